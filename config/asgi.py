@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from tg_bots.webhook import TelegramLifespan  # noqa: E402  (после настройки Django)
+
+# Боты из TELEGRAM_WEBHOOK_BOTS запускаются и останавливаются вместе с ASGI-воркером
+application = TelegramLifespan(django_application)
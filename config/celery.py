@@ -1,6 +1,7 @@
 import os
 import logging
 from celery import Celery
+from celery.signals import worker_process_shutdown
 
 # Установка переменной окружения Django
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
@@ -18,3 +19,9 @@ app.autodiscover_tasks()
 @app.task(bind=True)
 def debug_task(self):
     logger.info(f"Request: {self.request!r}")
+
+@worker_process_shutdown.connect
+def close_bot_pool(**kwargs):
+    # Закрываем HTTPX-соединения Bot-клиентов при остановке процесса воркера
+    from core.utils import bot_pool
+    bot_pool.shutdown()
@@ -30,6 +30,8 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    # индексы с классами операторов (OpClass) в core.models
+    "django.contrib.postgres",
     # проект
     "core",
     # celery-результаты
@@ -145,6 +147,13 @@ TELEGRAM_BOT_TOKEN_PRIVATE = os.getenv("TELEGRAM_BOT_TOKEN_PRIVATE")
 if not TELEGRAM_BOT_TOKEN_PRIVATE:
     raise ValueError("TELEGRAM_BOT_TOKEN_PRIVATE is missing! Please add it to .env file.")
 
+# Адрес Bot API; можно направить ботов на локальный сервер (например, фейковый Telegram в тестах)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+# Боты, которые получают апдейты вебхуком через ASGI (private, course); остальные работают через polling
+TELEGRAM_WEBHOOK_BOTS = [b.strip() for b in os.getenv("TELEGRAM_WEBHOOK_BOTS", "").split(",") if b.strip()]
+# Секрет, который Telegram присылает в X-Telegram-Bot-Api-Secret-Token
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+
 # ------------------------------------------------------------------------------
 #  CELERY
 # ------------------------------------------------------------------------------
@@ -154,6 +163,82 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = TIME_ZONE
+# Периодические задачи (нужен запущенный celery beat)
+CELERY_BEAT_SCHEDULE = {
+    "resume-stalled-broadcasts": {
+        "task": "core.tasks.resume_stalled_broadcasts",
+        "schedule": 60.0,
+    },
+    "reconcile-vote-tallies": {
+        "task": "core.tasks.reconcile_vote_tallies",
+        "schedule": 600.0,
+    },
+    "rollup-client-actions": {
+        "task": "core.tasks.rollup_client_actions",
+        "schedule": 300.0,
+    },
+    "client-action-partitions": {
+        "task": "core.tasks.maintain_client_action_partitions",
+        "schedule": 6 * 3600.0,
+    },
+}
+
+# ------------------------------------------------------------------------------
+#  РАССЫЛКИ
+# ------------------------------------------------------------------------------
+# Сколько отправок держать в полёте одновременно
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+# Глобальный лимит сообщений в секунду на бота (Telegram разрешает ~30)
+BROADCAST_RATE_LIMIT = float(os.getenv("BROADCAST_RATE_LIMIT", "25"))
+# Redis, в котором шарды одной рассылки делят общий лимит
+BROADCAST_RATE_REDIS_URL = os.getenv("BROADCAST_RATE_REDIS_URL", CELERY_BROKER_URL)
+# Минимальный интервал между сообщениями в один чат, сек
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1"))
+# Статусы доставок пишутся пачками: по размеру пачки или раз в N секунд
+BROADCAST_DB_BATCH_SIZE = int(os.getenv("BROADCAST_DB_BATCH_SIZE", "500"))
+BROADCAST_DB_FLUSH_INTERVAL = float(os.getenv("BROADCAST_DB_FLUSH_INTERVAL", "2"))
+# Если рассылка не подавала признаков жизни дольше этого времени, она считается упавшей и продолжается
+BROADCAST_LEASE_SECONDS = int(os.getenv("BROADCAST_LEASE_SECONDS", "300"))
+# Выборки клиентов больше этого числа добавляются в рассылку фоновой задачей, пачками по ATTACH_BATCH_SIZE
+ATTACH_SYNC_LIMIT = int(os.getenv("ATTACH_SYNC_LIMIT", "5000"))
+ATTACH_BATCH_SIZE = int(os.getenv("ATTACH_BATCH_SIZE", "5000"))
+# CSV-выгрузки из админки больше этого числа строк (по оценке планировщика) собираются Celery в EXPORT_ROOT
+EXPORT_SYNC_LIMIT = int(os.getenv("EXPORT_SYNC_LIMIT", "200000"))
+EXPORT_ROOT = MEDIA_ROOT / "exports"
+
+# ------------------------------------------------------------------------------
+#  ЖУРНАЛ ДЕЙСТВИЙ КЛИЕНТОВ
+# ------------------------------------------------------------------------------
+# Действия копятся в памяти бота и пишутся в БД пачкой: раз в интервал или по достижении размера пачки
+ACTION_LOG_FLUSH_INTERVAL_MS = int(os.getenv("ACTION_LOG_FLUSH_INTERVAL_MS", "500"))
+ACTION_LOG_BATCH_SIZE = int(os.getenv("ACTION_LOG_BATCH_SIZE", "200"))
+# Сюда откладываются действия, пока БД недоступна
+ACTION_LOG_SPOOL = os.getenv("ACTION_LOG_SPOOL", str(BASE_DIR / "logs" / "client_actions.spool.jsonl"))
+# Партиции по месяцам: на сколько месяцев вперёд держать готовые партиции
+CLIENT_ACTION_PARTITIONS_AHEAD = int(os.getenv("CLIENT_ACTION_PARTITIONS_AHEAD", "3"))
+# Партиции старше стольких месяцев отсоединяются и уходят в архив (0 — хранить всё в БД)
+CLIENT_ACTION_RETENTION_MONTHS = int(os.getenv("CLIENT_ACTION_RETENTION_MONTHS", "12"))
+CLIENT_ACTION_ARCHIVE_DIR = Path(os.getenv("CLIENT_ACTION_ARCHIVE_DIR", BASE_DIR / "archive" / "client_actions"))
+# Агрегаты воронки и активности досчитываются пачками по столько id журнала
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "50000"))
+
+# ------------------------------------------------------------------------------
+#  КЭШ КЛИЕНТОВ В БОТАХ
+# ------------------------------------------------------------------------------
+CLIENT_CACHE_SIZE = int(os.getenv("CLIENT_CACHE_SIZE", "10000"))
+CLIENT_CACHE_TTL = int(os.getenv("CLIENT_CACHE_TTL", "300"))
+# Redis, через который админка рассылает ботам инвалидации клиентов и аудио голосований
+CLIENT_CACHE_REDIS_URL = os.getenv("CLIENT_CACHE_REDIS_URL", CELERY_BROKER_URL)
+# Повторный /start с тем же профилем в пределах этого окна (сек) не пишет в БД
+CLIENT_UPSERT_WINDOW = int(os.getenv("CLIENT_UPSERT_WINDOW", "5"))
+
+# ------------------------------------------------------------------------------
+#  ОБРАБОТКА АПДЕЙТОВ
+# ------------------------------------------------------------------------------
+# Сколько апдейтов приватный бот обрабатывает одновременно (апдейты одного чата — всегда по очереди)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "32"))
+# Redis, куда боты публикуют состояние очередей апдейтов для страницы мониторинга
+BOT_STATS_REDIS_URL = os.getenv("BOT_STATS_REDIS_URL", CELERY_BROKER_URL)
 
 # ------------------------------------------------------------------------------
 #  ЛОГИРОВАНИЕ
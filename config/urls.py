@@ -2,12 +2,15 @@ from django.contrib import admin
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
-from core.views import monitoring_page, metrics_api, check_access_view
+from core.views import analytics_page, monitoring_page, metrics_api, check_access_view
+from tg_bots.webhook import telegram_webhook
 
 urlpatterns = [
     path('adminka-193n/performance/', monitoring_page, name='admin_monitoring'),
     path('adminka-193n/monitor/api/', metrics_api, name='metrics_api'),
+    path('adminka-193n/analytics/', analytics_page, name='admin_analytics'),
     path('api/check-access/', check_access_view, name='check_access'),
+    path('tg/<str:bot_name>/', telegram_webhook, name='telegram_webhook'),
     path('adminka-193n/', admin.site.urls),
 ]
 
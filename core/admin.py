@@ -1,21 +1,27 @@
 import asyncio
-import csv
 import json
+import os
 import logging
 import sys
 import time
 import traceback
 
+from celery.result import AsyncResult
+from django.conf import settings
 from django.contrib import admin, messages
-from django.http import HttpResponse, HttpResponseRedirect
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.http import FileResponse, Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect
 from django.template.response import TemplateResponse
 from django.urls import path, reverse
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
 from telegram import InputMediaPhoto
 
 from .forms import BroadcastAttachForm, BroadcastMessageForm
 from .models import (
+    AudienceSegment,
     BroadcastDelivery,
     BroadcastMessage,
     BroadcastPhoto,
@@ -26,6 +32,7 @@ from .models import (
     SupportMessage,
     TelegramClient,
 )
+from .utils import exports, recipients, selection, votes
 
 logger = logging.getLogger("broadcast")
 if not logger.handlers:
@@ -36,12 +43,121 @@ if not logger.handlers:
     logger.info("✅ Логгер инициализирован в stdout")
 
 
-class BroadcastDeliveryInline(admin.TabularInline):
-    model = BroadcastDelivery
-    extra = 0
-    readonly_fields = ("recipient", "status", "sent_at", "error_message")
-    can_delete = False
-    show_change_link = True
+DELIVERY_PAGE_SIZE = 50
+
+
+def delivery_page(request, deliveries):
+    """
+    Страница доставок для панели на странице рассылки или клиента: keyset-пагинация по id
+    (курсор ?after=<id>), фильтр ?status=. Без курсора в ответ добавляются итоги по статусам —
+    одним GROUP BY, без загрузки строк.
+    """
+    data = {}
+    if not request.GET.get("after"):
+        data["totals"] = dict(
+            deliveries.order_by().values_list("status").annotate(n=Count("*")).values_list("status", "n")
+        )
+        data["labels"] = dict(BroadcastDelivery._meta.get_field("status").choices)
+    status = request.GET.get("status")
+    if status:
+        deliveries = deliveries.filter(status=status)
+    after = request.GET.get("after")
+    if after and after.isdigit():
+        deliveries = deliveries.filter(id__lt=int(after))
+    rows = list(
+        deliveries.select_related("message", "recipient").order_by("-id")[: DELIVERY_PAGE_SIZE + 1]
+    )
+    data["results"] = [
+        {
+            "id": d.id,
+            "message": f"#{d.message_id} — {d.message.comment or ''}",
+            "message_url": reverse("admin:core_broadcastmessage_change", args=[d.message_id]),
+            "recipient": str(d.recipient),
+            "recipient_url": reverse("admin:core_telegramclient_change", args=[d.recipient_id]),
+            "status": d.status,
+            "status_display": d.get_status_display(),
+            "sent_at": d.sent_at.isoformat() if d.sent_at else None,
+            "error_message": d.error_message or "",
+        }
+        for d in rows[:DELIVERY_PAGE_SIZE]
+    ]
+    data["next"] = rows[DELIVERY_PAGE_SIZE - 1].id if len(rows) > DELIVERY_PAGE_SIZE else None
+    return JsonResponse(data)
+
+
+RECIPIENT_PAGE_SIZE = 20
+
+
+def recipient_page(request, clients):
+    after = request.GET.get("after")
+    if after and after.isdigit():
+        clients = clients.filter(id__lt=int(after))
+    rows = list(clients.order_by("-id").values("id", "user_id", "username", "first_name")[: RECIPIENT_PAGE_SIZE + 1])
+    page = rows[:RECIPIENT_PAGE_SIZE]
+    return JsonResponse({
+        "results": [
+            {"id": r["id"], "text": f"@{r['username']}" if r["username"] else f"{r['first_name'] or ''} ({r['user_id']})"}
+            for r in page
+        ],
+        "next": page[-1]["id"] if len(rows) > RECIPIENT_PAGE_SIZE else None,
+    })
+
+
+class CsvExportMixin:
+    """
+    Действие «Экспортировать в CSV» для больших таблиц: ответ стримится из серверного курсора
+    (values_list по ``export_columns``). Если по оценке планировщика строк больше EXPORT_SYNC_LIMIT,
+    выгрузка уходит в Celery и пишется в .csv.gz, который скачивается со страницы прогресса.
+    """
+
+    # (поле или lookup через __, заголовок колонки)
+    export_columns = ()
+
+    @admin.action(description="📤 Экспортировать в CSV")
+    def export_csv(self, request, queryset):
+        opts = self.model._meta
+        if recipients.estimate_count(queryset) > settings.EXPORT_SYNC_LIMIT:
+            task = export_csv_task.delay(selection.dump_selection(self, request), self.export_columns, opts.model_name)
+            messages.info(request, "⏳ Выгрузка большая — она собирается в фоне.")
+            return redirect(reverse(f"admin:{opts.app_label}_{opts.model_name}_export", args=[task.id]))
+        response = StreamingHttpResponse(
+            exports.stream_csv(queryset, self.export_columns), content_type="text/csv; charset=utf-8"
+        )
+        response["Content-Disposition"] = f'attachment; filename="{opts.model_name}.csv"'
+        return response
+
+    def get_urls(self):
+        opts = self.model._meta
+        custom = [
+            path(
+                "export/<str:task_id>/",
+                self.admin_site.admin_view(self.export_progress),
+                name=f"{opts.app_label}_{opts.model_name}_export",
+            ),
+        ]
+        return custom + super().get_urls()
+
+    def export_progress(self, request, task_id):
+        """Прогресс фоновой выгрузки (?json=1) и скачивание готового файла (?download=1)."""
+        if "download" in request.GET or "json" in request.GET:
+            result = AsyncResult(task_id)
+            info = result.info if isinstance(result.info, dict) else {}
+            if "json" in request.GET:
+                return JsonResponse({"state": result.state, **info})
+            if result.state != "SUCCESS":
+                raise Http404
+            filepath = os.path.join(settings.EXPORT_ROOT, os.path.basename(info["file"]))
+            if not os.path.exists(filepath):
+                raise Http404
+            return FileResponse(open(filepath, "rb"), as_attachment=True, filename=os.path.basename(filepath))
+        context = {
+            **self.admin_site.each_context(request),
+            "title": f"Выгрузка: {self.model._meta.verbose_name_plural}",
+            "progress_url": f"{request.path}?json=1",
+            "download_url": f"{request.path}?download=1",
+            "changelist_url": reverse(f"admin:{self.model._meta.app_label}_{self.model._meta.model_name}_changelist"),
+        }
+        return TemplateResponse(request, "admin/export_progress.html", context)
 
 
 class BroadcastPhotoInline(admin.TabularInline):
@@ -57,29 +173,29 @@ class BroadcastAudioInline(admin.TabularInline):
     fields = ("choice_number", "caption", "file", "custom_filename")
 
 
-class BroadcastVoteInline(admin.TabularInline):
-    model = BroadcastVote
-    extra = 0
-    readonly_fields = ("client", "choice_number", "voice_file", "created_at")
-    can_delete = False
-
-
 @admin.action(description="📨 Добавить в рассылку")
 def attach_to_broadcast(modeladmin, request, queryset):
+    select_across = request.POST.get("select_across") == "1"
     if "apply" in request.POST:
         form = BroadcastAttachForm(request.POST)
         if form.is_valid():
             broadcast = form.cleaned_data["broadcast"]
-            before = broadcast.recipients.count()
-            broadcast.recipients.add(*queryset)
-            added = broadcast.recipients.count() - before
-            messages.success(request, f"✅ Добавлено {added} клиентов в рассылку.")
-            return HttpResponseRedirect(request.get_full_path())
+            total = queryset.count()
+            if total <= settings.ATTACH_SYNC_LIMIT:
+                added = recipients.attach_recipients(broadcast.pk, queryset)
+                messages.success(request, f"✅ Добавлено {added} клиентов в рассылку.")
+                return HttpResponseRedirect(request.get_full_path())
+            task = attach_recipients_task.delay(broadcast.pk, selection.dump_selection(modeladmin, request))
+            messages.info(request, f"⏳ {total} клиентов добавляются в рассылку #{broadcast.pk} в фоне.")
+            return redirect(reverse("admin:attach_progress", args=[task.id]))
     else:
         form = BroadcastAttachForm()
 
     context = {
-        "clients": queryset,
+        "clients": queryset[:20],
+        "count": queryset.count(),
+        "select_across": select_across,
+        "selected_ids": [] if select_across else request.POST.getlist(admin.helpers.ACTION_CHECKBOX_NAME),
         "form": form,
         "title": "Выбери рассылку для добавления клиентов",
         "action_checkbox_name": admin.helpers.ACTION_CHECKBOX_NAME,
@@ -88,8 +204,8 @@ def attach_to_broadcast(modeladmin, request, queryset):
 
 
 @admin.register(TelegramClient)
-class TelegramClientAdmin(admin.ModelAdmin):
-    actions = [attach_to_broadcast]
+class TelegramClientAdmin(CsvExportMixin, admin.ModelAdmin):
+    actions = [attach_to_broadcast, "export_csv"]
     list_display = (
         "user_id",
         "username",
@@ -103,37 +219,134 @@ class TelegramClientAdmin(admin.ModelAdmin):
     )
     list_filter = ("bot_source", "created_at", "is_blocked", "is_course_paid")  # ← исправлено
     search_fields = ("username", "first_name", "last_name", "user_id")
-    inlines = [BroadcastDeliveryInline]
     ordering = ("-created_at",)
+    export_columns = (
+        ("id", "ID"),
+        ("user_id", "User ID"),
+        ("username", "Username"),
+        ("first_name", "First name"),
+        ("last_name", "Last name"),
+        ("bot_source", "Bot"),
+        ("is_blocked", "Blocked"),
+        ("is_course_paid", "Course paid"),
+        ("created_at", "Created At"),
+        ("broadcast_count", "Broadcasts"),
+    )
+
+    def get_queryset(self, request):
+        # Счётчик и последние рассылки считаются для всей страницы разом, а не запросом на строку
+        deliveries = BroadcastDelivery.objects.filter(recipient=OuterRef("pk")).order_by()
+        recent = (
+            BroadcastDelivery.objects.select_related("message")
+            .annotate(rank=Window(RowNumber(), partition_by=F("recipient"), order_by=F("sent_at").desc()))
+            .filter(rank__lte=3)
+            .order_by("-sent_at")
+        )
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(
+                broadcast_count=Coalesce(
+                    Subquery(deliveries.values("recipient").annotate(c=Count("*")).values("c")), 0
+                )
+            )
+            .prefetch_related(Prefetch("broadcastdelivery_set", queryset=recent, to_attr="recent_deliveries"))
+        )
 
     def broadcast_count(self, obj):
-        return obj.broadcastdelivery_set.count()
+        return obj.broadcast_count
 
     broadcast_count.short_description = "Получено рассылок"
+    broadcast_count.admin_order_field = "broadcast_count"
 
     def last_broadcasts(self, obj):
-        deliveries = obj.broadcastdelivery_set.select_related("message").order_by("-sent_at")[:3]
-        if not deliveries:
+        if not obj.recent_deliveries:
             return "—"
-        return format_html(
-            "<br>".join(
-                [
-                    f'<a href="/admin/core/broadcastmessage/{d.message.id}/change/">#{d.message.id} — {d.message.comment}</a>'
-                    for d in deliveries
-                ]
-            )
+        return format_html_join(
+            mark_safe("<br>"),
+            '<a href="{}">#{} — {}</a>',
+            (
+                (reverse("admin:core_broadcastmessage_change", args=[d.message_id]), d.message_id, d.message.comment)
+                for d in obj.recent_deliveries
+            ),
         )
 
     last_broadcasts.short_description = "Последние рассылки"
-    last_broadcasts.allow_tags = True
+
+    def get_urls(self):
+        custom = [
+            path(
+                "deliveries/<int:pk>/",
+                self.admin_site.admin_view(self.deliveries),
+                name="client_deliveries",
+            ),
+            path(
+                "attach/<str:task_id>/",
+                self.admin_site.admin_view(self.attach_progress),
+                name="attach_progress",
+            ),
+        ]
+        return custom + super().get_urls()
+
+    def deliveries(self, request, pk):
+        return delivery_page(request, BroadcastDelivery.objects.filter(recipient_id=pk))
+
+    def attach_progress(self, request, task_id):
+        """Прогресс фонового добавления клиентов в рассылку: страница, которая опрашивает себя же с ?json=1."""
+        if "json" in request.GET:
+            result = AsyncResult(task_id)
+            info = result.info if isinstance(result.info, dict) else {}
+            return JsonResponse({"state": result.state, **info})
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Добавление клиентов в рассылку",
+            "progress_url": f"{request.path}?json=1",
+            "changelist_url": reverse("admin:core_telegramclient_changelist"),
+        }
+        return TemplateResponse(request, "admin/attach_progress.html", context)
 
 
 @admin.register(ClientAction)
-class ClientActionAdmin(admin.ModelAdmin):
+class ClientActionAdmin(CsvExportMixin, admin.ModelAdmin):
     list_display = ("client", "action", "timestamp")
     list_filter = ("action", "timestamp")
     search_fields = ("client__username", "action")
     ordering = ("-timestamp",)
+    # таблица партиционирована по месяцам: фильтр по дате читает только нужные партиции
+    date_hierarchy = "timestamp"
+    list_select_related = ("client",)
+    show_full_result_count = False
+    actions = ["export_csv"]
+    export_columns = (
+        ("id", "ID"),
+        ("client__user_id", "User ID"),
+        ("client__username", "Username"),
+        ("action", "Action"),
+        ("timestamp", "Timestamp"),
+    )
+
+
+@admin.register(BroadcastDelivery)
+class BroadcastDeliveryAdmin(CsvExportMixin, admin.ModelAdmin):
+    list_display = ("message", "recipient", "status", "sent_at")
+    list_filter = ("status", "sent_at")
+    search_fields = ("recipient__username", "recipient__user_id")
+    list_select_related = ("message", "recipient")
+    raw_id_fields = ("message", "recipient")
+    ordering = ("-id",)
+    actions = ["export_csv"]
+    export_columns = (
+        ("id", "ID"),
+        ("message_id", "Broadcast ID"),
+        ("recipient__user_id", "User ID"),
+        ("recipient__username", "Username"),
+        ("status", "Status"),
+        ("sent_at", "Sent At"),
+        ("error_message", "Error"),
+    )
+
+    def has_add_permission(self, request):
+        return False
 
 
 @admin.register(PaymentUpload)
@@ -159,24 +372,87 @@ class SupportMessageAdmin(admin.ModelAdmin):
     ordering = ("-timestamp",)
 
 
-from core.tasks import send_broadcast as send_broadcast_task
+@admin.register(AudienceSegment)
+class AudienceSegmentAdmin(admin.ModelAdmin):
+    list_display = ("name", "bot_source", "is_course_paid", "is_blocked", "active_within_days", "estimated_clients", "created_at")
+    search_fields = ("name",)
+    ordering = ("name",)
+    readonly_fields = ("estimated_clients",)
+
+    def estimated_clients(self, obj):
+        if not obj.pk:
+            return "—"
+        return f"≈ {recipients.estimate_count(obj.clients())}"
+
+    estimated_clients.short_description = "Клиентов (оценка)"
+
+
+@admin.register(BroadcastVote)
+class BroadcastVoteAdmin(admin.ModelAdmin):
+    list_display = ("message", "client", "choice_number", "created_at")
+    list_filter = ("choice_number", "created_at")
+    search_fields = ("client__username", "client__user_id")
+    list_select_related = ("message", "client")
+    raw_id_fields = ("message", "client")
+    readonly_fields = ("message", "client", "choice_number", "voice_file", "created_at")
+    ordering = ("-created_at",)
+
+    def has_add_permission(self, request):
+        return False
+
+
+from core.tasks import (
+    attach_recipients as attach_recipients_task,
+    export_csv as export_csv_task,
+    send_broadcast as send_broadcast_task,
+)
 
 
 @admin.register(BroadcastMessage)
-class BroadcastMessageAdmin(admin.ModelAdmin):
+class BroadcastMessageAdmin(CsvExportMixin, admin.ModelAdmin):
     form = BroadcastMessageForm
-    list_display = ("id", "short_text", "comment", "created_at", "sent", "send_button")
+    list_display = (
+        "id",
+        "short_text",
+        "comment",
+        "created_at",
+        "sent",
+        "ok_count",
+        "failed_count",
+        "blocked_count",
+        "send_button",
+    )
     search_fields = ("text", "comment")
-    list_filter = ("sent", "created_at")
+    list_filter = ("sent", "created_at", "segment")
+    readonly_fields = ("audience_estimate",)
     ordering = ("-created_at",)
     actions = ["export_csv"]
+    export_columns = (
+        ("id", "ID"),
+        ("comment", "Comment"),
+        ("text", "Text"),
+        ("created_at", "Created At"),
+        ("sent", "Sent"),
+        ("ok_count", "OK"),
+        ("failed_count", "Failed"),
+        ("blocked_count", "Blocked"),
+    )
     inlines = [
-        BroadcastDeliveryInline,
         BroadcastPhotoInline,
         BroadcastAudioInline,
-        BroadcastVoteInline,
     ]
 
+    def audience_estimate(self, obj):
+        """Сколько получателей будет у рассылки: точное число из списка плюс оценка по сегменту."""
+        if not obj.pk:
+            return "—"
+        parts = [f"{obj.recipients.count()} в списке получателей"]
+        if obj.segment_id:
+            parts.append(f"≈ {recipients.estimate_count(obj.segment.clients())} в сегменте «{obj.segment}»")
+        return " + ".join(parts)
+
+    audience_estimate.short_description = "Аудитория"
+
     def short_text(self, obj):
         return obj.text[:40] + "..." if len(obj.text) > 40 else obj.text
 
@@ -188,7 +464,10 @@ class BroadcastMessageAdmin(admin.ModelAdmin):
                 '<a class="button" href="{}">Отправить сейчас</a>',
                 reverse("admin:send_broadcast", args=[obj.pk]),
             )
-        return "Отправлено"
+        return format_html(
+            'Отправлено <a class="button" href="{}">Дослать новым</a>',
+            reverse("admin:send_broadcast", args=[obj.pk]),
+        )
 
     send_button.short_description = "Действие"
 
@@ -200,20 +479,75 @@ class BroadcastMessageAdmin(admin.ModelAdmin):
                 self.admin_site.admin_view(self.send_broadcast),
                 name="send_broadcast",
             ),
+            path(
+                "votes/<int:pk>/",
+                self.admin_site.admin_view(self.vote_results),
+                name="broadcast_vote_results",
+            ),
+            path(
+                "deliveries/<int:pk>/",
+                self.admin_site.admin_view(self.deliveries),
+                name="broadcast_deliveries",
+            ),
+            path(
+                "recipients/search/",
+                self.admin_site.admin_view(self.recipient_search),
+                name="broadcast_recipient_search",
+            ),
+            path(
+                "recipients/<int:pk>/",
+                self.admin_site.admin_view(self.recipient_list),
+                name="broadcast_recipient_list",
+            ),
         ]
         return custom + urls
 
+    def deliveries(self, request, pk):
+        return delivery_page(request, BroadcastDelivery.objects.filter(message_id=pk))
+
+    def recipient_search(self, request):
+        """
+        Поиск клиентов для выбора получателей: число ищется по user_id, текст — по началу username,
+        чтобы запрос шёл по индексам. Keyset-пагинация по id (?after=<id>).
+        """
+        q = request.GET.get("q", "").strip().lstrip("@")
+        clients = TelegramClient.objects.all()
+        if q.isdigit():
+            clients = clients.filter(user_id=int(q))
+        elif q:
+            clients = clients.filter(username__istartswith=q)
+        return recipient_page(request, clients)
+
+    def recipient_list(self, request, pk):
+        """Текущие получатели рассылки постранично — для просмотра и удаления по одному."""
+        return recipient_page(request, TelegramClient.objects.filter(broadcastmessage__id=pk))
+
     def send_broadcast(self, request, pk):
         msg = BroadcastMessage.objects.get(pk=pk)
+        if msg.is_running():
+            messages.warning(request, f"⏳ Рассылка #{msg.id} уже идёт — повторно не ставим.")
+            return redirect(reverse("admin:core_broadcastmessage_changelist"))
         send_broadcast_task.delay(pk)
 
+        if msg.sent:
+            # Повтор не шлёт заново тем, у кого уже есть доставка: только новым получателям и застрявшим в очереди
+            messages.success(
+                request,
+                f"🔁 Рассылка #{msg.id} уже отправлялась — дошлём только получателям, "
+                f"до которых она ещё не доходила (аудитория: {self.audience_estimate(msg)})",
+            )
+            return redirect(reverse("admin:core_broadcastmessage_changelist"))
         messages.success(
             request,
             f"🚀 Рассылка #{msg.id} поставлена в очередь Celery "
-            f"({msg.recipients.count()} получателей)",
+            f"(аудитория: {self.audience_estimate(msg)})",
         )
         return redirect(reverse("admin:core_broadcastmessage_changelist"))
 
+    def vote_results(self, request, pk):
+        """Итоги голосования из счётчиков BroadcastVoteTally — для панели на странице рассылки."""
+        return JsonResponse(votes.vote_results(pk))
+
     def run_async(self, coro):
         try:
             loop = asyncio.get_event_loop()
@@ -224,17 +558,3 @@ class BroadcastMessageAdmin(admin.ModelAdmin):
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             return loop.run_until_complete(coro)
-
-    def export_csv(self, request, queryset):
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = 'attachment; filename="broadcasts.csv"'
-
-        writer = csv.writer(response)
-        writer.writerow(["ID", "Comment", "Text", "Created At", "Sent"])
-
-        for obj in queryset:
-            writer.writerow([obj.id, obj.comment, obj.text, obj.created_at, obj.sent])
-
-        return response
-
-    export_csv.short_description = "📤 Экспортировать в CSV"
@@ -1,10 +1,61 @@
 from django import forms
+from django.urls import reverse
 from .models import BroadcastMessage, TelegramClient
+from .utils.recipients import attach_recipient_ids
 import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+class RecipientPickerWidget(forms.Widget):
+    """
+    Вместо <select> со всеми клиентами: поиск по клиентам через AJAX, счётчик выбранных и
+    постраничный просмотр текущих получателей. В форму уходят только изменения — {"add": [...], "remove": [...]}.
+    """
+    template_name = "admin/recipient_picker.html"
+
+    def __init__(self, attrs=None):
+        super().__init__(attrs)
+        self.broadcast = None
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        broadcast = self.broadcast
+        context["widget"].update({
+            "count": broadcast.recipients.count() if broadcast and broadcast.pk else 0,
+            "search_url": reverse("admin:broadcast_recipient_search"),
+            "list_url": reverse("admin:broadcast_recipient_list", args=[broadcast.pk]) if broadcast and broadcast.pk else "",
+        })
+        return context
+
+
+class RecipientChangesField(forms.Field):
+    widget = RecipientPickerWidget
+
+    def to_python(self, value):
+        if not value:
+            return {"add": [], "remove": []}
+        try:
+            data = json.loads(value)
+            return {key: sorted({int(pk) for pk in data.get(key, [])}) for key in ("add", "remove")}
+        except (ValueError, TypeError, AttributeError):
+            raise forms.ValidationError("Некорректный список получателей.")
+
+    def clean(self, value):
+        changes = super().clean(value)
+        # id приходят из браузера: неизвестный клиент — ошибка формы, а не IntegrityError при сохранении
+        ids = set(changes["add"]) | set(changes["remove"])
+        if ids:
+            unknown = ids - set(TelegramClient.objects.filter(pk__in=ids).values_list("pk", flat=True))
+            if unknown:
+                raise forms.ValidationError(
+                    "Неизвестные клиенты: %(ids)s.",
+                    params={"ids": ", ".join(map(str, sorted(unknown)))},
+                )
+        return changes
+
+
 class BroadcastMessageForm(forms.ModelForm):
     button_texts = forms.CharField(
         label="Текст кнопок (через |||)",
@@ -26,12 +77,15 @@ class BroadcastMessageForm(forms.ModelForm):
         required=False,
         widget=forms.Textarea(attrs={"rows": 4, "class": "vLargeTextField"})
     )
+    recipient_changes = RecipientChangesField(label="Получатели", required=False)
+    clear_recipients = forms.BooleanField(label="Очистить список получателей", required=False)
 
     class Meta:
         model = BroadcastMessage
         fields = [
             "text", "text_after_media", "comment",
-            "recipients", "sent", "buttons_json"
+            "recipient_changes", "clear_recipients", "segment", "sent", "buttons_json",
+            "shard_size", "shard_parallelism"
         ]
         widgets = {
             "buttons_json": forms.HiddenInput()
@@ -43,7 +97,7 @@ class BroadcastMessageForm(forms.ModelForm):
         if "photo" in self.fields:
             del self.fields["photo"]
 
-        self.fields["recipients"].queryset = TelegramClient.objects.order_by("bot_source")
+        self.fields["recipient_changes"].widget.broadcast = self.instance
         self.initial["button_texts"] = ""
         self.initial["button_urls"] = ""
         self.initial["button_types"] = ""
@@ -94,6 +148,17 @@ class BroadcastMessageForm(forms.ModelForm):
 
         return cleaned_data
 
+    def _save_m2m(self):
+        super()._save_m2m()
+        # Пишем только разницу: список получателей целиком через форму не передаётся
+        changes = self.cleaned_data.get("recipient_changes") or {"add": [], "remove": []}
+        if self.cleaned_data.get("clear_recipients"):
+            self.instance.recipients.clear()
+        elif changes["remove"]:
+            self.instance.recipients.remove(*changes["remove"])
+        if changes["add"]:
+            attach_recipient_ids(self.instance.pk, changes["add"])
+
     def save(self, commit=True):
         instance = super().save(commit=False)
         instance.buttons_json = self.cleaned_data.get("buttons_json", "")
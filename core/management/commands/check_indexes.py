@@ -0,0 +1,107 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from core.models import BroadcastDelivery, BroadcastMessage, ClientAction, TelegramClient
+
+
+def hot_queries():
+    """(название, queryset, индекс, который он должен использовать) — запросы с горячих путей ботов и админки."""
+    return [
+        (
+            "check_access_view",
+            TelegramClient.objects.filter(user_id=0, is_course_paid=True),
+            "client_paid_user_idx",
+        ),
+        (
+            "кнопка «Послание» (get_message)",
+            BroadcastMessage.objects.filter(comment="Послание для меню").order_by("pk")[:1],
+            "broadcast_comment_idx",
+        ),
+        (
+            "поиск получателей по username",
+            TelegramClient.objects.filter(username__istartswith="ab").order_by("-id")[:21],
+            "client_username_upper_idx",
+        ),
+        (
+            "фильтры клиентов в админке",
+            TelegramClient.objects.filter(bot_source="private", is_blocked=False),
+            "client_source_blocked_idx",
+        ),
+        (
+            "список клиентов по дате",
+            TelegramClient.objects.order_by("-created_at")[:100],
+            "client_created_idx",
+        ),
+        (
+            "история действий клиента",
+            ClientAction.objects.filter(client_id=0).order_by("-timestamp")[:50],
+            "action_client_ts_idx",
+        ),
+        (
+            "активность в сегменте",
+            TelegramClient.objects.filter(
+                Exists(ClientAction.objects.filter(client=OuterRef("pk"), timestamp__gte=timezone.now()))
+            ).filter(user_id=0),
+            "action_client_ts_idx",
+        ),
+        (
+            "последние рассылки клиента",
+            BroadcastDelivery.objects.filter(recipient_id=0).order_by("-sent_at")[:3],
+            "delivery_recipient_sent_idx",
+        ),
+        (
+            "claim_deliveries",
+            BroadcastDelivery.objects.filter(message_id=0, status="pending").order_by("recipient_id").values("id")[:500],
+            "delivery_message_status_idx",
+        ),
+    ]
+
+
+def _index_names(plan):
+    names = set()
+    if "Index Name" in plan:
+        names.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        names |= _index_names(child)
+    return names
+
+
+def used_indexes(queryset):
+    """
+    Индексы в плане запроса. Последовательное сканирование выключается: на маленькой (тестовой) базе
+    планировщик всегда выберет seq scan, а проверяется, что подходящий индекс вообще применим.
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = json.loads(queryset.explain(format="json"))
+    names = _index_names(plan[0]["Plan"])
+    if not names:
+        return names
+    # У партиционированной таблицы в плане индексы партиций — сводим их к индексу родителя
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COALESCE(pg_partition_root(i)::text, i) FROM unnest(%s::text[]) AS i",
+            [sorted(names)],
+        )
+        return {name for (name,) in cursor.fetchall()}
+
+
+class Command(BaseCommand):
+    help = "Проверяет через EXPLAIN, что запросы с горячих путей используют свои индексы"
+
+    def handle(self, *args, **options):
+        failed = []
+        for name, queryset, index in hot_queries():
+            used = used_indexes(queryset)
+            if index in used:
+                self.stdout.write(self.style.SUCCESS(f"✅ {name}: {index}"))
+            else:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f"❌ {name}: ожидался {index}, в плане {sorted(used) or 'нет индексов'}"))
+        if failed:
+            raise CommandError(f"Без своего индекса: {', '.join(failed)}")
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.utils import partitions
+
+
+class Command(BaseCommand):
+    help = "Создаёт партиции журнала действий клиентов на следующие месяцы и архивирует вышедшие из окна хранения"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ahead", type=int, default=settings.CLIENT_ACTION_PARTITIONS_AHEAD,
+                            help="На сколько месяцев вперёд создавать партиции")
+        parser.add_argument("--retention-months", type=int, default=settings.CLIENT_ACTION_RETENTION_MONTHS,
+                            help="Сколько месяцев хранить в БД (0 — не архивировать)")
+        parser.add_argument("--archive-dir", default=str(settings.CLIENT_ACTION_ARCHIVE_DIR))
+
+    def handle(self, *args, **options):
+        created, archived = partitions.maintain(options["ahead"], options["retention_months"], options["archive_dir"])
+        for name in created:
+            self.stdout.write(self.style.SUCCESS(f"🗂 Создана партиция {name}"))
+        for name, rows in archived:
+            self.stdout.write(self.style.SUCCESS(f"📦 {name}: {rows} строк в архиве"))
+        if not created and not archived:
+            self.stdout.write("Партиции в порядке, ничего делать не нужно")
@@ -0,0 +1,43 @@
+import itertools
+import time
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from tg_bots.fake_telegram import fake_update
+from tg_bots.webhook import BOTS, SECRET_HEADER
+
+
+class Command(BaseCommand):
+    help = "Фейковый Telegram: шлёт в вебхук бота апдейты с секретным заголовком, как это делает Telegram"
+
+    def add_arguments(self, parser):
+        parser.add_argument("bot", choices=list(BOTS))
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Адрес ASGI-сервера проекта")
+        parser.add_argument("--text", default="/start")
+        parser.add_argument("--callback", help="callback_data нажатой кнопки вместо текста")
+        parser.add_argument("--users", type=int, default=1, help="Сколько разных пользователей имитировать")
+        parser.add_argument("--repeat", type=int, default=1, help="Сколько апдейтов отправить от каждого")
+        parser.add_argument("--first-user-id", type=int, default=900000000)
+
+    def handle(self, *args, **options):
+        url = options["url"].rstrip("/") + reverse("telegram_webhook", args=[options["bot"]])
+        headers = {SECRET_HEADER[len("HTTP_"):].replace("_", "-"): settings.TELEGRAM_WEBHOOK_SECRET}
+        update_ids = itertools.count(int(time.time()))
+        started = time.monotonic()
+        statuses = {}
+        with httpx.Client(headers=headers, timeout=10) as client:
+            for _ in range(options["repeat"]):
+                for i in range(options["users"]):
+                    payload = fake_update(
+                        next(update_ids),
+                        options["first_user_id"] + i,
+                        text=None if options["callback"] else options["text"],
+                        callback_data=options["callback"],
+                    )
+                    status = client.post(url, json=payload).status_code
+                    statuses[status] = statuses.get(status, 0) + 1
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{sum(statuses.values())} апдейтов за {elapsed:.2f} c, ответы: {statuses}")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.utils import rollups
+
+
+class Command(BaseCommand):
+    help = "Досчитывает агрегаты воронки и активности по новым действиям клиентов (то же делает celery beat)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true", help="Пересчитать агрегаты с нуля")
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            lo, hi = rollups.rebuild()
+        else:
+            lo, hi = rollups.run(options["batch_size"])
+        if hi > lo:
+            self.stdout.write(self.style.SUCCESS(f"📈 Учтены действия с id {lo + 1} по {hi}"))
+        else:
+            self.stdout.write("Новых действий нет")
@@ -0,0 +1,44 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from telegram import Bot
+
+from tg_bots.webhook import BOTS
+
+
+class Command(BaseCommand):
+    help = "Регистрирует вебхук бота в Telegram (или удаляет его, возвращая бота к polling)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("bot", choices=list(BOTS))
+        parser.add_argument("base_url", nargs="?", help="Публичный адрес проекта, например https://crm.example.com")
+        parser.add_argument("--delete", action="store_true", help="Удалить вебхук")
+        parser.add_argument("--max-connections", type=int, default=40)
+
+    def handle(self, *args, **options):
+        name = options["bot"]
+        token = getattr(settings, BOTS[name][1])
+        if options["delete"]:
+            asyncio.run(self._delete(token))
+            self.stdout.write(self.style.SUCCESS(f"Вебхук бота {name} удалён"))
+            return
+        if not options["base_url"]:
+            raise CommandError("Укажите base_url")
+        if not settings.TELEGRAM_WEBHOOK_SECRET:
+            raise CommandError("TELEGRAM_WEBHOOK_SECRET не задан")
+        url = options["base_url"].rstrip("/") + reverse("telegram_webhook", args=[name])
+        asyncio.run(self._set(token, url, options["max_connections"]))
+        self.stdout.write(self.style.SUCCESS(f"Вебхук бота {name}: {url}"))
+
+    def _bot(self, token):
+        return Bot(token, base_url=f"{settings.TELEGRAM_API_URL}/bot")
+
+    async def _set(self, token, url, max_connections):
+        async with self._bot(token) as bot:
+            await bot.set_webhook(url, secret_token=settings.TELEGRAM_WEBHOOK_SECRET, max_connections=max_connections)
+
+    async def _delete(self, token):
+        async with self._bot(token) as bot:
+            await bot.delete_webhook()
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 03:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_telegramclient_is_course_paid'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='broadcastdelivery',
+            name='status',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('sent', 'Отправлено'), ('failed', 'Ошибка')], max_length=20),
+        ),
+    ]
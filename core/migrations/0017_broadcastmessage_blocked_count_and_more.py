@@ -0,0 +1,38 @@
+# Generated by Django 4.2.20 on 2026-10-18 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_alter_broadcastdelivery_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='blocked_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Заблокировали бота'),
+        ),
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='failed_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Ошибок'),
+        ),
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='ok_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Доставлено'),
+        ),
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='shard_parallelism',
+            field=models.PositiveSmallIntegerField(default=4, verbose_name='Шардов одновременно'),
+        ),
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='shard_size',
+            field=models.PositiveIntegerField(default=5000, verbose_name='Получателей в шарде'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-18 03:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_broadcastmessage_blocked_count_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Последний пульс рассылки'),
+        ),
+        migrations.AlterField(
+            model_name='broadcastdelivery',
+            name='status',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('sending', 'Отправляется'), ('sent', 'Отправлено'), ('failed', 'Ошибка'), ('blocked', 'Заблокировал бота')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-18 03:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_broadcastmessage_heartbeat_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='photo_file_id',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='broadcastphoto',
+            name='file_id',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+    ]
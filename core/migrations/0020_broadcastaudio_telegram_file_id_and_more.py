@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-18 03:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_broadcastmessage_photo_file_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcastaudio',
+            name='telegram_file_id',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='broadcastaudio',
+            name='telegram_filename',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.20 on 2026-10-18 03:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_broadcastaudio_telegram_file_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelegramMediaFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500, unique=True)),
+                ('signature', models.CharField(max_length=100)),
+                ('file_id', models.CharField(max_length=255)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Файл в Telegram',
+                'verbose_name_plural': 'Файлы в Telegram',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.20 on 2026-10-18 03:23
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_telegrammediafile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='clientaction',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.20 on 2026-10-18 03:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_alter_clientaction_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BroadcastVoteTally',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('choice_number', models.PositiveSmallIntegerField()),
+                ('votes', models.PositiveIntegerField(default=0)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_tallies', to='core.broadcastmessage')),
+            ],
+            options={
+                'verbose_name': 'Итог голосования',
+                'verbose_name_plural': 'Итоги голосования',
+                'unique_together': {('message', 'choice_number')},
+            },
+        ),
+        # Счётчики для уже существующих голосов
+        migrations.RunSQL(
+            """
+            INSERT INTO core_broadcastvotetally (message_id, choice_number, votes)
+            SELECT message_id, choice_number, COUNT(*) FROM core_broadcastvote
+            GROUP BY message_id, choice_number
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
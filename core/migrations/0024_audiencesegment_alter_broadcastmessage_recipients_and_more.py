@@ -0,0 +1,43 @@
+# Generated by Django 4.2.20 on 2026-10-18 03:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_broadcastvotetally'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AudienceSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Название')),
+                ('bot_source', models.CharField(blank=True, help_text='Пусто — любой', max_length=50, verbose_name='Источник (бот)')),
+                ('is_course_paid', models.BooleanField(blank=True, help_text='Пусто — неважно', null=True, verbose_name='Доступ к курсу')),
+                ('is_blocked', models.BooleanField(blank=True, default=False, help_text='Пусто — неважно', null=True, verbose_name='Заблокировал бота')),
+                ('joined_after', models.DateTimeField(blank=True, null=True, verbose_name='Пришёл не раньше')),
+                ('joined_before', models.DateTimeField(blank=True, null=True, verbose_name='Пришёл не позже')),
+                ('active_within_days', models.PositiveIntegerField(blank=True, help_text='Есть действие клиента за этот период', null=True, verbose_name='Активен за последние N дней')),
+                ('action_prefix', models.CharField(blank=True, help_text='Например, clicked_payment; учитывается вместе с периодом активности', max_length=255, verbose_name='Действие начинается с')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Сегмент аудитории',
+                'verbose_name_plural': 'Сегменты аудитории',
+            },
+        ),
+        migrations.AlterField(
+            model_name='broadcastmessage',
+            name='recipients',
+            field=models.ManyToManyField(blank=True, to='core.telegramclient', verbose_name='Получатели'),
+        ),
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='segment',
+            field=models.ForeignKey(blank=True, help_text='Клиенты сегмента добавляются к получателям в момент отправки', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='broadcasts', to='core.audiencesegment', verbose_name='Сегмент'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.20 on 2026-10-18 03:39
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся CONCURRENTLY, без блокировки записи в большие таблицы
+    atomic = False
+
+    dependencies = [
+        ('core', '0024_audiencesegment_alter_broadcastmessage_recipients_and_more'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='broadcastdelivery',
+            index=models.Index(fields=['recipient', '-sent_at'], name='delivery_recipient_sent_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='broadcastdelivery',
+            index=models.Index(fields=['message', 'status', 'recipient'], name='delivery_message_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='broadcastmessage',
+            index=models.Index(fields=['comment', 'id'], name='broadcast_comment_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='clientaction',
+            index=models.Index(fields=['client', '-timestamp'], name='action_client_ts_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='telegramclient',
+            index=models.Index(condition=models.Q(('is_course_paid', True)), fields=['user_id'], name='client_paid_user_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='telegramclient',
+            index=models.Index(fields=['bot_source', 'is_blocked'], name='client_source_blocked_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='telegramclient',
+            index=models.Index(fields=['-created_at'], name='client_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='telegramclient',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('username'), name='text_pattern_ops'), name='client_username_upper_idx'),
+        ),
+        # Одиночные индексы по FK удаляются после того, как их заменили составные
+        migrations.AlterField(
+            model_name='broadcastdelivery',
+            name='message',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='core.broadcastmessage'),
+        ),
+        migrations.AlterField(
+            model_name='broadcastdelivery',
+            name='recipient',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.telegramclient'),
+        ),
+        migrations.AlterField(
+            model_name='clientaction',
+            name='client',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='actions', to='core.telegramclient'),
+        ),
+    ]
@@ -0,0 +1,149 @@
+from datetime import datetime
+
+from django.db import migrations, transaction
+from django.utils import timezone
+
+# CHECK по границе legacy-партиции: с проверенным заранее CHECK ATTACH PARTITION не сканирует таблицу
+LEGACY_BOUND = "core_clientaction_legacy_bound"
+# Уникальный индекс под будущий первичный ключ (id, "timestamp"), строится CONCURRENTLY
+LEGACY_PKEY = "core_clientaction_legacy_pkey"
+
+
+def client_fk(cursor, table):
+    """Имя FK client_id → core_telegramclient: Django генерирует его с хешем, поэтому берём из pg_constraint."""
+    cursor.execute(
+        "SELECT conname FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f' AND confrelid = 'core_telegramclient'::regclass",
+        [table],
+    )
+    return cursor.fetchone()[0]
+
+
+def partition(apps, schema_editor):
+    """
+    Превращает core_clientaction в таблицу, партиционированную по месяцам "timestamp".
+    Старая таблица целиком прикрепляется партицией core_clientaction_legacy (до начала следующего месяца),
+    без копирования строк. Дальше партиции создаёт manage.py client_action_partitions.
+
+    Всё, что читает таблицу целиком, делается заранее и не мешает боту писать действия:
+    уникальный индекс под новый первичный ключ строится CONCURRENTLY, CHECK по границе партиции
+    добавляется NOT VALID и проверяется VALIDATE (блокировка SHARE UPDATE EXCLUSIVE).
+    Потом в одной транзакции под ACCESS EXCLUSIVE меняется только каталог: первичный ключ берёт готовый
+    индекс, а ATTACH PARTITION видит проверенный CHECK, готовые индекс и FK и не сканирует строки.
+    Блокировка держится доли секунды независимо от размера журнала; ждать её дольше lock_timeout
+    миграция не станет — упадёт, и её можно просто запустить снова.
+    """
+    connection = schema_editor.connection
+    execute = schema_editor.execute
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT max("timestamp") FROM core_clientaction')
+        latest = cursor.fetchone()[0]
+    # Граница legacy — начало месяца после текущего (или после самой поздней строки, если она в будущем)
+    latest = timezone.localtime(max(filter(None, [latest, timezone.now()])))
+    next_month = datetime(latest.year + latest.month // 12, latest.month % 12 + 1, 1, tzinfo=latest.tzinfo)
+
+    # Долгие шаги — без блокировки записи; невалидный индекс от прерванного запуска пересоздаётся
+    execute(f"DROP INDEX CONCURRENTLY IF EXISTS {LEGACY_PKEY}")
+    execute(f'CREATE UNIQUE INDEX CONCURRENTLY {LEGACY_PKEY} ON core_clientaction (id, "timestamp")')
+    execute(f"ALTER TABLE core_clientaction DROP CONSTRAINT IF EXISTS {LEGACY_BOUND}")
+    # Ровно ограничение партиции FROM (MINVALUE) TO (next_month)
+    execute(
+        f'ALTER TABLE core_clientaction ADD CONSTRAINT {LEGACY_BOUND} '
+        'CHECK ("timestamp" IS NOT NULL AND "timestamp" < %s) NOT VALID',
+        [next_month],
+    )
+    execute(f"ALTER TABLE core_clientaction VALIDATE CONSTRAINT {LEGACY_BOUND}")
+
+    with transaction.atomic(using=connection.alias):
+        execute("SET LOCAL lock_timeout = '5s'")
+        with connection.cursor() as cursor:
+            fk = client_fk(cursor, "core_clientaction")
+        execute("ALTER TABLE core_clientaction RENAME TO core_clientaction_legacy")
+        execute("ALTER INDEX action_client_ts_idx RENAME TO core_clientaction_legacy_client_ts_idx")
+        execute(f"ALTER TABLE core_clientaction_legacy RENAME CONSTRAINT {fk} TO core_clientaction_legacy_client_fk")
+        # Первичный ключ партиционированной таблицы обязан включать ключ партиционирования
+        execute("ALTER TABLE core_clientaction_legacy DROP CONSTRAINT core_clientaction_pkey")
+        execute(f"ALTER TABLE core_clientaction_legacy ADD CONSTRAINT {LEGACY_PKEY} PRIMARY KEY USING INDEX {LEGACY_PKEY}")
+        execute(
+            """
+            CREATE TABLE core_clientaction (
+                id bigint NOT NULL,
+                action text NOT NULL,
+                "timestamp" timestamp with time zone NOT NULL,
+                client_id bigint NOT NULL,
+                PRIMARY KEY (id, "timestamp")
+            ) PARTITION BY RANGE ("timestamp")
+            """
+        )
+        # id выдаёт новая последовательность родительской таблицы, продолжая нумерацию старой
+        execute("ALTER TABLE core_clientaction_legacy ALTER COLUMN id DROP IDENTITY")
+        execute("CREATE SEQUENCE core_clientaction_id_seq OWNED BY core_clientaction.id")
+        execute(
+            "SELECT setval('core_clientaction_id_seq', "
+            "COALESCE((SELECT max(id) FROM core_clientaction_legacy), 0) + 1, false)"
+        )
+        execute("ALTER TABLE core_clientaction ALTER COLUMN id SET DEFAULT nextval('core_clientaction_id_seq')")
+        execute(
+            f"ALTER TABLE core_clientaction ADD CONSTRAINT {fk} FOREIGN KEY (client_id) "
+            "REFERENCES core_telegramclient (id) DEFERRABLE INITIALLY DEFERRED"
+        )
+        execute('CREATE INDEX action_client_ts_idx ON core_clientaction (client_id, "timestamp" DESC)')
+        execute(
+            "ALTER TABLE core_clientaction ATTACH PARTITION core_clientaction_legacy FOR VALUES FROM (MINVALUE) TO (%s)",
+            [next_month],
+        )
+        # Дальше границу держит само ограничение партиции
+        execute(f"ALTER TABLE core_clientaction_legacy DROP CONSTRAINT {LEGACY_BOUND}")
+        execute("CREATE TABLE core_clientaction_default PARTITION OF core_clientaction DEFAULT")
+
+
+def unpartition(apps, schema_editor):
+    """Обратно в обычную таблицу: строки всех прикреплённых партиций копируются (архивы не возвращаются)."""
+    connection = schema_editor.connection
+    execute = schema_editor.execute
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            fk = client_fk(cursor, "core_clientaction")
+        execute("ALTER TABLE core_clientaction RENAME TO core_clientaction_partitioned")
+        execute(f"ALTER TABLE core_clientaction_partitioned RENAME CONSTRAINT {fk} TO core_clientaction_partitioned_fk")
+        execute("ALTER INDEX action_client_ts_idx RENAME TO core_clientaction_partitioned_client_ts_idx")
+        execute("ALTER TABLE core_clientaction_partitioned RENAME CONSTRAINT core_clientaction_pkey TO core_clientaction_partitioned_pkey")
+        execute("ALTER SEQUENCE core_clientaction_id_seq RENAME TO core_clientaction_partitioned_id_seq")
+        execute(
+            """
+            CREATE TABLE core_clientaction (
+                id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                action text NOT NULL,
+                "timestamp" timestamp with time zone NOT NULL,
+                client_id bigint NOT NULL
+            )
+            """
+        )
+        execute(
+            'INSERT INTO core_clientaction (id, action, "timestamp", client_id) '
+            'SELECT id, action, "timestamp", client_id FROM core_clientaction_partitioned'
+        )
+        execute(
+            "SELECT setval(pg_get_serial_sequence('core_clientaction', 'id'), "
+            "COALESCE((SELECT max(id) FROM core_clientaction), 0) + 1, false)"
+        )
+        execute("DROP TABLE core_clientaction_partitioned CASCADE")
+        execute('CREATE INDEX action_client_ts_idx ON core_clientaction (client_id, "timestamp" DESC)')
+        # FK — после копирования: отложенные проверки вставленных строк не дали бы создать индекс
+        execute(
+            f"ALTER TABLE core_clientaction ADD CONSTRAINT {fk} FOREIGN KEY (client_id) "
+            "REFERENCES core_telegramclient (id) DEFERRABLE INITIALLY DEFERRED"
+        )
+
+
+class Migration(migrations.Migration):
+    # Индекс и CHECK готовятся вне транзакции, под блокировкой — только короткая транзакция с каталогом
+    atomic = False
+
+    dependencies = [
+        ("core", "0025_hot_path_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
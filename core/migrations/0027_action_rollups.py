@@ -0,0 +1,66 @@
+# Generated by Django 4.2.20 on 2026-10-18 03:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_partition_clientaction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FunnelProgress',
+            fields=[
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='funnel', serialize=False, to='core.telegramclient')),
+                ('bot_source', models.CharField(blank=True, default='', max_length=50)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('payment_clicked_at', models.DateTimeField(blank=True, null=True)),
+                ('payment_uploaded_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bot_source', 'started_at'], name='funnel_source_started_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='FunnelDailyCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('bot_source', models.CharField(blank=True, default='', max_length=50)),
+                ('started', models.PositiveIntegerField(default=0)),
+                ('payment_clicked', models.PositiveIntegerField(default=0)),
+                ('payment_uploaded', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Воронка за день',
+                'verbose_name_plural': 'Воронка за день',
+                'unique_together': {('day', 'bot_source')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ActionDailyCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('bot_source', models.CharField(blank=True, default='', max_length=50)),
+                ('action', models.CharField(max_length=100)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Действия за день',
+                'verbose_name_plural': 'Действия за день',
+                'unique_together': {('day', 'bot_source', 'action')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-18 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_action_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='lease_id',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='broadcastdelivery',
+            name='status',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('claimed', 'Взята шардом'), ('sending', 'Отправляется'), ('sent', 'Отправлено'), ('failed', 'Ошибка'), ('blocked', 'Заблокировал бота')], max_length=20),
+        ),
+    ]
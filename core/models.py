@@ -1,8 +1,12 @@
 from django.db import models
+from django.contrib.postgres.indexes import OpClass
+from django.db.models.functions import Upper
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 import json
 import os
+from datetime import timedelta
 from django.conf import settings
+from django.utils import timezone
 from pydub import AudioSegment
 from django.db import transaction
 
@@ -25,19 +29,34 @@ class TelegramClient(models.Model):
     class Meta:
         verbose_name = "Клиент Telegram"
         verbose_name_plural = "Клиенты Telegram"
+        indexes = [
+            # check_access_view: доступ к курсу есть у небольшой доли клиентов
+            models.Index(fields=["user_id"], condition=models.Q(is_course_paid=True), name="client_paid_user_idx"),
+            # фильтры админки и сегменты
+            models.Index(fields=["bot_source", "is_blocked"], name="client_source_blocked_idx"),
+            models.Index(fields=["-created_at"], name="client_created_idx"),
+            # username__istartswith (поиск получателей) → UPPER(username) LIKE 'X%'
+            models.Index(OpClass(Upper("username"), name="text_pattern_ops"), name="client_username_upper_idx"),
+        ]
 
     def __str__(self):
         return self.username or str(self.user_id)
 
 
 class ClientAction(models.Model):
-    client = models.ForeignKey(TelegramClient, on_delete=models.CASCADE, related_name='actions')
+    # отдельный индекс по client не нужен: его покрывает action_client_ts_idx
+    client = models.ForeignKey(TelegramClient, on_delete=models.CASCADE, related_name='actions', db_index=False)
     action = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # не auto_now_add: журнал пишется пачками, время берётся из момента действия, а не записи
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         verbose_name = "Действие клиента"
         verbose_name_plural = "Действия клиентов"
+        indexes = [
+            # история клиента и активность в сегментах
+            models.Index(fields=["client", "-timestamp"], name="action_client_ts_idx"),
+        ]
 
     def __str__(self):
         return f"{self.client.username or self.client.user_id}: {self.action} at {self.timestamp}"
@@ -56,19 +75,89 @@ class SupportMessage(models.Model):
         return f"{self.client.username or self.client.user_id}: {self.message[:30]}"
 
 
+class AudienceSegment(models.Model):
+    """
+    Сохранённый фильтр по клиентам. Рассылка на сегмент не хранит список получателей:
+    выборка делается в момент отправки, поэтому в неё попадают только актуальные клиенты.
+    """
+    name = models.CharField("Название", max_length=255)
+    bot_source = models.CharField("Источник (бот)", max_length=50, blank=True, help_text="Пусто — любой")
+    is_course_paid = models.BooleanField("Доступ к курсу", null=True, blank=True, help_text="Пусто — неважно")
+    is_blocked = models.BooleanField("Заблокировал бота", null=True, blank=True, default=False, help_text="Пусто — неважно")
+    joined_after = models.DateTimeField("Пришёл не раньше", null=True, blank=True)
+    joined_before = models.DateTimeField("Пришёл не позже", null=True, blank=True)
+    active_within_days = models.PositiveIntegerField(
+        "Активен за последние N дней", null=True, blank=True, help_text="Есть действие клиента за этот период"
+    )
+    action_prefix = models.CharField(
+        "Действие начинается с", max_length=255, blank=True, help_text="Например, clicked_payment; учитывается вместе с периодом активности"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Сегмент аудитории"
+        verbose_name_plural = "Сегменты аудитории"
+
+    def __str__(self):
+        return self.name
+
+    def clients(self):
+        qs = TelegramClient.objects.all()
+        if self.bot_source:
+            qs = qs.filter(bot_source=self.bot_source)
+        if self.is_course_paid is not None:
+            qs = qs.filter(is_course_paid=self.is_course_paid)
+        if self.is_blocked is not None:
+            qs = qs.filter(is_blocked=self.is_blocked)
+        if self.joined_after:
+            qs = qs.filter(created_at__gte=self.joined_after)
+        if self.joined_before:
+            qs = qs.filter(created_at__lte=self.joined_before)
+        if self.active_within_days or self.action_prefix:
+            actions = ClientAction.objects.filter(client=models.OuterRef("pk"))
+            if self.active_within_days:
+                actions = actions.filter(timestamp__gte=timezone.now() - timedelta(days=self.active_within_days))
+            if self.action_prefix:
+                actions = actions.filter(action__startswith=self.action_prefix)
+            qs = qs.filter(models.Exists(actions))
+        return qs
+
+
 class BroadcastMessage(models.Model):
     text = models.TextField("Текст сообщения")
     text_after_media = models.TextField("Текст после фото (если их много)", blank=True, null=True)
     comment = models.CharField("Комментарий", max_length=255, default="Без названия")
-    recipients = models.ManyToManyField(TelegramClient, verbose_name="Получатели")
+    recipients = models.ManyToManyField(TelegramClient, verbose_name="Получатели", blank=True)
+    segment = models.ForeignKey(
+        AudienceSegment,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="broadcasts",
+        verbose_name="Сегмент",
+        help_text="Клиенты сегмента добавляются к получателям в момент отправки",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     sent = models.BooleanField(default=False)
     buttons_json = models.TextField("Кнопки (JSON)", blank=True, null=True)
     photo = models.ImageField(upload_to="broadcasts/", blank=True, null=True, verbose_name="Фото")
+    photo_file_id = models.CharField(max_length=255, blank=True, null=True, editable=False)
+    shard_size = models.PositiveIntegerField("Получателей в шарде", default=5000)
+    shard_parallelism = models.PositiveSmallIntegerField("Шардов одновременно", default=4)
+    ok_count = models.PositiveIntegerField("Доставлено", default=0)
+    failed_count = models.PositiveIntegerField("Ошибок", default=0)
+    blocked_count = models.PositiveIntegerField("Заблокировали бота", default=0)
+    heartbeat_at = models.DateTimeField("Последний пульс рассылки", blank=True, null=True)
+    # Запуск, которому принадлежит рассылка: шарды и финал чужого (вытесненного) запуска ничего не делают
+    lease_id = models.UUIDField(blank=True, null=True, editable=False)
 
     class Meta:
         verbose_name = "Рассылка"
         verbose_name_plural = "Рассылки"
+        indexes = [
+            # служебные рассылки ищутся по комментарию, первая по id («Послание для меню» — на каждый клик)
+            models.Index(fields=["comment", "id"], name="broadcast_comment_idx"),
+        ]
 
     def __str__(self):
         if self.created_at:
@@ -87,10 +176,18 @@ class BroadcastMessage(models.Model):
         except Exception:
             return None
 
+    def is_running(self):
+        # Рассылка считается живой, пока воркеры обновляют heartbeat_at чаще, чем раз в BROADCAST_LEASE_SECONDS
+        if self.sent or not self.heartbeat_at:
+            return False
+        return timezone.now() - self.heartbeat_at < timedelta(seconds=settings.BROADCAST_LEASE_SECONDS)
+
 
 class BroadcastPhoto(models.Model):
     message = models.ForeignKey(BroadcastMessage, on_delete=models.CASCADE, related_name="photos")
     image = models.ImageField(upload_to="broadcasts/photos/")
+    # file_id, который вернул Telegram после первой загрузки — дальше фото отправляется по нему
+    file_id = models.CharField(max_length=255, blank=True, null=True, editable=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -102,12 +199,20 @@ class BroadcastPhoto(models.Model):
 
 
 class BroadcastDelivery(models.Model):
-    message = models.ForeignKey(BroadcastMessage, on_delete=models.CASCADE, related_name='deliveries')
-    recipient = models.ForeignKey(TelegramClient, on_delete=models.CASCADE)
+    # одиночные индексы по FK покрыты составными (unique по message+recipient и индексами ниже)
+    message = models.ForeignKey(BroadcastMessage, on_delete=models.CASCADE, related_name='deliveries', db_index=False)
+    recipient = models.ForeignKey(TelegramClient, on_delete=models.CASCADE, db_index=False)
     sent_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(
         max_length=20,
-        choices=[('sent', 'Отправлено'), ('failed', 'Ошибка')]
+        choices=[
+            ('pending', 'В очереди'),
+            ('claimed', 'Взята шардом'),
+            ('sending', 'Отправляется'),
+            ('sent', 'Отправлено'),
+            ('failed', 'Ошибка'),
+            ('blocked', 'Заблокировал бота'),
+        ]
     )
     error_message = models.TextField(blank=True, null=True)
 
@@ -115,11 +220,32 @@ class BroadcastDelivery(models.Model):
         unique_together = ('message', 'recipient')
         verbose_name = "Доставка сообщения"
         verbose_name_plural = "Доставки сообщений"
+        indexes = [
+            # последние рассылки клиента в админке
+            models.Index(fields=["recipient", "-sent_at"], name="delivery_recipient_sent_idx"),
+            # claim_deliveries: pending-строки рассылки по порядку получателей
+            models.Index(fields=["message", "status", "recipient"], name="delivery_message_status_idx"),
+        ]
 
     def __str__(self):
         return f"{self.recipient} ← {self.message} [{self.status}]"
 
 
+class TelegramMediaFile(models.Model):
+    """file_id статичных картинок ботов (галереи «о канале», отзывы), чтобы не загружать их заново."""
+    path = models.CharField(max_length=500, unique=True)
+    signature = models.CharField(max_length=100)
+    file_id = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Файл в Telegram"
+        verbose_name_plural = "Файлы в Telegram"
+
+    def __str__(self):
+        return self.path
+
+
 class PaymentUpload(models.Model):
     client = models.ForeignKey(TelegramClient, on_delete=models.CASCADE)
     file = models.ImageField(upload_to=upload_to_payment, blank=True, null=True)
@@ -145,6 +271,9 @@ class BroadcastAudio(models.Model):
         null=True,
         help_text="Название файла для отправки в Telegram (с расширением .mp3)"
     )
+    # file_id загруженного в Telegram mp3 и имя файла, с которым он загружен
+    telegram_file_id = models.CharField(max_length=255, blank=True, null=True, editable=False)
+    telegram_filename = models.CharField(max_length=255, blank=True, null=True, editable=False)
 
     def __str__(self):
         return f"Audio {self.choice_number} for Broadcast #{self.message.id}"
@@ -164,12 +293,121 @@ class BroadcastVote(models.Model):
         return f"Vote: {self.client} chose {self.choice_number} for #{self.message.id}"
 
 
-# async конвертация через celery
-from django.db.models.signals import post_save
+class BroadcastVoteTally(models.Model):
+    """Счётчик голосов по варианту: увеличивается вместе с каждой вставкой BroadcastVote."""
+    message = models.ForeignKey(BroadcastMessage, on_delete=models.CASCADE, related_name="vote_tallies")
+    choice_number = models.PositiveSmallIntegerField()
+    votes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('message', 'choice_number')
+        verbose_name = "Итог голосования"
+        verbose_name_plural = "Итоги голосования"
+
+    def __str__(self):
+        return f"#{self.message_id} вариант {self.choice_number}: {self.votes}"
+
+
+class RollupWatermark(models.Model):
+    """До какого id журнал действий уже учтён в агрегатах (core.utils.rollups)."""
+    name = models.CharField(max_length=50, primary_key=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
+
+class ActionDailyCount(models.Model):
+    """Число действий за день по типу действия (часть до «:») и боту клиента."""
+    day = models.DateField()
+    bot_source = models.CharField(max_length=50, blank=True, default="")
+    action = models.CharField(max_length=100)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'bot_source', 'action')
+        verbose_name = "Действия за день"
+        verbose_name_plural = "Действия за день"
+
+
+class FunnelProgress(models.Model):
+    """Когда клиент впервые прошёл каждый шаг воронки: /start → кнопка оплаты → загрузка чека."""
+    client = models.OneToOneField(TelegramClient, on_delete=models.CASCADE, primary_key=True, related_name="funnel")
+    bot_source = models.CharField(max_length=50, blank=True, default="")
+    started_at = models.DateTimeField(null=True, blank=True)
+    payment_clicked_at = models.DateTimeField(null=True, blank=True)
+    payment_uploaded_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["bot_source", "started_at"], name="funnel_source_started_idx"),
+        ]
+
+
+class FunnelDailyCount(models.Model):
+    """Когорта дня первого /start: сколько клиентов начали и сколько из них дошли до оплаты."""
+    day = models.DateField()
+    bot_source = models.CharField(max_length=50, blank=True, default="")
+    started = models.PositiveIntegerField(default=0)
+    payment_clicked = models.PositiveIntegerField(default=0)
+    payment_uploaded = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'bot_source')
+        verbose_name = "Воронка за день"
+        verbose_name_plural = "Воронка за день"
+
+
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
+# при замене картинки сохранённый file_id Telegram больше не подходит
+@receiver(pre_save, sender=BroadcastPhoto)
+def reset_broadcastphoto_file_id(sender, instance, **kwargs):
+    if instance.pk and instance.file_id:
+        old = sender.objects.filter(pk=instance.pk).values_list("image", flat=True).first()
+        if old != instance.image.name:
+            instance.file_id = None
+
+@receiver(pre_save, sender=BroadcastMessage)
+def reset_broadcastmessage_photo_file_id(sender, instance, **kwargs):
+    if instance.pk and instance.photo_file_id:
+        old = sender.objects.filter(pk=instance.pk).values_list("photo", flat=True).first()
+        if old != instance.photo.name:
+            instance.photo_file_id = None
+
+# изменения клиента (например, is_course_paid / is_blocked в админке) сбрасывают его в кэше ботов;
+# новый клиент — тоже: бот мог закэшировать, что такого клиента нет
+@receiver(post_save, sender=TelegramClient)
+def invalidate_cached_client(sender, instance, created, **kwargs):
+    from core.utils.client_cache import publish_invalidation
+    transaction.on_commit(lambda: publish_invalidation(instance.user_id))
+
+@receiver(post_delete, sender=TelegramClient)
+def invalidate_deleted_client(sender, instance, **kwargs):
+    from core.utils.client_cache import publish_invalidation
+    transaction.on_commit(lambda: publish_invalidation(instance.user_id))
+
+# file_id привязан к конкретному mp3 и имени файла — при их смене загружаем заново
+@receiver(pre_save, sender=BroadcastAudio)
+def reset_broadcastaudio_file_id(sender, instance, **kwargs):
+    if instance.pk and instance.telegram_file_id:
+        old = sender.objects.filter(pk=instance.pk).values("mp3_file", "custom_filename").first()
+        if old and (old["mp3_file"] != instance.mp3_file.name or old["custom_filename"] != instance.custom_filename):
+            instance.telegram_file_id = None
+            instance.telegram_filename = None
+
+# async конвертация через celery
 @receiver(post_save, sender=BroadcastAudio)
 def handle_broadcastaudio_post_save(sender, instance, created, **kwargs):
     if created:
         from core.tasks import convert_audio_to_mp3_task
         transaction.on_commit(lambda: convert_audio_to_mp3_task.delay(instance.id))
+
+# новый mp3, подпись или file_id — бот перечитывает аудио рассылки, а не ждёт истечения своего кэша
+@receiver(post_save, sender=BroadcastAudio)
+@receiver(post_delete, sender=BroadcastAudio)
+def invalidate_cached_audios(sender, instance, **kwargs):
+    from core.utils.votes import publish_audio_invalidation
+    transaction.on_commit(lambda: publish_audio_invalidation(instance.message_id))
@@ -1,14 +1,28 @@
 import json
 import logging
-import time
-import asyncio
 import os
+import uuid
+from datetime import timedelta
 
-from celery import shared_task
+from asgiref.sync import sync_to_async
+from celery import chain, chord, group, shared_task
 from django.conf import settings
-from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.request import HTTPXRequest
-from core.models import BroadcastMessage, BroadcastDelivery, BroadcastAudio
+from django.db.models import Count, Q
+from django.utils import timezone
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from core.models import BroadcastMessage, BroadcastDelivery, BroadcastPhoto, BroadcastAudio
+from core.utils import bot_pool, exports, partitions, recipients, rollups, votes
+from core.utils.broadcast import BroadcastSender, RedisRateBudget, TelegramRateLimiter
+from core.utils.selection import load_selection
+from core.utils.telegram import CachedPhoto, PhotoSet, _send_async
+from core.utils.deliveries import (
+    AttemptLog,
+    DeliveryBuffer,
+    claim_deliveries,
+    interrupt_claimed,
+    precreate_deliveries,
+    precreate_segment_deliveries,
+)
 from pydub import AudioSegment
 
 logger = logging.getLogger("broadcast")
@@ -32,20 +46,38 @@ def build_keyboard(raw):
         logger.exception("Не удалось распарсить buttons_json")
         return None
 
-def _sync_send(coro):
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    if loop.is_running():
-        new_loop = asyncio.new_event_loop()
-        try:
-            return new_loop.run_until_complete(coro)
-        finally:
-            new_loop.close()
-    else:
-        return loop.run_until_complete(coro)
+def _split_shards(bm):
+    """Границы шардов [lo, hi) по id клиента среди ещё не отправленных доставок; у последнего hi = None."""
+    ids = (
+        BroadcastDelivery.objects
+        .filter(message_id=bm.pk, status="pending")
+        .order_by("recipient_id")
+        .values_list("recipient_id", flat=True)
+    )
+    size = max(1, bm.shard_size)
+    bounds = [rid for n, rid in enumerate(ids.iterator(chunk_size=size)) if n % size == 0]
+    return list(zip(bounds, bounds[1:] + [None]))
+
+def _acquire_lease(broadcast_id):
+    """
+    Атомарно занимает рассылку, если её никто не ведёт (heartbeat протух или его нет), и возвращает id запуска.
+    Уже отправленную рассылку тоже можно запустить: она дойдёт только до получателей без доставки.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.BROADCAST_LEASE_SECONDS)
+    lease = str(uuid.uuid4())
+    taken = BroadcastMessage.objects.filter(
+        Q(heartbeat_at__isnull=True) | Q(heartbeat_at__lt=stale),
+        pk=broadcast_id,
+    ).update(heartbeat_at=now, lease_id=lease, sent=False)
+    return lease if taken else None
+
+def _heartbeat(broadcast_id, lease=None):
+    """Продлевает аренду; False — рассылку уже ведёт другой запуск (шард ждал в очереди дольше аренды)."""
+    broadcasts = BroadcastMessage.objects.filter(pk=broadcast_id)
+    if lease:
+        broadcasts = broadcasts.filter(lease_id=lease)
+    return bool(broadcasts.update(heartbeat_at=timezone.now()))
 
 @shared_task(bind=True, name="core.tasks.send_broadcast")
 def send_broadcast(self, broadcast_id: int):
@@ -58,51 +90,238 @@ def send_broadcast(self, broadcast_id: int):
         logger.error("❌ BroadcastMessage %s не найден", broadcast_id)
         return
 
+    lease = _acquire_lease(bm.pk)
+    if not lease:
+        logger.warning("⏭ Рассылка %s идёт прямо сейчас (task %s)", broadcast_id, tid)
+        return
+
+    interrupted = interrupt_claimed(bm.pk)
+    if interrupted:
+        logger.warning("⚠️ Рассылка %s: %d доставок прервано при прошлом запуске", broadcast_id, interrupted)
+    created = precreate_deliveries(bm.pk)
+    if bm.segment_id:
+        created += precreate_segment_deliveries(bm.pk, bm.segment.clients())
+    logger.info("📝 Подготовлено %d новых доставок для рассылки %s", created, broadcast_id)
+
+    shards = _split_shards(bm)
+    if not shards:
+        finish_broadcast([], broadcast_id, lease)
+        return
+
+    # Шарды раскладываются по «дорожкам»: дорожки идут параллельно, шарды внутри — по очереди
+    lanes = [[] for _ in range(min(max(1, bm.shard_parallelism), len(shards)))]
+    for n, bounds in enumerate(shards):
+        lanes[n % len(lanes)].append(bounds)
+    chains = [
+        chain(*(send_broadcast_shard.si(broadcast_id, *bounds, lease) for bounds in lane))
+        for lane in lanes
+    ]
+    chord(group(chains))(finish_broadcast.s(broadcast_id, lease))
+    logger.info(
+        "🧩 Рассылка %s разбита на %d шардов по %d (параллельно %d)",
+        broadcast_id,
+        len(shards),
+        bm.shard_size,
+        len(lanes),
+    )
+
+@shared_task(
+    bind=True,
+    name="core.tasks.send_broadcast_shard",
+    acks_late=True,
+    reject_on_worker_lost=True,
+)
+def send_broadcast_shard(self, broadcast_id: int, lo: int, hi=None, lease=None):
+    bm = BroadcastMessage.objects.get(pk=broadcast_id)
+    # Пульс с проверкой запуска: если аренду уже перехватил новый запуск, этот шард ничего не трогает
+    if not _heartbeat(bm.pk, lease):
+        logger.warning("⏭ Шард [%s, %s) рассылки %s от вытесненного запуска — пропускаем", lo, hi, broadcast_id)
+        return None
+    # Если шард перезапущен после падения воркера: невзятое в работу — снова в pending, начатое (sending) не переотправляем
+    interrupted = interrupt_claimed(bm.pk, lo, hi)
+    if interrupted:
+        logger.warning("⚠️ Шард [%s, %s) рассылки %s: %d доставок прервано", lo, hi, broadcast_id, interrupted)
+
     keyboard = build_keyboard(bm.buttons_json)
-    ok = failed = 0
-    for client in bm.recipients.all():
-        delivery, _ = BroadcastDelivery.objects.update_or_create(
-            message=bm,
-            recipient=client,
-            defaults={"status": "pending", "error_message": ""},
-        )
-        try:
-            bot = Bot(
-                token=settings.TELEGRAM_BOT_TOKEN_PRIVATE,
-                request=HTTPXRequest(connect_timeout=10, read_timeout=30),
-            )
-            coro = bot.send_message(
-                chat_id=client.user_id,
-                text=bm.text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-            msg = _sync_send(coro)
-            logger.info("📨 Ответ Telegram: %s", msg.to_dict())
-            delivery.status = "sent"
-            # delivery.message_id = msg.message_id    # <-- ЭТУ СТРОКУ НЕ НУЖНО!
-            delivery.save()
-            logger.info("✅ Успешно отправлено пользователю %s", client.user_id)
-            ok += 1
-        except Exception as exc:
-            logger.exception("⚠️ Ошибка при отправке пользователю %s", client.user_id)
-            delivery.status = "failed"
-            delivery.error_message = str(exc)[:500]
-            delivery.save()
-            failed += 1
-        time.sleep(1)
-
-    bm.sent = True
-    bm.save(update_fields=["sent"])
+    photos = _broadcast_photos(bm)
+    totals = bot_pool.run(_run_broadcast(bm, keyboard, photos, lo, hi, lease))
+    logger.info(
+        "📦 Шард [%s, %s) рассылки %s: ok=%d, failed=%d, blocked=%d (task %s)",
+        lo,
+        hi,
+        broadcast_id,
+        totals["ok"],
+        totals["failed"],
+        totals["blocked"],
+        self.request.id,
+    )
+    return totals
 
+@shared_task(name="core.tasks.finish_broadcast")
+def finish_broadcast(results, broadcast_id: int, lease=None):
+    broadcasts = BroadcastMessage.objects.filter(pk=broadcast_id)
+    if lease:
+        broadcasts = broadcasts.filter(lease_id=lease)
+    # Итоги считаем по доставкам, а не по шардам: так они верны и после продолжения упавшей рассылки
+    counts = dict(
+        BroadcastDelivery.objects
+        .filter(message_id=broadcast_id)
+        .values_list("status")
+        .annotate(n=Count("id"))
+    )
+    if not broadcasts.update(
+        sent=True,
+        heartbeat_at=None,
+        ok_count=counts.get("sent", 0),
+        failed_count=counts.get("failed", 0),
+        blocked_count=counts.get("blocked", 0),
+    ):
+        logger.warning("⏭ Рассылку %s уже ведёт другой запуск — итоги подведёт он", broadcast_id)
+        return
     logger.info(
-        "📬 Рассылка %s завершена: ok=%d, failed=%d (task %s)",
+        "📬 Рассылка %s завершена: ok=%d, failed=%d, blocked=%d",
         broadcast_id,
-        ok,
-        failed,
-        tid,
+        counts.get("sent", 0),
+        counts.get("failed", 0),
+        counts.get("blocked", 0),
     )
 
+@shared_task(name="core.tasks.resume_stalled_broadcasts")
+def resume_stalled_broadcasts():
+    stale = timezone.now() - timedelta(seconds=settings.BROADCAST_LEASE_SECONDS)
+    for broadcast_id in BroadcastMessage.objects.filter(sent=False, heartbeat_at__lt=stale).values_list("pk", flat=True):
+        logger.warning("🔁 Рассылка %s не подаёт признаков жизни — продолжаем", broadcast_id)
+        send_broadcast.delay(broadcast_id)
+
+@shared_task(bind=True, name="core.tasks.attach_recipients")
+def attach_recipients(self, broadcast_id: int, selection: dict):
+    """
+    Добавляет большую выборку клиентов в рассылку: queryset собирается на воркере из описания выборки,
+    а вставляется диапазонами id по ATTACH_BATCH_SIZE — каждый одним INSERT ... SELECT, с прогрессом в состоянии задачи.
+    """
+    clients = load_selection(selection).order_by("pk")
+    total, done, added = clients.count(), 0, 0
+    step = settings.ATTACH_BATCH_SIZE
+    last = None
+    while True:
+        batch = clients if last is None else clients.filter(pk__gt=last)
+        edge = list(batch.values_list("pk", flat=True)[step - 1:step])
+        if edge:
+            last = edge[0]
+            batch = batch.filter(pk__lte=last)
+        added += recipients.attach_recipients(broadcast_id, batch)
+        done = min(done + step, total) if edge else total
+        self.update_state(state="PROGRESS", meta={"done": done, "total": total, "added": added})
+        if not edge:
+            break
+    logger.info(f"📨 В рассылку #{broadcast_id} добавлено {added} из {total} выбранных клиентов")
+    return {"done": total, "total": total, "added": added}
+
+
+@shared_task(bind=True, name="core.tasks.export_csv")
+def export_csv(self, selection, columns, name):
+    """Большая выгрузка из админки: пишет .csv.gz в EXPORT_ROOT, прогресс — через состояние задачи."""
+    os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+    filename = f"{name}-{timezone.now():%Y%m%d-%H%M%S}-{self.request.id}.csv.gz"
+    count = exports.write_csv_gz(
+        load_selection(selection),
+        columns,
+        os.path.join(settings.EXPORT_ROOT, filename),
+        progress=lambda done: self.update_state(state="PROGRESS", meta={"done": done}),
+    )
+    logger.info(f"📤 Выгрузка {filename}: {count} строк")
+    return {"done": count, "file": filename}
+
+
+@shared_task(name="core.tasks.reconcile_vote_tallies")
+def reconcile_vote_tallies():
+    fixed = votes.reconcile_vote_tallies()
+    if fixed:
+        logger.warning(f"🗳 Счётчики голосов расходились с голосами — исправлено строк: {fixed}")
+    return fixed
+
+
+@shared_task(name="core.tasks.rollup_client_actions")
+def rollup_client_actions():
+    lo, hi = rollups.run()
+    if hi > lo:
+        logger.info(f"📈 Агрегаты действий клиентов досчитаны: id {lo}–{hi}")
+    return hi - lo
+
+
+@shared_task(name="core.tasks.maintain_client_action_partitions")
+def maintain_client_action_partitions():
+    created, archived = partitions.maintain(
+        settings.CLIENT_ACTION_PARTITIONS_AHEAD,
+        settings.CLIENT_ACTION_RETENTION_MONTHS,
+        settings.CLIENT_ACTION_ARCHIVE_DIR,
+    )
+    if created or archived:
+        logger.info(f"🗂 Партиции действий клиентов: создано {created}, в архиве {[name for name, _ in archived]}")
+    return {"created": created, "archived": archived}
+
+
+def _broadcast_photos(bm):
+    """Фото рассылки с сохранёнными file_id; новые id пишутся обратно в БД после первой загрузки."""
+    photos = []
+    if bm.photo:
+        photos.append(CachedPhoto(
+            bm.photo.path,
+            bm.photo_file_id,
+            lambda file_id: BroadcastMessage.objects.filter(pk=bm.pk).update(photo_file_id=file_id),
+        ))
+    for photo in bm.photos.order_by("id"):
+        photos.append(CachedPhoto(
+            photo.image.path,
+            photo.file_id,
+            lambda file_id, pk=photo.pk: BroadcastPhoto.objects.filter(pk=pk).update(file_id=file_id),
+        ))
+    return PhotoSet(photos) if photos else None
+
+async def _run_broadcast(bm, keyboard, photos, lo, hi, lease=None):
+    bot = await bot_pool.get_bot()
+
+    async def send(chat_id, state):
+        await _send_async(bot, chat_id, bm.text, keyboard, photos, bm.text_after_media, state)
+
+    buffer = DeliveryBuffer(
+        bm.pk,
+        size=settings.BROADCAST_DB_BATCH_SIZE,
+        interval=settings.BROADCAST_DB_FLUSH_INTERVAL,
+    )
+    budget = RedisRateBudget(
+        settings.BROADCAST_RATE_REDIS_URL,
+        f"broadcast:rate:{bot.id}",
+        rate=settings.BROADCAST_RATE_LIMIT,
+        share=bm.shard_parallelism,
+    )
+    sender = BroadcastSender(
+        send,
+        buffer.add,
+        on_attempt=AttemptLog(bm.pk).mark,
+        limiter=TelegramRateLimiter(
+            per_chat_interval=settings.BROADCAST_PER_CHAT_INTERVAL,
+            budget=budget,
+        ),
+        concurrency=settings.BROADCAST_CONCURRENCY,
+        # альбом = два запроса к Telegram: сам альбом и текст с кнопками после него
+        cost=2 if photos and len(photos) > 1 else 1,
+    )
+    claim = sync_to_async(claim_deliveries)
+    totals = {"ok": 0, "failed": 0, "blocked": 0}
+    try:
+        # Получателей забираем порциями: чекпоинт — это статусы доставок, плюс пульс после каждой порции
+        while chunk := await claim(bm.pk, lo, hi, settings.BROADCAST_DB_BATCH_SIZE):
+            totals = await sender.run(chunk)
+            await buffer.flush()
+            if not await sync_to_async(_heartbeat)(bm.pk, lease):
+                logger.warning("⏭ Рассылку %s перехватил новый запуск — шард [%s, %s) останавливается", bm.pk, lo, hi)
+                break
+        return totals
+    finally:
+        await buffer.flush()
+        await budget.close()
+
 @shared_task(name="core.tasks.convert_audio_to_mp3")
 def convert_audio_to_mp3_task(audio_id: int):
     try:
@@ -112,6 +331,9 @@ def convert_audio_to_mp3_task(audio_id: int):
 
         AudioSegment.from_file(ogg_path).export(mp3_path, format="mp3")
 
+        # новый mp3 — старый file_id в Telegram больше не про него
+        audio.telegram_file_id = None
+        audio.telegram_filename = None
         with open(mp3_path, "rb") as f:
             audio.mp3_file.save(os.path.basename(mp3_path), f, save=True)
 
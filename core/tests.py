@@ -1,3 +1,1379 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+from telegram import Chat, InputFile, Message, Update
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from telegram.ext import ApplicationBuilder, CommandHandler
+
+from .forms import BroadcastMessageForm
+from .models import (
+    ActionDailyCount,
+    AudienceSegment,
+    BroadcastAudio,
+    BroadcastDelivery,
+    BroadcastMessage,
+    BroadcastVote,
+    BroadcastVoteTally,
+    ClientAction,
+    FunnelDailyCount,
+    TelegramClient,
+    TelegramMediaFile,
+)
+from .tasks import (
+    _acquire_lease,
+    _run_broadcast,
+    attach_recipients,
+    export_csv,
+    finish_broadcast,
+    send_broadcast,
+    send_broadcast_shard,
+)
+from .utils import bot_pool, partitions, rollups
+from .utils.actions import ActionRecorder
+from .utils.client_cache import INVALIDATE_CHANNEL, ClientCache
+from .utils.clients import ClientUpserter, upsert_client
+from .utils.broadcast import BroadcastSender, DeliveryResult, TelegramRateLimiter, TokenBucket
+from .utils.deliveries import (
+    DeliveryBuffer,
+    interrupt_claimed,
+    precreate_deliveries,
+    precreate_segment_deliveries,
+)
+from .utils.selection import load_selection
+from .utils.telegram import CachedPhoto, PhotoSet, _send_async
+from .utils.texts import TextRegistry
+from .utils.updates import ChatOrderedProcessor, start_background, stop_background
+from .utils.votes import reconcile_vote_tallies, record_vote
+from tg_bots import webhook
+from tg_bots.bot_private.handlers.handler_vote import UPLOAD_LOCKS, send_vote_audio
+from tg_bots.bot_private.media_cache import MediaGalleries
+from tg_bots.fake_telegram import FakeBotAPI, FakeTelegram
+
+# Сессия, пользователь, count(), страница клиентов и одна предвыборка последних рассылок
+CHANGELIST_QUERY_BUDGET = 7
+
+
+class FakeBot:
+    """
+    Bot без сети: запоминает отправки и сколько их было в полёте одновременно;
+    ``failures[(метод, chat_id)]`` — исключения, которые выдать по очереди;
+    отправка в чаты из ``hang`` не завершается никогда (воркер «умер» посреди запроса).
+    """
+
+    id = 42
+
+    def __init__(self, failures=None, delay=0, hang=()):
+        self.calls = []
+        self.failures = {key: list(excs) for key, excs in (failures or {}).items()}
+        self.delay = delay
+        self.hang = set(hang)
+        self.hung = asyncio.Event()
+        self.in_flight = self.max_in_flight = 0
+        self._file_ids = itertools.count(1)
+
+    async def _call(self, method, chat_id):
+        if chat_id in self.hang:
+            self.hung.set()
+            await asyncio.Future()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        queue = self.failures.get((method, chat_id))
+        if queue:
+            raise queue.pop(0)
+        self.calls.append((method, chat_id))
+
+    def _photo_message(self):
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"file-{next(self._file_ids)}")])
+
+    async def send_message(self, chat_id, text, reply_markup=None, parse_mode=None):
+        await self._call("send_message", chat_id)
+        return SimpleNamespace(photo=[])
+
+    async def send_photo(self, chat_id, photo, caption=None, reply_markup=None, parse_mode=None):
+        await self._call("send_photo", chat_id)
+        return self._photo_message()
+
+    async def send_media_group(self, chat_id, media):
+        await self._call("send_media_group", chat_id)
+        return [self._photo_message() for _ in media]
+
+
+class NoWaitLimiter:
+    """Лимитер без ожиданий — для проверки логики повторов без реального времени."""
+
+    async def acquire(self, chat_id, tokens=1):
+        pass
+
+    def pause(self, seconds):
+        pass
+
+
+class BroadcastSenderTests(SimpleTestCase):
+    """Движок рассылки: пул воркеров, лимиты скорости, заблокировавшие бота и RetryAfter."""
+
+    def _run(self, bot, chat_ids, **kwargs):
+        results = []
+
+        async def send(chat_id, state):
+            await _send_async(bot, chat_id, "текст", None, None, None, state)
+
+        async def on_result(result):
+            results.append(result)
+
+        totals = asyncio.run(BroadcastSender(send, on_result, **kwargs).run([(1000 + c, c) for c in chat_ids]))
+        return totals, {r.chat_id: r.status for r in results}
+
+    def test_totals_and_each_chat_once(self):
+        bot = FakeBot(
+            {
+                ("send_message", 3): [Forbidden("Forbidden: bot was blocked by the user")],
+                ("send_message", 5): [RetryAfter(1)],
+                ("send_message", 7): [BadRequest("Chat not found")],
+            },
+            delay=0.001,
+        )
+        totals, statuses = self._run(bot, range(1, 41), limiter=NoWaitLimiter(), concurrency=8)
+        self.assertEqual(totals, {"ok": 38, "failed": 1, "blocked": 1})
+        self.assertEqual(len(statuses), 40)
+        self.assertEqual((statuses[3], statuses[5], statuses[7]), ("blocked", "sent", "failed"))
+        sent = Counter(chat_id for _, chat_id in bot.calls)
+        self.assertEqual(len(sent), 38)
+        self.assertEqual(set(sent.values()), {1})
+        self.assertLessEqual(bot.max_in_flight, 8)
+        self.assertGreater(bot.max_in_flight, 1)
+
+    def test_retry_after_gives_up(self):
+        bot = FakeBot({("send_message", 1): [RetryAfter(1)] * 3})
+        totals, statuses = self._run(bot, [1], limiter=NoWaitLimiter(), max_retries=2)
+        self.assertEqual(totals, {"ok": 0, "failed": 1, "blocked": 0})
+        self.assertEqual(bot.calls, [])
+
+    def test_global_rate(self):
+        limiter = TelegramRateLimiter(per_chat_interval=0, budget=TokenBucket(50, capacity=1))
+        started = time.monotonic()
+        totals, _ = self._run(FakeBot(), range(11), limiter=limiter, concurrency=11)
+        self.assertEqual(totals["ok"], 11)
+        self.assertGreaterEqual(time.monotonic() - started, 10 / 50 - 0.01)
+
+    def test_per_chat_interval(self):
+        limiter = TelegramRateLimiter(rate=1000, per_chat_interval=0.05)
+
+        async def three_to_one_chat():
+            for _ in range(3):
+                await limiter.acquire(1)
+
+        started = time.monotonic()
+        asyncio.run(three_to_one_chat())
+        self.assertGreaterEqual(time.monotonic() - started, 0.1 - 0.01)
+
+
+@override_settings(
+    BROADCAST_PER_CHAT_INTERVAL=0,
+    BROADCAST_RATE_LIMIT=1000,
+    BROADCAST_RATE_REDIS_URL="redis://127.0.0.1:1/0",
+    BROADCAST_DB_FLUSH_INTERVAL=0,
+)
+class BroadcastTaskTests(TransactionTestCase):
+    """Задачи рассылки целиком на поддельном Bot: итоги, отсутствие повторов и продолжение после падения."""
+
+    def setUp(self):
+        self.clients = TelegramClient.objects.bulk_create([TelegramClient(user_id=500 + i) for i in range(12)])
+        self.bm = BroadcastMessage.objects.create(text="msg", comment="движок", shard_size=5, shard_parallelism=2)
+        self.bm.recipients.add(*self.clients)
+        self.bot = FakeBot({("send_message", 503): [Forbidden("Forbidden: bot was blocked by the user")]})
+        patcher = mock.patch("core.tasks.bot_pool.get_bot", mock.AsyncMock(return_value=self.bot))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _statuses(self):
+        return Counter(BroadcastDelivery.objects.filter(message=self.bm).values_list("status", flat=True))
+
+    def _finish(self):
+        finish_broadcast([], self.bm.pk)
+        self.bm.refresh_from_db()
+        return self.bm.ok_count, self.bm.failed_count, self.bm.blocked_count
+
+    def test_shard_totals_and_no_resend(self):
+        precreate_deliveries(self.bm.pk)
+        totals = send_broadcast_shard.apply(args=[self.bm.pk, None, None]).get()
+        self.assertEqual(totals, {"ok": 11, "failed": 0, "blocked": 1})
+        self.assertEqual(self._statuses(), {"sent": 11, "blocked": 1})
+        send_broadcast_shard.apply(args=[self.bm.pk, None, None]).get()
+        self.assertEqual(len(self.bot.calls), 11)
+        self.assertEqual(self._finish(), (11, 0, 1))
+        self.assertTrue(self.bm.sent)
+
+    def test_resume_after_crash(self):
+        precreate_deliveries(self.bm.pk)
+        ids = [c.pk for c in self.clients]
+        # Воркер упал: три доставки успели уйти, две были в полёте
+        BroadcastDelivery.objects.filter(message=self.bm, recipient_id__in=ids[:3]).update(status="sent")
+        BroadcastDelivery.objects.filter(message=self.bm, recipient_id__in=ids[5:7]).update(status="sending")
+        # взятые шардом, но не начатые — отправляются после перезапуска
+        BroadcastDelivery.objects.filter(message=self.bm, recipient_id__in=ids[7:9]).update(status="claimed")
+        send_broadcast_shard.apply(args=[self.bm.pk, None, None]).get()
+        resent = {chat_id for _, chat_id in self.bot.calls}
+        self.assertEqual(resent, {c.user_id for c in self.clients[3:5] + self.clients[7:]} - {503})
+        self.assertEqual(
+            set(BroadcastDelivery.objects.filter(message=self.bm, status="failed").values_list("recipient_id", flat=True)),
+            set(ids[5:7]),
+        )
+        self.assertEqual(self._finish(), (9, 2, 1))
+
+    def test_send_broadcast_shards_and_lease(self):
+        with mock.patch("core.tasks.chord") as chord:
+            send_broadcast.apply(args=[self.bm.pk]).get()
+            send_broadcast.apply(args=[self.bm.pk]).get()
+        # Второй запуск, пока у рассылки свежий пульс, ничего не делает
+        chord.assert_called_once()
+        lanes = chord.call_args.args[0].tasks
+        self.assertEqual(len(lanes), 2)
+        self.assertEqual(self._statuses(), {"pending": 12})
+
+    @override_settings(BROADCAST_CONCURRENCY=1)
+    def test_shard_killed_mid_chunk(self):
+        precreate_deliveries(self.bm.pk)
+        self.bot.hang = {505}
+
+        async def killed():
+            shard = asyncio.ensure_future(_run_broadcast(self.bm, None, None, None, None))
+            await self.bot.hung.wait()
+            shard.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await shard
+
+        bot_pool.run(killed())
+        # вся порция взята шардом, но до Telegram дошли только получатели до зависшего запроса
+        self.assertEqual(self._statuses(), {"sent": 4, "blocked": 1, "sending": 1, "claimed": 6})
+        self.bot.hang.clear()
+        send_broadcast_shard.apply(args=[self.bm.pk, None, None]).get()
+        sent = Counter(chat_id for _, chat_id in self.bot.calls)
+        self.assertEqual(set(sent), {500, 501, 502, 504, *range(506, 512)})
+        self.assertEqual(set(sent.values()), {1})
+        failed = BroadcastDelivery.objects.filter(message=self.bm, status="failed")
+        self.assertEqual(list(failed.values_list("recipient__user_id", flat=True)), [505])
+        self.assertEqual(self._finish(), (10, 1, 1))
+
+    def test_superseded_run_does_nothing(self):
+        precreate_deliveries(self.bm.pk)
+        old = _acquire_lease(self.bm.pk)
+        # шарды первого запуска простояли в очереди дольше аренды — рассылку подхватил новый запуск
+        BroadcastMessage.objects.filter(pk=self.bm.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        new = _acquire_lease(self.bm.pk)
+        self.assertNotEqual(old, new)
+        BroadcastDelivery.objects.filter(message=self.bm, recipient=self.clients[0]).update(status="sending")
+        self.assertIsNone(send_broadcast_shard.apply(args=[self.bm.pk, None, None, old]).get())
+        finish_broadcast([], self.bm.pk, old)
+        self.assertEqual(self.bot.calls, [])
+        self.assertEqual(self._statuses(), {"pending": 11, "sending": 1})
+        self.bm.refresh_from_db()
+        self.assertFalse(self.bm.sent)
+        send_broadcast_shard.apply(args=[self.bm.pk, None, None, new]).get()
+        self.assertEqual(len(self.bot.calls), 10)
+
+    def test_resend_goes_to_new_recipients_only(self):
+        precreate_deliveries(self.bm.pk)
+        send_broadcast_shard.apply(args=[self.bm.pk, None, None]).get()
+        self._finish()
+        late = TelegramClient.objects.create(user_id=600)
+        self.bm.recipients.add(late)
+        with mock.patch("core.tasks.chord") as chord:
+            send_broadcast.apply(args=[self.bm.pk]).get()
+        chord.assert_called_once()
+        self.assertEqual(self._statuses(), {"sent": 11, "blocked": 1, "pending": 1})
+        lease = chord.return_value.call_args.args[0].args[1]
+        send_broadcast_shard.apply(args=[self.bm.pk, None, None, lease]).get()
+        self.assertEqual(self.bot.calls[11:], [("send_message", 600)])
+        finish_broadcast([], self.bm.pk, lease)
+        self.bm.refresh_from_db()
+        self.assertEqual((self.bm.sent, self.bm.ok_count), (True, 12))
+
+    def test_interrupt_claimed_in_shard_range(self):
+        precreate_deliveries(self.bm.pk)
+        ids = sorted(c.pk for c in self.clients)
+        BroadcastDelivery.objects.filter(message=self.bm).update(status="sending")
+        self.assertEqual(interrupt_claimed(self.bm.pk, ids[0], ids[4]), 4)
+        self.assertEqual(self._statuses(), {"failed": 4, "sending": 8})
+
+
+class DeliveryBufferTests(TestCase):
+    """Буфер статусов: сброс по размеру и по времени, upsert поверх уже созданных доставок."""
+
+    def setUp(self):
+        self.message = BroadcastMessage.objects.create(text="msg")
+        self.clients = TelegramClient.objects.bulk_create([TelegramClient(user_id=16000 + i) for i in range(3)])
+
+    def result(self, client, status="sent", error=""):
+        return DeliveryResult(client.pk, client.user_id, status, error)
+
+    def statuses(self):
+        return dict(BroadcastDelivery.objects.filter(message=self.message).values_list("recipient_id", "status"))
+
+    def test_flush_on_size(self):
+        buffer = DeliveryBuffer(self.message.pk, size=3, interval=3600)
+
+        async def run():
+            for client in self.clients[:2]:
+                await buffer.add(self.result(client))
+            # пока пачка не набрана, в БД ничего не пишется
+            self.assertEqual(await sync_to_async(self.statuses)(), {})
+            await buffer.add(self.result(self.clients[2]))
+
+        async_to_sync(run)()
+        self.assertEqual(self.statuses(), {client.pk: "sent" for client in self.clients})
+
+    def test_flush_on_interval(self):
+        buffer = DeliveryBuffer(self.message.pk, size=500, interval=0.05)
+
+        async def run():
+            await buffer.add(self.result(self.clients[0]))
+            self.assertEqual(await sync_to_async(self.statuses)(), {})
+            await asyncio.sleep(0.06)
+            await buffer.add(self.result(self.clients[1]))
+
+        async_to_sync(run)()
+        self.assertEqual(self.statuses(), {self.clients[0].pk: "sent", self.clients[1].pk: "sent"})
+
+    def test_upsert_over_precreated_rows(self):
+        self.message.recipients.set(self.clients)
+        precreate_deliveries(self.message.pk)
+        before = BroadcastDelivery.objects.get(message=self.message, recipient=self.clients[0]).sent_at
+        buffer = DeliveryBuffer(self.message.pk, size=500, interval=3600)
+
+        async def run():
+            await buffer.add(self.result(self.clients[0], "failed", "timeout"))
+            # повтор того же получателя в пачке: остаётся последний статус
+            await buffer.add(self.result(self.clients[0]))
+            await buffer.add(self.result(self.clients[1], "blocked", "Forbidden"))
+            await buffer.flush()
+
+        with CaptureQueriesContext(connection) as queries:
+            async_to_sync(run)()
+        self.assertEqual(len(queries), 1)
+        self.assertIn("ON CONFLICT", queries[0]["sql"])
+        self.assertEqual(BroadcastDelivery.objects.filter(message=self.message).count(), 3)
+        self.assertEqual(
+            self.statuses(),
+            {self.clients[0].pk: "sent", self.clients[1].pk: "blocked", self.clients[2].pk: "pending"},
+        )
+        row = BroadcastDelivery.objects.get(message=self.message, recipient=self.clients[1])
+        self.assertEqual(row.error_message, "Forbidden")
+        self.assertGreater(BroadcastDelivery.objects.get(message=self.message, recipient=self.clients[0]).sent_at, before)
+
+
+class PoolBot:
+    """Bot без сети для пула: считает initialize/shutdown."""
+
+    def __init__(self, token, request):
+        self.token = token
+        self.initialized = self.closed = 0
+
+    async def initialize(self):
+        await asyncio.sleep(0.01)
+        self.initialized += 1
+
+    async def shutdown(self):
+        self.closed += 1
+
+
+@override_settings(TELEGRAM_BOT_TOKEN_PRIVATE="1:private")
+class BotPoolTests(TransactionTestCase):
+    """Пул ботов: один loop на процесс, один Bot на токен, закрытие по сигналу остановки воркера."""
+
+    def setUp(self):
+        patcher = mock.patch("core.utils.bot_pool.Bot", PoolBot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(bot_pool.shutdown)
+
+    def test_one_loop_per_process(self):
+        async def loop_and_thread():
+            return asyncio.get_running_loop(), threading.current_thread().name
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(bot_pool.run(loop_and_thread()))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({loop for loop, _ in results}), 1)
+        self.assertEqual({name for _, name in results}, {"telegram-bot-pool"})
+
+    def test_one_client_per_token(self):
+        async def bots():
+            same = await asyncio.gather(*(bot_pool.get_bot() for _ in range(5)))
+            return same, await bot_pool.get_bot("2:other")
+
+        same, other = bot_pool.run(bots())
+        self.assertEqual(len({id(bot) for bot in same}), 1)
+        self.assertEqual((same[0].token, same[0].initialized), ("1:private", 1))
+        self.assertIsNot(other, same[0])
+        self.assertIs(bot_pool.run(bot_pool.get_bot()), same[0])
+
+    def test_worker_process_shutdown_closes_clients(self):
+        from celery.signals import worker_process_shutdown
+
+        bot = bot_pool.run(bot_pool.get_bot())
+        loop = bot_pool._ensure_loop()
+        worker_process_shutdown.send(sender=None, pid=os.getpid(), exitcode=0)
+        self.assertEqual(bot.closed, 1)
+        self.assertTrue(loop.is_closed())
+        # следующий запуск в том же процессе поднимает пул заново
+        self.assertIsNot(bot_pool.run(bot_pool.get_bot()), bot)
+
+    def test_db_connection_closed_after_run(self):
+        def query():
+            TelegramClient.objects.count()
+            return connections["default"]
+
+        wrapper = bot_pool.run(sync_to_async(query)())
+        self.assertIsNot(wrapper, connections["default"])
+        self.assertIsNone(wrapper.connection)
+
+
+class AlbumRetryTests(SimpleTestCase):
+    """RetryAfter на тексте после альбома не приводит к повторной отправке альбома."""
+
+    def test_album_is_not_resent(self):
+        bot = FakeBot({("send_message", 1): [RetryAfter(1)]})
+        photos = PhotoSet([CachedPhoto("a.jpg", data=b"a"), CachedPhoto("b.jpg", data=b"b")])
+        results = []
+
+        async def send(chat_id, state):
+            await _send_async(bot, chat_id, "текст", None, photos, None, state)
+
+        async def on_result(result):
+            results.append(result)
+
+        sender = BroadcastSender(send, on_result, limiter=NoWaitLimiter())
+        totals = asyncio.run(sender.run([(10, 1)]))
+        self.assertEqual(totals, {"ok": 1, "failed": 0, "blocked": 0})
+        self.assertEqual(bot.calls, [("send_media_group", 1), ("send_message", 1)])
+        # после первой загрузки фото уходят по file_id
+        self.assertEqual([p.file_id for p in photos.photos], ["file-1", "file-2"])
+
+
+class VoteAudioUploadTests(TestCase):
+    """Одновременные голоса до появления file_id: mp3 загружается в Telegram один раз, остальные идут по id."""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        os.makedirs(f"{media.name}/voice_mp3")
+        with open(f"{media.name}/voice_mp3/choice.mp3", "wb") as f:
+            f.write(b"mp3")
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        message = BroadcastMessage.objects.create(text="msg", comment="голосование")
+        self.audio = BroadcastAudio.objects.create(
+            message=message, choice_number=1, file="voice/choice.ogg", mp3_file="voice_mp3/choice.mp3"
+        )
+        self.uploads, self.by_id = 0, 0
+
+    async def send_audio(self, chat_id, audio, caption=None, parse_mode=None):
+        await asyncio.sleep(0.01)
+        if isinstance(audio, InputFile):
+            self.uploads += 1
+            return SimpleNamespace(audio=SimpleNamespace(file_id="audio-1"))
+        self.by_id += 1
+        return SimpleNamespace(audio=None)
+
+    def test_single_upload(self):
+        bot = SimpleNamespace(send_audio=self.send_audio)
+
+        async def vote_all():
+            await asyncio.gather(*(send_vote_audio(bot, chat_id, self.audio) for chat_id in range(5)))
+
+        async_to_sync(vote_all)()
+        self.assertEqual((self.uploads, self.by_id), (1, 4))
+        self.audio.refresh_from_db()
+        self.assertEqual(self.audio.telegram_file_id, "audio-1")
+        # лок загрузки не переживает саму загрузку
+        self.assertEqual(UPLOAD_LOCKS, {})
+
+
+class GalleryBot(FakeBot):
+    """FakeBot, который запоминает, чем ушло каждое фото альбома: байтами или по file_id."""
+
+    def __init__(self):
+        super().__init__()
+        self.albums = []
+
+    async def send_media_group(self, chat_id, media):
+        self.albums.append(["id" if isinstance(m.media, str) else "upload" for m in media])
+        return await super().send_media_group(chat_id, media)
+
+
+class MediaGalleriesTests(TestCase):
+    """Галереи бота: загрузка в Telegram один раз, дальше file_id из БД, перечитывание изменённых файлов."""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.base_dir = Path(media.name)
+        self.paths = [self.base_dir / "a.jpg", self.base_dir / "b.jpg"]
+        for path in self.paths:
+            path.write_bytes(path.name.encode())
+
+    def galleries(self):
+        galleries = MediaGalleries(self.base_dir, {"about": self.paths})
+        galleries.load()
+        return galleries
+
+    def test_upload_once_then_file_id(self):
+        galleries, bot = self.galleries(), GalleryBot()
+        async_to_sync(galleries.send)(bot, 1, "about")
+        async_to_sync(galleries.send)(bot, 2, "about")
+        self.assertEqual(bot.albums, [["upload", "upload"], ["id", "id"]])
+        self.assertEqual(
+            dict(TelegramMediaFile.objects.values_list("path", "file_id")),
+            {"a.jpg": "file-1", "b.jpg": "file-2"},
+        )
+
+        # после перезапуска id берутся из БД — повторной загрузки нет
+        bot = GalleryBot()
+        async_to_sync(self.galleries().send)(bot, 3, "about")
+        self.assertEqual(bot.albums, [["id", "id"]])
+
+    def test_changed_file_is_reuploaded(self):
+        galleries, bot = self.galleries(), GalleryBot()
+        async_to_sync(galleries.send)(bot, 1, "about")
+        self.paths[0].write_bytes(b"new picture")
+
+        async def rescan():
+            before = galleries._signatures["about"]
+            watcher = asyncio.create_task(galleries.watch(interval=0))
+            try:
+                for _ in range(200):
+                    if galleries._signatures["about"] != before:
+                        break
+                    await asyncio.sleep(0.01)
+            finally:
+                watcher.cancel()
+            await galleries.send(bot, 2, "about")
+
+        async_to_sync(rescan)()
+        # изменённый файл загружается заново, неизменённый по-прежнему уходит по id
+        self.assertEqual(bot.albums, [["upload", "upload"], ["upload", "id"]])
+        self.assertEqual(TelegramMediaFile.objects.get(path="a.jpg").file_id, "file-3")
+
+
+class TextRegistryTests(SimpleTestCase):
+    """Горячая перезагрузка текстов: правка файла подхватывается, битый файл не ломает текущие тексты."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "greeting.txt"
+        self.path.write_text("Привет\n", encoding="utf-8")
+        self.texts = TextRegistry(directory.name)
+        self.texts.load()
+        self.version = self.path.stat().st_mtime_ns
+
+    def edit(self, data):
+        self.path.write_bytes(data)
+        # mtime_ns гарантированно новый, даже если запись попала в тот же тик часов
+        self.version += 1_000_000
+        os.utime(self.path, ns=(self.version, self.version))
+
+    def watch_once(self):
+        async def run():
+            watcher = asyncio.create_task(self.texts.watch(interval=0))
+            for _ in range(20):
+                await asyncio.sleep(0.01)
+            watcher.cancel()
+
+        asyncio.run(run())
+
+    def test_edited_file_is_served(self):
+        self.assertEqual(self.texts.get("greeting"), "Привет")
+        self.edit("Здравствуйте\n".encode())
+        self.watch_once()
+        self.assertEqual(self.texts.get("greeting"), "Здравствуйте")
+
+    def test_bad_file_keeps_previous_texts(self):
+        self.edit(b"\xff\xfe not utf-8")
+        with self.assertLogs("core.utils.texts", "ERROR"):
+            self.watch_once()
+        self.assertEqual(self.texts.get("greeting"), "Привет")
+
+        # исправленный файл подхватывается на следующем опросе
+        self.edit("Исправлено".encode())
+        self.watch_once()
+        self.assertEqual(self.texts.get("greeting"), "Исправлено")
+
+
+class ActionRecorderTests(TransactionTestCase):
+    """Журнал действий пишется пачками; строку, которую БД отвергла, не откладывают в spool навсегда."""
+
+    def setUp(self):
+        self.spool = tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False).name
+        os.remove(self.spool)
+        self.recorder = ActionRecorder(self.spool)
+        self.kept, self.deleted = TelegramClient.objects.bulk_create(
+            [TelegramClient(user_id=11000), TelegramClient(user_id=11001)]
+        )
+
+    def tearDown(self):
+        if os.path.exists(self.spool):
+            os.remove(self.spool)
+
+    def test_client_deleted_while_buffered(self):
+        self.recorder.record(self.kept, "start_private")
+        self.recorder.record(self.deleted, "start_private")
+        self.deleted.delete()
+        async_to_sync(self.recorder.flush)()
+        self.assertEqual(list(ClientAction.objects.values_list("client_id", flat=True)), [self.kept.pk])
+        self.assertFalse(os.path.exists(self.spool))
+        self.recorder.record(self.kept, "clicked_payment")
+        async_to_sync(self.recorder.flush)()
+        self.assertEqual(ClientAction.objects.count(), 2)
+
+    def test_spooled_batch_with_bad_row_is_replayed(self):
+        self.recorder._spool([(self.kept.pk, "a", timezone.now()), (self.deleted.pk + 1000, "b", timezone.now())])
+        with mock.patch.object(ClientAction.objects, "bulk_create", side_effect=OperationalError("down")):
+            self.recorder._write([(self.kept.pk, "c", timezone.now())])
+        self.assertEqual(ClientAction.objects.count(), 0)
+        self.recorder._write([(self.kept.pk, "d", timezone.now())])
+        self.assertEqual(sorted(ClientAction.objects.values_list("action", flat=True)), ["a", "c", "d"])
+        self.assertFalse(os.path.exists(self.spool))
+
+
+@override_settings(TELEGRAM_WEBHOOK_SECRET="webhook-secret", TELEGRAM_WEBHOOK_BOTS=["private"])
+class WebhookTests(SimpleTestCase):
+    """Вебхук: апдейт без секрета или с чужим секретом отклоняется, настоящий доходит до хендлера бота."""
+
+    def _application(self, received):
+        async def start(update, context):
+            received.put_nowait(update)
+
+        app = ApplicationBuilder().token("1:fake").request(FakeBotAPI()).updater(None).build()
+        app.add_handler(CommandHandler("start", start))
+        return app
+
+    async def _run(self, scenario):
+        received = asyncio.Queue()
+        module = SimpleNamespace(build_application=lambda: self._application(received))
+        with mock.patch("tg_bots.webhook.import_module", return_value=module):
+            try:
+                await scenario(received)
+            finally:
+                await webhook.shutdown_applications()
+
+    async def test_secret_is_required(self):
+        async def scenario(received):
+            for secret in (None, "wrong"):
+                response = await FakeTelegram("private", secret).send(100, "/start")
+                self.assertEqual(response.status_code, 403)
+            self.assertTrue(received.empty())
+
+        await self._run(scenario)
+
+    async def test_update_is_dispatched(self):
+        async def scenario(received):
+            telegram = FakeTelegram("private", "webhook-secret")
+            response = await telegram.send(100, "/start")
+            self.assertEqual(response.status_code, 200)
+            update = await asyncio.wait_for(received.get(), 5)
+            self.assertEqual((update.effective_user.id, update.message.text), (100, "/start"))
+            self.assertEqual((await FakeTelegram("course", "webhook-secret").send(100, "/start")).status_code, 404)
+
+        await self._run(scenario)
+
+    async def test_background_tasks_stop_on_shutdown(self):
+        started = []
+
+        async def post_init(app):
+            start_background(app, "watcher", asyncio.Event().wait())
+            started.extend(app.bot_data["background"].values())
+
+        async def post_shutdown(app):
+            await stop_background(app)
+
+        app = (
+            ApplicationBuilder().token("1:fake").request(FakeBotAPI()).updater(None)
+            .post_init(post_init).post_shutdown(post_shutdown).build()
+        )
+        with mock.patch("tg_bots.webhook.import_module", return_value=SimpleNamespace(build_application=lambda: app)):
+            await webhook.get_application("private")
+            await webhook.shutdown_applications()
+        self.assertEqual(len(started), 1)
+        self.assertTrue(started[0].cancelled())
+        self.assertNotIn("background", app.bot_data)
+
+
+class ChatOrderedProcessorTests(SimpleTestCase):
+    """Апдейты одного чата обрабатываются по очереди, разных чатов — параллельно в пределах лимита."""
+
+    @staticmethod
+    def _update(update_id, chat_id):
+        chat = Chat(chat_id, Chat.PRIVATE)
+        return Update(update_id, message=Message(update_id, timezone.now(), chat))
+
+    def _process(self, processor, *updates):
+        """Как Application: каждый апдейт — отдельная задача, в порядке поступления. Возвращает журнал событий."""
+        events = []
+
+        async def handler(name, delay):
+            events.append(f"{name}:start")
+            await asyncio.sleep(delay)
+            events.append(f"{name}:end")
+
+        async def feed():
+            async with processor:
+                await asyncio.gather(*(
+                    asyncio.create_task(processor.process_update(self._update(n, chat_id), handler(name, delay)))
+                    for n, (name, chat_id, delay) in enumerate(updates)
+                ))
+
+        asyncio.run(feed())
+        return events
+
+    def test_same_chat_in_order(self):
+        processor = ChatOrderedProcessor(2)
+        events = self._process(processor, ("a1", 1, 0.05), ("a2", 1, 0), ("b1", 2, 0))
+        self.assertLess(events.index("a1:end"), events.index("a2:start"))
+        # пока первый апдейт чата 1 ждёт, второй не занимает слот — чат 2 обрабатывается сразу
+        self.assertLess(events.index("b1:end"), events.index("a1:end"))
+        self.assertEqual(processor.stats()["current"], 0)
+
+    def test_limit(self):
+        events = self._process(ChatOrderedProcessor(1), ("a1", 1, 0.02), ("b1", 2, 0))
+        self.assertEqual(events, ["a1:start", "a1:end", "b1:start", "b1:end"])
+
+
+class ClientUpsertTests(TestCase):
+    """upsert_client: одна вставка со значениями по умолчанию из модели, обновление только изменившегося профиля."""
+
+    def _ctid(self, user_id):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT ctid::text FROM core_telegramclient WHERE user_id = %s", [user_id])
+            return cursor.fetchone()[0]
+
+    def test_create_uses_model_defaults(self):
+        client = upsert_client(7001, "ann", "Ann", None, "private")
+        stored = TelegramClient.objects.get(user_id=7001)
+        self.assertEqual(client.pk, stored.pk)
+        defaults = TelegramClient()
+        for field in TelegramClient._meta.concrete_fields:
+            if field.has_default():
+                self.assertEqual(getattr(stored, field.attname), getattr(defaults, field.attname), field.name)
+        self.assertEqual((stored.username, stored.bot_source), ("ann", "private"))
+        self.assertIsNotNone(stored.created_at)
+
+    def test_update_keeps_bot_source(self):
+        created = upsert_client(7002, "old", "Ann", None, "private")
+        updated = upsert_client(7002, "new", "Ann", "Lee", "public")
+        self.assertEqual(updated.pk, created.pk)
+        self.assertEqual((updated.username, updated.last_name, updated.bot_source), ("new", "Lee", "private"))
+        self.assertEqual(TelegramClient.objects.get(user_id=7002).username, "new")
+
+    def test_unchanged_profile_does_not_rewrite_row(self):
+        created = upsert_client(7003, "ann", "Ann", None, "private")
+        before = self._ctid(7003)
+        again = upsert_client(7003, "ann", "Ann", None, "private")
+        # UPDATE создал бы новую версию строки на новом месте
+        self.assertEqual(self._ctid(7003), before)
+        self.assertEqual((again.pk, again.username), (created.pk, "ann"))
+
+
+class FakePubSub:
+    """Подписка Redis без сервера: сообщения кладутся в ``queue``."""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.channels = []
+
+    def pubsub(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def subscribe(self, channel):
+        self.channels.append(channel)
+
+    async def listen(self):
+        while True:
+            yield await self.queue.get()
+
+
+class ClientCacheTests(TestCase):
+    """Кэш клиентов бота: попадания и отсутствующие клиенты не ходят в БД, инвалидация приходит через pub/sub."""
+
+    def setUp(self):
+        self.cache = ClientCache(ttl=60)
+        self.client_row = TelegramClient.objects.create(user_id=8001, username="ann")
+
+    def test_hits_and_misses_are_cached(self):
+        get = async_to_sync(self.cache.get)
+        with self.assertNumQueries(2):
+            self.assertEqual(get(8001).pk, self.client_row.pk)
+            self.assertIsNone(get(8002))
+        with self.assertNumQueries(0):
+            self.assertEqual(get(8001).pk, self.client_row.pk)
+            self.assertIsNone(get(8002))
+        # /start кладёт нового клиента поверх отметки «нет в БД»
+        created = TelegramClient.objects.create(user_id=8002)
+        self.cache.put(created)
+        with self.assertNumQueries(0):
+            self.assertEqual(get(8002).pk, created.pk)
+
+    def test_invalidation_through_pubsub(self):
+        redis_conn = FakePubSub()
+
+        async def scenario():
+            with mock.patch("core.utils.client_cache.aioredis.from_url", return_value=redis_conn):
+                listener = asyncio.ensure_future(self.cache.listen("redis://fake"))
+                await asyncio.sleep(0.01)
+                self.cache.put(self.client_row)
+                self.cache.put(TelegramClient(user_id=8003))
+                await redis_conn.queue.put({"type": "message", "data": b"8001"})
+                await asyncio.sleep(0.01)
+                listener.cancel()
+
+        async_to_sync(scenario)()
+        self.assertEqual(redis_conn.channels, [INVALIDATE_CHANNEL])
+        self.assertNotIn(8001, self.cache._cache)
+        self.assertIn(8003, self.cache._cache)
+
+
+class ClientUpserterTests(SimpleTestCase):
+    """ClientUpserter: одновременные /start делят один запрос, повтор с тем же профилем в окне не идёт в БД."""
+
+    def setUp(self):
+        self.calls = []
+
+        def upsert(user_id, username, first_name, last_name, bot_source):
+            time.sleep(0.02)
+            self.calls.append((user_id, username))
+            return SimpleNamespace(user_id=user_id, username=username)
+
+        patcher = mock.patch("core.utils.clients.upsert_client", upsert)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _user(user_id, username):
+        return SimpleNamespace(id=user_id, username=username, first_name="Ann", last_name=None)
+
+    def test_concurrent_and_repeated(self):
+        upserter = ClientUpserter("private", window=0.2)
+
+        async def scenario():
+            same = await asyncio.gather(*(upserter.upsert(self._user(1, "ann")) for _ in range(5)))
+            cached = await upserter.upsert(self._user(1, "ann"))
+            renamed = await upserter.upsert(self._user(1, "anna"))
+            await asyncio.sleep(0.25)
+            expired = await upserter.upsert(self._user(1, "anna"))
+            return same, cached, renamed, expired
+
+        same, cached, renamed, expired = async_to_sync(scenario)()
+        self.assertEqual(len({id(client) for client in same}), 1)
+        self.assertIs(cached, same[0])
+        self.assertEqual(renamed.username, "anna")
+        self.assertEqual(self.calls, [(1, "ann"), (1, "anna"), (1, "anna")])
+        self.assertEqual(upserter._pending, {})
+
+
+class VoteTallyTests(TestCase):
+    """Счётчики голосов: сверка исправляет расхождения разницей и не теряет параллельные голоса."""
+
+    def setUp(self):
+        self.message = BroadcastMessage.objects.create(text="msg", comment="голосование")
+        self.clients = TelegramClient.objects.bulk_create([TelegramClient(user_id=14000 + i) for i in range(4)])
+        for client, choice in zip(self.clients, [1, 1, 2, 2]):
+            record_vote(client.pk, self.message.pk, choice)
+
+    def _tallies(self):
+        return dict(BroadcastVoteTally.objects.filter(message=self.message).values_list("choice_number", "votes"))
+
+    def test_reconcile_fixes_drift(self):
+        self.assertEqual(self._tallies(), {1: 2, 2: 2})
+        BroadcastVote.objects.filter(client=self.clients[0]).delete()
+        BroadcastVoteTally.objects.filter(message=self.message, choice_number=2).delete()
+        BroadcastVoteTally.objects.create(message=self.message, choice_number=3, votes=5)
+        self.assertEqual(reconcile_vote_tallies(), 3)
+        self.assertEqual(self._tallies(), {1: 1, 2: 2, 3: 0})
+        self.assertEqual(reconcile_vote_tallies(), 0)
+
+    def test_double_tap_counts_once(self):
+        client = self.clients[0]
+        self.assertFalse(record_vote(client.pk, self.message.pk, 1))
+        # второе нажатие на другую кнопку тоже ничего не меняет: первый голос окончательный
+        self.assertFalse(record_vote(client.pk, self.message.pk, 2))
+        self.assertEqual(BroadcastVote.objects.filter(message=self.message, client=client).count(), 1)
+        self.assertEqual(self._tallies(), {1: 2, 2: 2})
+
+
+class VoteTallyRaceTests(TransactionTestCase):
+    """Голос, закоммиченный во время сверки, не теряется: сверка прибавляет разницу к текущему счётчику."""
+
+    def test_vote_during_reconcile(self):
+        message = BroadcastMessage.objects.create(text="msg", comment="голосование")
+        first, second, late = TelegramClient.objects.bulk_create([TelegramClient(user_id=14100 + i) for i in range(3)])
+        record_vote(first.pk, message.pk, 1)
+        record_vote(second.pk, message.pk, 1)
+        BroadcastVote.objects.filter(client=first).delete()
+        voted = threading.Event()
+
+        def vote_and_commit_later():
+            with transaction.atomic():
+                record_vote(late.pk, message.pk, 1)
+                voted.set()
+                # Сверка уже взяла снимок и ждёт блокировку строки счётчика
+                time.sleep(0.3)
+            connection.close()
+
+        thread = threading.Thread(target=vote_and_commit_later)
+        thread.start()
+        voted.wait()
+        reconcile_vote_tallies()
+        thread.join()
+        self.assertEqual(BroadcastVoteTally.objects.get(message=message, choice_number=1).votes, 2)
+
+    def test_simultaneous_double_tap(self):
+        message = BroadcastMessage.objects.create(text="msg", comment="голосование")
+        client = TelegramClient.objects.create(user_id=14200)
+        start = threading.Barrier(2)
+        recorded = []
+
+        def tap():
+            start.wait()
+            recorded.append(record_vote(client.pk, message.pk, 1))
+            connection.close()
+
+        threads = [threading.Thread(target=tap) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(recorded), [False, True])
+        self.assertEqual(BroadcastVote.objects.filter(message=message).count(), 1)
+        self.assertEqual(BroadcastVoteTally.objects.get(message=message, choice_number=1).votes, 1)
+
+
+class AudienceSegmentTests(TestCase):
+    """Сегмент выбирает клиентов по фильтрам; его доставки не дублируют уже выбранных вручную получателей."""
+
+    def setUp(self):
+        now = timezone.now()
+        (
+            self.paid_active, self.paid_stale, self.other_bot, self.blocked, self.direct_only,
+        ) = TelegramClient.objects.bulk_create([
+            TelegramClient(user_id=15000 + i, bot_source=source, is_blocked=blocked)
+            for i, (source, blocked) in enumerate([
+                ("private", False), ("private", False), ("public", False), ("private", True), ("public", False),
+            ])
+        ])
+        ClientAction.objects.bulk_create([
+            ClientAction(client=self.paid_active, action="clicked_payment_card", timestamp=now - timedelta(days=1)),
+            ClientAction(client=self.paid_stale, action="clicked_payment_card", timestamp=now - timedelta(days=30)),
+            ClientAction(client=self.other_bot, action="clicked_payment_card", timestamp=now),
+            ClientAction(client=self.blocked, action="clicked_payment_card", timestamp=now),
+            ClientAction(client=self.paid_stale, action="opened_menu", timestamp=now),
+        ])
+        self.segment = AudienceSegment.objects.create(
+            name="нажали оплату", bot_source="private", active_within_days=7, action_prefix="clicked_payment",
+        )
+
+    def test_segment_filters(self):
+        self.assertEqual(list(self.segment.clients()), [self.paid_active])
+        self.segment.bot_source = ""
+        self.segment.is_blocked = None
+        self.assertEqual(set(self.segment.clients()), {self.paid_active, self.other_bot, self.blocked})
+
+    def test_segment_deliveries_skip_direct_recipients(self):
+        self.segment.bot_source = ""
+        self.segment.save()
+        message = BroadcastMessage.objects.create(text="msg", segment=self.segment)
+        message.recipients.set([self.paid_active, self.direct_only])
+        self.assertEqual(precreate_deliveries(message.pk), 2)
+        # paid_active уже есть среди прямых получателей — ON CONFLICT его пропускает
+        self.assertEqual(precreate_segment_deliveries(message.pk, self.segment.clients()), 1)
+        self.assertEqual(precreate_segment_deliveries(message.pk, self.segment.clients()), 0)
+        self.assertEqual(
+            set(BroadcastDelivery.objects.filter(message=message).values_list("recipient_id", flat=True)),
+            {self.paid_active.pk, self.direct_only.pk, self.other_bot.pk},
+        )
+
+
+class TelegramClientChangelistTests(TestCase):
+    """Список клиентов в админке рендерится за постоянное число запросов, сколько бы ни было строк."""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(self.admin)
+        self.url = reverse("admin:core_telegramclient_changelist")
+        self.broadcasts = [BroadcastMessage.objects.create(text=f"msg {i}", comment=f"рассылка {i}") for i in range(5)]
+
+    def _add_clients(self, count, start):
+        clients = TelegramClient.objects.bulk_create(
+            [TelegramClient(user_id=start + i, username=f"user{start + i}") for i in range(count)]
+        )
+        BroadcastDelivery.objects.bulk_create(
+            [BroadcastDelivery(message=m, recipient=c, status="sent") for c in clients for m in self.broadcasts]
+        )
+        return clients
+
+    def _changelist_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_constant(self):
+        self._add_clients(2, start=1000)
+        small = self._changelist_queries()
+        self._add_clients(98, start=2000)
+        large = self._changelist_queries()
+        self.assertEqual(large, small)
+        self.assertLessEqual(large, CHANGELIST_QUERY_BUDGET)
+
+    def test_annotations(self):
+        client = self._add_clients(1, start=3000)[0]
+        model_admin = admin.site._registry[TelegramClient]
+        request = RequestFactory().get(self.url)
+        request.user = self.admin
+        obj = model_admin.get_queryset(request).get(pk=client.pk)
+        self.assertEqual(obj.broadcast_count, len(self.broadcasts))
+        self.assertEqual(len(obj.recent_deliveries), 3)
+
+
+class DeliveryPanelTests(TestCase):
+    """Панель доставок отдаёт страницы по курсору и итоги по статусам без загрузки строк."""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        self.broadcast = BroadcastMessage.objects.create(text="msg", comment="панель")
+        clients = TelegramClient.objects.bulk_create([TelegramClient(user_id=5000 + i) for i in range(120)])
+        BroadcastDelivery.objects.bulk_create(
+            [
+                BroadcastDelivery(message=self.broadcast, recipient=c, status="failed" if i % 4 == 0 else "sent")
+                for i, c in enumerate(clients)
+            ]
+        )
+        self.url = reverse("admin:broadcast_deliveries", args=[self.broadcast.pk])
+
+    def test_keyset_pages_cover_all_rows_once(self):
+        first = self.client.get(self.url).json()
+        self.assertEqual(first["totals"], {"sent": 90, "failed": 30})
+        seen = [d["id"] for d in first["results"]]
+        cursor = first["next"]
+        while cursor:
+            page = self.client.get(self.url, {"after": cursor}).json()
+            self.assertNotIn("totals", page)
+            seen += [d["id"] for d in page["results"]]
+            cursor = page["next"]
+        self.assertEqual(len(seen), 120)
+        self.assertEqual(seen, sorted(set(seen), reverse=True))
+
+    def test_status_filter(self):
+        page = self.client.get(self.url, {"status": "failed"}).json()
+        self.assertEqual({d["status"] for d in page["results"]}, {"failed"})
+        self.assertEqual(len(page["results"]), 30)
+        self.assertIsNone(page["next"])
+
+
+class AttachToBroadcastTests(TestCase):
+    """Добавление выбранных клиентов в рассылку: одним INSERT ... SELECT или фоновой задачей."""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        self.broadcast = BroadcastMessage.objects.create(text="msg", comment="добавление")
+        self.clients = TelegramClient.objects.bulk_create([TelegramClient(user_id=7000 + i) for i in range(30)])
+        self.broadcast.recipients.add(*self.clients[:10])
+        self.url = reverse("admin:core_telegramclient_changelist")
+
+    def _apply(self):
+        return self.client.post(self.url, {
+            "action": "attach_to_broadcast",
+            "select_across": "1",
+            "_selected_action": [self.clients[0].pk],
+            "broadcast": self.broadcast.pk,
+            "apply": "1",
+        }, follow=True)
+
+    def test_adds_only_missing_recipients(self):
+        response = self._apply()
+        self.assertContains(response, "Добавлено 20 клиентов")
+        self.assertEqual(self.broadcast.recipients.count(), 30)
+
+    @override_settings(ATTACH_SYNC_LIMIT=5)
+    def test_large_selection_goes_to_celery(self):
+        with mock.patch("core.admin.attach_recipients_task.delay") as delay:
+            delay.return_value.id = "task-1"
+            response = self._apply()
+        broadcast_id, dumped = delay.call_args.args
+        self.assertEqual(broadcast_id, self.broadcast.pk)
+        self.assertEqual(dumped["pks"], None)
+        self.assertRedirects(response, reverse("admin:attach_progress", args=["task-1"]))
+
+    @override_settings(ATTACH_BATCH_SIZE=7)
+    def test_task_inserts_in_id_ranges(self):
+        selection = {
+            "model": "core.TelegramClient",
+            "user_id": User.objects.get(username="admin").pk,
+            "filters": "",
+            "pks": None,
+        }
+        with mock.patch.object(attach_recipients, "update_state") as update_state:
+            result = attach_recipients.apply(args=[self.broadcast.pk, selection]).get()
+        self.assertEqual([c.kwargs["meta"]["done"] for c in update_state.call_args_list], [7, 14, 21, 28, 30])
+        self.assertEqual(result, {"done": 30, "total": 30, "added": 20})
+        self.assertEqual(self.broadcast.recipients.count(), 30)
+
+
+class RecipientPickerTests(TestCase):
+    """Выбор получателей: поиск по индексируемым полям и сохранение только разницы."""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        self.broadcast = BroadcastMessage.objects.create(text="msg", comment="получатели")
+        self.clients = TelegramClient.objects.bulk_create(
+            [TelegramClient(user_id=9000 + i, username=f"picker{i}") for i in range(30)]
+        )
+        self.broadcast.recipients.add(*self.clients[:5])
+
+    def test_search_pages(self):
+        url = reverse("admin:broadcast_recipient_search")
+        first = self.client.get(url, {"q": "@Picker"}).json()
+        self.assertEqual(len(first["results"]), 20)
+        rest = self.client.get(url, {"q": "picker", "after": first["next"]}).json()
+        self.assertEqual(len(rest["results"]), 10)
+        self.assertIsNone(rest["next"])
+        exact = self.client.get(url, {"q": "9003"}).json()
+        self.assertEqual([r["id"] for r in exact["results"]], [self.clients[3].pk])
+
+    def test_saves_only_changes(self):
+        changes = {"add": [c.pk for c in self.clients[3:8]], "remove": [self.clients[0].pk]}
+        form = BroadcastMessageForm(
+            {"text": "msg", "comment": "получатели", "recipient_changes": json.dumps(changes),
+             "shard_size": 1000, "shard_parallelism": 1},
+            instance=self.broadcast,
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertEqual(
+            set(self.broadcast.recipients.values_list("pk", flat=True)),
+            {c.pk for c in self.clients[1:8]},
+        )
+
+    def test_unknown_ids_are_form_error(self):
+        missing = self.clients[-1].pk + 1000
+        form = BroadcastMessageForm(
+            {"text": "msg", "comment": "получатели", "recipient_changes": json.dumps({"add": [self.clients[6].pk, missing]}),
+             "shard_size": 1000, "shard_parallelism": 1},
+            instance=self.broadcast,
+        )
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors["recipient_changes"], [f"Неизвестные клиенты: {missing}."])
+        self.assertEqual(self.broadcast.recipients.count(), 5)
+
+    def test_change_page_renders_picker(self):
+        url = reverse("admin:core_broadcastmessage_change", args=[self.broadcast.pk])
+        response = self.client.get(url)
+        self.assertContains(response, "Сейчас получателей")
+        self.assertContains(response, reverse("admin:broadcast_recipient_list", args=[self.broadcast.pk]))
+        self.assertNotContains(response, "picker29")
+
+
+class CsvExportTests(TestCase):
+    """Экспорт в CSV стримится из курсора, а большие выборки уходят в Celery и пишутся в .csv.gz."""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        self.clients = TelegramClient.objects.bulk_create(
+            [TelegramClient(user_id=11000 + i, username=f"export{i}") for i in range(15)]
+        )
+        ClientAction.objects.bulk_create([ClientAction(client=c, action="start") for c in self.clients])
+        self.url = reverse("admin:core_telegramclient_changelist")
+
+    def _export(self, url):
+        return self.client.post(url, {"action": "export_csv", "select_across": "1", "_selected_action": [self.clients[0].pk]})
+
+    @override_settings(EXPORT_SYNC_LIMIT=10**9)
+    def test_streams_rows(self):
+        response = self._export(self.url)
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:2], ["ID", "User ID"])
+        self.assertEqual(len(rows), 16)
+
+    @override_settings(EXPORT_SYNC_LIMIT=0)
+    def test_large_export_goes_to_celery(self):
+        url = reverse("admin:core_clientaction_changelist") + "?q=start"
+        with mock.patch("core.admin.export_csv_task.delay") as delay:
+            delay.return_value.id = "task-2"
+            response = self._export(url)
+        self.assertRedirects(response, reverse("admin:core_clientaction_export", args=["task-2"]))
+        dumped, columns, name = delay.call_args.args
+        self.assertEqual(name, "clientaction")
+        # В задачу уходят только данные: модель, фильтры списка, пользователь, отмеченные id
+        self.assertEqual(json.loads(json.dumps(dumped)), dumped)
+        self.assertEqual(dumped["filters"], "q=start")
+        self.assertIsNone(dumped["pks"])
+        self.assertEqual(load_selection(dumped).count(), 15)
+
+    def test_task_writes_gzip(self):
+        selection = {
+            "model": "core.TelegramClient",
+            "user_id": User.objects.get(username="admin").pk,
+            "filters": "q=export1",
+            "pks": None,
+        }
+        columns = [["user_id", "User ID"], ["username", "Username"]]
+        with tempfile.TemporaryDirectory() as root, override_settings(EXPORT_ROOT=root):
+            result = export_csv.apply(args=[selection, columns, "telegramclient"]).get()
+            with gzip.open(f"{root}/{result['file']}", "rt") as f:
+                rows = list(csv.reader(f))
+        self.assertEqual(result["done"], 6)
+        self.assertEqual(rows[0], ["User ID", "Username"])
+        self.assertEqual(len(rows), 7)
+
+    def test_selected_rows_only(self):
+        selection = {
+            "model": "core.TelegramClient",
+            "user_id": User.objects.get(username="admin").pk,
+            "filters": "",
+            "pks": [str(c.pk) for c in self.clients[:3]],
+        }
+        self.assertEqual(set(load_selection(selection)), set(self.clients[:3]))
+
+
+class HotPathIndexTests(TestCase):
+    """Каждый запрос с горячего пути использует свой индекс (EXPLAIN в check_indexes)."""
+
+    def test_hot_queries_use_indexes(self):
+        out = io.StringIO()
+        call_command("check_indexes", stdout=out)
+        self.assertNotIn("❌", out.getvalue())
+
+
+class ClientActionPartitionTests(TestCase):
+    """Журнал действий партиционирован по месяцам: новые партиции забирают строки из DEFAULT, старые уходят в архив."""
+
+    def setUp(self):
+        self.client_ = TelegramClient.objects.create(user_id=12000)
+        self.now = timezone.now()
+        ClientAction.objects.bulk_create([
+            ClientAction(client=self.client_, action="old", timestamp=self.now - timedelta(days=400)),
+            ClientAction(client=self.client_, action="future", timestamp=partitions.month_start(self.now, 5) + timedelta(days=1)),
+        ])
+        # В тесте всё идёт одной транзакцией: отложенные проверки FK иначе не дали бы отсоединить партицию
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+    def _partition_of(self, action):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT tableoid::regclass::text FROM {partitions.PARENT} WHERE action = %s", [action])
+            return cursor.fetchone()[0]
+
+    def test_new_partition_takes_rows_from_default(self):
+        self.assertEqual(self._partition_of("future"), partitions.DEFAULT)
+        created = partitions.ensure_partitions(ahead=6, now=self.now)
+        expected = f"{partitions.PARENT}_p{partitions.month_start(self.now, 5):%Y_%m}"
+        self.assertIn(expected, created)
+        self.assertEqual(self._partition_of("future"), expected)
+        self.assertEqual(partitions.ensure_partitions(ahead=6, now=self.now), [])
+        self.assertEqual(ClientAction.objects.filter(client=self.client_).count(), 2)
+
+    def test_expired_partitions_are_archived(self):
+        partitions.ensure_partitions(ahead=6, now=self.now)
+        with tempfile.TemporaryDirectory() as root:
+            _, archived = partitions.maintain(0, 12, root, now=partitions.month_start(self.now, 30))
+            self.assertIn((partitions.LEGACY, 1), archived)
+            with gzip.open(f"{root}/{partitions.LEGACY}.csv.gz", "rt") as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual([r["action"] for r in rows], ["old"])
+        self.assertEqual(partitions.detached_partitions(), [])
+        self.assertFalse(ClientAction.objects.exists())
+
+
+class RollupTests(TestCase):
+    """Агрегаты считаются только по новым действиям и совпадают с GROUP BY по журналу."""
+
+    def setUp(self):
+        self.noon = timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0)
+        self.clients = TelegramClient.objects.bulk_create(
+            [TelegramClient(user_id=13000 + i, bot_source="private") for i in range(3)]
+            + [TelegramClient(user_id=13100, bot_source="public")]
+        )
+        c1, c2, c3, public = self.clients
+        self._log(
+            (c1, "start_private"), (c1, "clicked_payment"), (c1, "uploaded_payment: 1.jpg"),
+            (c2, "start_private"), (c2, "clicked_payment"), (c2, "support_message: вопрос"),
+            (c3, "start_private"), (public, "start_private"),
+        )
+
+    def _log(self, *actions, day=0):
+        ClientAction.objects.bulk_create(
+            [ClientAction(client=c, action=a, timestamp=self.noon + timedelta(days=day)) for c, a in actions]
+        )
+
+    def _cohort(self, source="private"):
+        return FunnelDailyCount.objects.values_list("started", "payment_clicked", "payment_uploaded").get(
+            day=self.noon.date(), bot_source=source
+        )
+
+    def test_counts_and_funnel(self):
+        rollups.run(batch_size=3)
+        counts = dict(
+            ActionDailyCount.objects.filter(bot_source="private").values_list("action", "count")
+        )
+        self.assertEqual(
+            counts,
+            {"start_private": 3, "clicked_payment": 2, "uploaded_payment": 1, "support_message": 1},
+        )
+        self.assertEqual(self._cohort(), (3, 2, 1))
+        self.assertEqual(self._cohort("public"), (1, 0, 0))
+
+    def test_only_new_actions_are_counted(self):
+        rollups.run()
+        self._log((self.clients[2], "clicked_payment"), (self.clients[0], "clicked_payment"), day=1)
+        rollups.run()
+        rollups.run()
+        self.assertEqual(
+            ActionDailyCount.objects.filter(action="clicked_payment").aggregate(n=Sum("count"))["n"], 4
+        )
+        # повторный клик клиента 1 не меняет воронку, первый клик клиента 3 засчитан его когорте
+        self.assertEqual(self._cohort(), (3, 3, 1))
+
+    def test_dashboard_reads_rollups(self):
+        rollups.run()
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        response = self.client.get(reverse("admin_analytics"), {"days": "7", "bot": "private"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["total"]["started"], 3)
+        self.assertEqual(response.context["total"]["clicked_pct"], 66.7)
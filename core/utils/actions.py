@@ -0,0 +1,117 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, InterfaceError, OperationalError, close_old_connections, transaction
+from django.utils import timezone
+
+from core.models import ClientAction
+
+logger = logging.getLogger(__name__)
+
+
+class ActionRecorder:
+    """
+    Write-behind журнал ClientAction для процесса бота: хендлер только кладёт действие в очередь,
+    фоновая задача пишет очередь bulk_create'ом раз в ``interval`` секунд или по ``batch_size`` строк.
+    Если БД недоступна, пачка дописывается в spool-файл и досылается при следующей удачной записи.
+    Строки, которые БД отвергла (например, клиента удалили, пока действие ждало в очереди),
+    пишутся в лог и отбрасываются — в spool попадают только пачки, не записанные из-за связи с БД.
+    """
+
+    def __init__(self, spool_path, batch_size=200, interval=0.5):
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = []
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def record(self, client, action):
+        self._queue.append((client.pk, action, timezone.now()))
+        if len(self._queue) >= self.batch_size:
+            self._wake.set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Останавливает фоновую запись и сбрасывает всё, что осталось в очереди."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Ошибка при записи действий клиентов")
+
+    async def flush(self):
+        async with self._lock:
+            if not self._queue and not os.path.exists(self.spool_path):
+                return
+            batch, self._queue = self._queue, []
+            await sync_to_async(self._write)(batch)
+
+    def _write(self, batch):
+        # После падения БД соединение в этом потоке может быть битым — Django откроет новое
+        close_old_connections()
+        try:
+            self._replay_spool()
+            self._insert(batch)
+        except (OperationalError, InterfaceError) as e:
+            logger.error(f"БД недоступна ({e}) — {len(batch)} действий отложено в {self.spool_path}")
+            self._spool(batch)
+
+    def _insert(self, rows):
+        """
+        Пишет строки одной пачкой; если БД отвергла пачку, пишет по одной и отбрасывает плохие.
+        FK на клиента отложенный, поэтому ошибка приходит на коммите — каждая строка в своей транзакции.
+        """
+        actions = [ClientAction(client_id=client_id, action=action, timestamp=ts) for client_id, action, ts in rows]
+        try:
+            with transaction.atomic():
+                ClientAction.objects.bulk_create(actions, batch_size=self.batch_size)
+            return
+        except IntegrityError:
+            pass
+        for action in actions:
+            try:
+                with transaction.atomic():
+                    action.pk = None
+                    action.save(force_insert=True)
+            except IntegrityError as e:
+                logger.warning(
+                    f"⚠️ Действие {action.action!r} клиента {action.client_id} от {action.timestamp} отброшено: {e}"
+                )
+
+    def _spool(self, batch):
+        os.makedirs(os.path.dirname(self.spool_path), exist_ok=True)
+        with open(self.spool_path, "a", encoding="utf-8") as f:
+            for client_id, action, ts in batch:
+                f.write(json.dumps({"client_id": client_id, "action": action, "timestamp": ts.isoformat()}) + "\n")
+
+    def _replay_spool(self):
+        if not os.path.exists(self.spool_path):
+            return
+        with open(self.spool_path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        self._insert([(row["client_id"], row["action"], datetime.fromisoformat(row["timestamp"])) for row in rows])
+        os.remove(self.spool_path)
+        logger.info(f"Дозаписано {len(rows)} отложенных действий из {self.spool_path}")
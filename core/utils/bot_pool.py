@@ -0,0 +1,106 @@
+import asyncio
+import atexit
+import importlib.util
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger("broadcast")
+
+# HTTP/2 включается только если установлен пакет h2 (pip install "httpx[http2]")
+HTTP_VERSION = "2" if importlib.util.find_spec("h2") else "1.1"
+
+_loop = None
+_thread = None
+_bots = {}
+_bots_lock = None
+_state_lock = threading.Lock()
+
+
+def _ensure_loop():
+    """Один долгоживущий event loop на процесс: в нём живут все Bot и их HTTPX-пулы."""
+    global _loop, _thread, _bots_lock
+    with _state_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _bots_lock = asyncio.Lock()
+            _thread = threading.Thread(target=_loop.run_forever, name="telegram-bot-pool", daemon=True)
+            _thread.start()
+        return _loop
+
+
+def run(coro):
+    """Выполняет корутину в общем loop процесса и синхронно возвращает результат."""
+    loop = _ensure_loop()
+    return asyncio.run_coroutine_threadsafe(_with_fresh_connections(coro), loop).result()
+
+
+async def _with_fresh_connections(coro):
+    """
+    ORM-вызовы корутин идут в потоке sync_to_async этого loop'а, и его соединение с БД живёт вместе с процессом.
+    Как Django между запросами, до и после каждого запуска закрываем там протухшие и сломанные соединения
+    (CONN_MAX_AGE, рестарт Postgres).
+    """
+    await sync_to_async(close_old_connections)()
+    try:
+        return await coro
+    finally:
+        await sync_to_async(close_old_connections)()
+
+
+async def get_bot(token=None) -> Bot:
+    """Возвращает инициализированный Bot для токена (по умолчанию — приватный бот)."""
+    token = token or settings.TELEGRAM_BOT_TOKEN_PRIVATE
+    bot = _bots.get(token)
+    if bot is not None:
+        return bot
+    async with _bots_lock:
+        if token not in _bots:
+            bot = Bot(
+                token=token,
+                request=HTTPXRequest(
+                    connection_pool_size=settings.BROADCAST_CONCURRENCY,
+                    connect_timeout=10,
+                    read_timeout=30,
+                    pool_timeout=30,
+                    http_version=HTTP_VERSION,
+                ),
+            )
+            await bot.initialize()
+            _bots[token] = bot
+            logger.info("🔌 Bot-клиент создан (HTTP/%s, пул %d)", HTTP_VERSION, settings.BROADCAST_CONCURRENCY)
+        return _bots[token]
+
+
+async def _shutdown_bots():
+    while _bots:
+        _, bot = _bots.popitem()
+        try:
+            await bot.shutdown()
+        except Exception:
+            logger.exception("⚠️ Ошибка при закрытии Bot-клиента")
+
+
+def shutdown():
+    """Закрывает все Bot-клиенты и останавливает loop. Вызывается при выходе воркера."""
+    global _loop, _thread
+    with _state_lock:
+        loop, thread = _loop, _thread
+        _loop = _thread = None
+    if loop is None or loop.is_closed():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_shutdown_bots(), loop).result(timeout=10)
+    except Exception:
+        logger.exception("⚠️ Не удалось корректно закрыть пул Bot-клиентов")
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+    loop.close()
+
+
+atexit.register(shutdown)
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+logger = logging.getLogger("broadcast")
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 сообщение в секунду в один чат
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_PER_CHAT_INTERVAL = 1.0
+
+
+class TokenBucket:
+    """Асинхронный token bucket: ``rate`` токенов в секунду, не больше ``capacity`` в запасе."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens=1):
+        # Лок держим и во время ожидания — так токены выдаются строго по очереди
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class RedisRateBudget:
+    """
+    Общий для всех воркеров бюджет отправок: счётчик в Redis на каждую секунду.
+    Если Redis недоступен — каждый шард берёт себе ``rate / share`` локально.
+    """
+
+    def __init__(self, url, key, rate=TELEGRAM_GLOBAL_RATE, share=1):
+        self.url = url
+        self.key = key
+        self.rate = int(rate)
+        self._redis = None
+        self._fallback = TokenBucket(max(1.0, rate / max(1, share)))
+        self._broken = False
+
+    async def acquire(self, tokens=1):
+        if self._broken:
+            return await self._fallback.acquire(tokens)
+        try:
+            if self._redis is None:
+                self._redis = aioredis.from_url(self.url)
+            while True:
+                now = time.time()
+                window = int(now)
+                async with self._redis.pipeline(transaction=True) as pipe:
+                    pipe.incrby(f"{self.key}:{window}", tokens)
+                    pipe.expire(f"{self.key}:{window}", 2)
+                    used, _ = await pipe.execute()
+                if used <= self.rate:
+                    return
+                await asyncio.sleep(window + 1 - now)
+        except RedisError:
+            logger.exception("⚠️ Redis недоступен — общий лимит рассылки заменён локальным")
+            self._broken = True
+            await self._fallback.acquire(tokens)
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+class TelegramRateLimiter:
+    """Глобальный лимит бота + интервал между сообщениями в один чат + общая пауза по RetryAfter."""
+
+    def __init__(self, rate=TELEGRAM_GLOBAL_RATE, per_chat_interval=TELEGRAM_PER_CHAT_INTERVAL, max_chats=10000, budget=None):
+        # budget — общий на несколько процессов лимит (RedisRateBudget), иначе локальный bucket
+        self.bucket = budget or TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_chats = max_chats
+        self._chat_next = OrderedDict()
+        self._paused_until = 0.0
+
+    def pause(self, seconds):
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            logger.warning("⏸ Telegram просит подождать %s сек — рассылка на паузе", seconds)
+
+    async def _wait_pause(self):
+        while True:
+            delay = self._paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def _wait_chat(self, chat_id):
+        now = time.monotonic()
+        next_at = max(now, self._chat_next.pop(chat_id, now))
+        self._chat_next[chat_id] = next_at + self.per_chat_interval
+        if len(self._chat_next) > self.max_chats:
+            self._chat_next.popitem(last=False)
+        if next_at > now:
+            await asyncio.sleep(next_at - now)
+
+    async def acquire(self, chat_id, tokens=1):
+        await self._wait_pause()
+        await self._wait_chat(chat_id)
+        await self.bucket.acquire(tokens)
+        # За время ожидания токена могла прилететь пауза
+        await self._wait_pause()
+
+
+@dataclass
+class DeliveryResult:
+    recipient_id: int
+    chat_id: int
+    status: str
+    error: str = ""
+
+
+class BroadcastSender:
+    """
+    Отправка рассылки внутри одного event loop.
+
+    ``send(chat_id, state)`` — корутина, делающая сами запросы к Telegram для одного получателя;
+    ``state`` — словарь, общий для всех попыток этой доставки, чтобы повтор после RetryAfter
+    продолжал с упавшего запроса, а не слал заново уже доставленное,
+    ``on_result(result)`` — корутина, которая сохраняет ``DeliveryResult``,
+    ``on_attempt(recipient_id)`` — необязательная корутина, которую ждут перед первым запросом к получателю.
+    Одновременно в полёте не больше ``concurrency`` отправок.
+    """
+
+    def __init__(self, send, on_result, limiter=None, concurrency=20, cost=1, max_retries=3, on_attempt=None):
+        self.send = send
+        self.on_result = on_result
+        self.on_attempt = on_attempt
+        self.limiter = limiter or TelegramRateLimiter()
+        self.concurrency = max(1, int(concurrency))
+        self.cost = cost
+        self.max_retries = max_retries
+        self.ok = 0
+        self.failed = 0
+        self.blocked = 0
+
+    async def _deliver(self, recipient_id, chat_id):
+        attempt = 0
+        state = {}
+        while True:
+            await self.limiter.acquire(chat_id, self.cost)
+            if attempt == 0 and self.on_attempt is not None:
+                await self.on_attempt(recipient_id)
+            try:
+                await self.send(chat_id, state)
+                return DeliveryResult(recipient_id, chat_id, "sent")
+            except RetryAfter as exc:
+                retry_after = exc.retry_after
+                if hasattr(retry_after, "total_seconds"):
+                    retry_after = retry_after.total_seconds()
+                self.limiter.pause(float(retry_after) + 1)
+                attempt += 1
+                if attempt > self.max_retries:
+                    return DeliveryResult(recipient_id, chat_id, "failed", str(exc)[:500])
+            except Forbidden as exc:
+                return DeliveryResult(recipient_id, chat_id, "blocked", str(exc)[:500])
+            except TelegramError as exc:
+                return DeliveryResult(recipient_id, chat_id, "failed", str(exc)[:500])
+            except Exception as exc:
+                logger.exception("⚠️ Ошибка при отправке пользователю %s", chat_id)
+                return DeliveryResult(recipient_id, chat_id, "failed", str(exc)[:500])
+
+    async def _worker(self, recipients):
+        for recipient_id, chat_id in recipients:
+            result = await self._deliver(recipient_id, chat_id)
+            if result.status == "sent":
+                self.ok += 1
+                logger.info("✅ Успешно отправлено пользователю %s", chat_id)
+            else:
+                if result.status == "blocked":
+                    self.blocked += 1
+                else:
+                    self.failed += 1
+                logger.warning("⚠️ Ошибка при отправке пользователю %s: %s", chat_id, result.error)
+            await self.on_result(result)
+
+    async def run(self, recipients):
+        # Все воркеры читают один итератор — каждый получатель достаётся ровно одному из них
+        recipients = iter(recipients)
+        await asyncio.gather(*(self._worker(recipients) for _ in range(self.concurrency)))
+        return {"ok": self.ok, "failed": self.failed, "blocked": self.blocked}
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+
+import redis
+from asgiref.sync import sync_to_async
+from cachetools import TTLCache
+from django.conf import settings
+from redis import asyncio as aioredis
+
+from core.models import TelegramClient
+
+logger = logging.getLogger(__name__)
+
+# Канал, через который админка сообщает ботам об изменённых клиентах
+INVALIDATE_CHANNEL = "crm:telegramclient:invalidate"
+
+# Один клиент на процесс (соединения — из его пула); короткие таймауты, чтобы недоступный Redis
+# не подвешивал сохранение в админке
+PUBLISHER = redis.Redis.from_url(settings.CLIENT_CACHE_REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
+
+# Отметка «такого клиента в БД нет» — чтобы апдейты неизвестных пользователей не ходили в БД каждый раз
+MISSING = object()
+
+
+def publish(channel, data):
+    """Публикует инвалидацию для ботов; ошибка Redis только логируется — кэш ботов догонит по TTL."""
+    try:
+        PUBLISHER.publish(channel, data)
+    except redis.RedisError:
+        logger.exception(f"Не удалось отправить инвалидацию {data} в {channel}")
+
+
+def publish_invalidation(user_id):
+    """Вызывается из процесса админки: боты выкидывают клиента из своего кэша."""
+    publish(INVALIDATE_CHANNEL, user_id)
+
+
+class ClientCache:
+    """
+    TelegramClient по user_id в памяти процесса бота: TTL + вытеснение давно не использованных (LRU).
+    Отсутствие клиента тоже кэшируется; put() после /start и инвалидации его перекрывают.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def put(self, client):
+        self._cache[client.user_id] = client
+
+    def invalidate(self, user_id):
+        self._cache.pop(user_id, None)
+
+    async def get(self, user_id):
+        client = self._cache.get(user_id)
+        if client is None:
+            client = await sync_to_async(TelegramClient.objects.filter(user_id=user_id).first)()
+            self._cache[user_id] = MISSING if client is None else client
+        return None if client is MISSING else client
+
+    async def listen(self, url):
+        """Слушает инвалидации из Redis; при обрыве соединения переподключается."""
+        await listen_channel(url, INVALIDATE_CHANNEL, lambda data: self.invalidate(int(data)), self._cache.clear)
+
+
+async def listen_channel(url, channel, on_message, on_subscribed):
+    """
+    Подписка процесса бота на канал инвалидаций: ``on_message(data)`` на каждое сообщение,
+    ``on_subscribed()`` после каждой (пере)подписки — пока были отключены, могли пропустить инвалидации.
+    """
+    while True:
+        try:
+            conn = aioredis.from_url(url)
+            async with conn.pubsub() as pubsub:
+                await pubsub.subscribe(channel)
+                on_subscribed()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        on_message(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"Подписка на {channel} оборвалась, переподключаемся")
+            await asyncio.sleep(5)
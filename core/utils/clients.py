@@ -0,0 +1,80 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from cachetools import TTLCache
+from django.db import connection
+
+from core.models import TelegramClient
+
+
+def upsert_client(user_id, username, first_name, last_name, bot_source):
+    """
+    Один INSERT ... ON CONFLICT: создаёт клиента или обновляет username/имя у существующего
+    и возвращает строку. В отличие от get_or_create не падает с IntegrityError при гонке двух апдейтов.
+    bot_source у существующего клиента не меняется — это бот, через который он пришёл впервые.
+    Если профиль не изменился, строка не переписывается (без лишней мёртвой версии на каждый /start).
+    """
+    meta = TelegramClient._meta
+    # Колонки и значения по умолчанию — из модели, как их подставил бы save()
+    client = TelegramClient(
+        user_id=user_id, username=username, first_name=first_name, last_name=last_name, bot_source=bot_source
+    )
+    fields = [f for f in meta.concrete_fields if not f.primary_key]
+    values = [f.get_db_prep_save(f.pre_save(client, True), connection) for f in fields]
+    columns = ", ".join(f.column for f in meta.concrete_fields)
+    profile = ("username", "first_name", "last_name")
+    sql = f"""
+        WITH up AS (
+            INSERT INTO {meta.db_table} AS t ({", ".join(f.column for f in fields)})
+            VALUES ({", ".join(["%s"] * len(fields))})
+            ON CONFLICT (user_id) DO UPDATE SET
+                {", ".join(f"{c} = EXCLUDED.{c}" for c in profile)}
+            WHERE ({", ".join(f"t.{c}" for c in profile)}) IS DISTINCT FROM ({", ".join(f"EXCLUDED.{c}" for c in profile)})
+            RETURNING {columns}
+        )
+        SELECT {columns} FROM up
+        UNION ALL
+        SELECT {columns} FROM {meta.db_table} WHERE user_id = %s AND NOT EXISTS (SELECT 1 FROM up)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*values, user_id])
+        row = cursor.fetchone()
+    if row is None:
+        # Конфликт со строкой, вставленной параллельно уже после снимка запроса: её видно следующему запросу
+        return TelegramClient.objects.get(user_id=user_id)
+    return TelegramClient.from_db(connection.alias, [f.attname for f in meta.concrete_fields], row)
+
+
+class ClientUpserter:
+    """
+    upsert_client для процесса бота: повторные /start одного пользователя с тем же профилем
+    в пределах ``window`` секунд не ходят в БД, одновременные — делят один запрос.
+    """
+
+    def __init__(self, bot_source, window=5, maxsize=10000):
+        self.bot_source = bot_source
+        self._recent = TTLCache(maxsize=maxsize, ttl=window)
+        self._pending = {}
+
+    async def upsert(self, user):
+        profile = (user.username, user.first_name, user.last_name)
+        recent = self._recent.get(user.id)
+        if recent and recent[0] == profile:
+            return recent[1]
+
+        pending = self._pending.get(user.id)
+        if pending and pending[0] == profile:
+            task = pending[1]
+        else:
+            task = asyncio.ensure_future(sync_to_async(upsert_client)(user.id, *profile, self.bot_source))
+            self._pending[user.id] = (profile, task)
+            task.add_done_callback(lambda t, key=user.id: self._forget_pending(key, t))
+        # shield: отмена одного хендлера не должна отменять запрос, которого ждут другие
+        client = await asyncio.shield(task)
+        self._recent[user.id] = (profile, client)
+        return client
+
+    def _forget_pending(self, user_id, task):
+        pending = self._pending.get(user_id)
+        if pending and pending[1] is task:
+            del self._pending[user_id]
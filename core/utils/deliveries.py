@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.utils import timezone
+
+from core.models import BroadcastDelivery, BroadcastMessage, TelegramClient
+
+logger = logging.getLogger("broadcast")
+
+
+def precreate_deliveries(message_id):
+    """
+    Одним INSERT ... SELECT создаёт pending-доставки для всех получателей рассылки.
+    Уже существующие строки не трогаем: повторный запуск продолжает рассылку с того же места.
+    """
+    through = BroadcastMessage.recipients.through._meta
+    delivery = BroadcastDelivery._meta
+    sql = f"""
+        INSERT INTO {delivery.db_table} (message_id, recipient_id, status, error_message, sent_at)
+        SELECT %s, r.{through.get_field("telegramclient").column}, 'pending', '', NOW()
+        FROM {through.db_table} r
+        WHERE r.{through.get_field("broadcastmessage").column} = %s
+        ON CONFLICT (message_id, recipient_id) DO NOTHING
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [message_id, message_id])
+        return cursor.rowcount
+
+
+def precreate_segment_deliveries(message_id, clients):
+    """
+    pending-доставки для клиентов сегмента: queryset выполняется внутри INSERT ... SELECT,
+    так что ни клиенты, ни их id в память воркера не загружаются при любом размере аудитории.
+    """
+    delivery = BroadcastDelivery._meta
+    select_sql, params = clients.order_by().values("pk").query.sql_with_params()
+    sql = f"""
+        INSERT INTO {delivery.db_table} (message_id, recipient_id, status, error_message, sent_at)
+        SELECT %s, c.id, 'pending', '', NOW() FROM ({select_sql}) c(id)
+        ON CONFLICT (message_id, recipient_id) DO NOTHING
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [message_id, *params])
+        return cursor.rowcount
+
+
+def _range_filter(lo, hi, alias="d"):
+    sql, params = "", []
+    if lo is not None:
+        sql += f" AND {alias}.recipient_id >= %s"
+        params.append(lo)
+    if hi is not None:
+        sql += f" AND {alias}.recipient_id < %s"
+        params.append(hi)
+    return sql, params
+
+
+def claim_deliveries(message_id, lo=None, hi=None, limit=500):
+    """
+    Переводит до ``limit`` pending-доставок в claimed и возвращает [(recipient_id, user_id)].
+    claimed — «шард взял, но ещё не отправлял»: в sending строку переводит AttemptLog прямо перед отправкой.
+    """
+    delivery = BroadcastDelivery._meta.db_table
+    client = TelegramClient._meta.db_table
+    range_sql, range_params = _range_filter(lo, hi, alias="p")
+    sql = f"""
+        UPDATE {delivery} d
+        SET status = 'claimed', sent_at = NOW()
+        FROM {client} c
+        WHERE c.id = d.recipient_id AND d.id IN (
+            SELECT p.id FROM {delivery} p
+            WHERE p.message_id = %s AND p.status = 'pending'{range_sql}
+            ORDER BY p.recipient_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING d.recipient_id, c.user_id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [message_id, *range_params, limit])
+        return sorted(cursor.fetchall())
+
+
+def mark_attempted(message_id, recipient_ids):
+    """claimed → sending: по этим получателям сейчас уйдёт первый запрос к Telegram."""
+    return BroadcastDelivery.objects.filter(
+        message_id=message_id,
+        recipient_id__in=recipient_ids,
+        status="claimed",
+    ).update(status="sending", sent_at=timezone.now())
+
+
+def interrupt_claimed(message_id, lo=None, hi=None):
+    """
+    Разбирает доставки, оставшиеся после падения воркера, и возвращает число прерванных.
+    claimed-строки до Telegram не доходили — они возвращаются в pending и будут отправлены.
+    Про sending неизвестно, дошло ли сообщение, поэтому такая строка помечается ошибкой, а не отправляется снова.
+    """
+    range_sql, range_params = _range_filter(lo, hi)
+    table = BroadcastDelivery._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} d SET status = 'pending' WHERE d.message_id = %s AND d.status = 'claimed'{range_sql}",
+            [message_id, *range_params],
+        )
+        cursor.execute(
+            f"""
+            UPDATE {table} d
+            SET status = 'failed', error_message = 'Прервано: воркер остановился во время отправки'
+            WHERE d.message_id = %s AND d.status = 'sending'{range_sql}
+            """,
+            [message_id, *range_params],
+        )
+        return cursor.rowcount
+
+
+class AttemptLog:
+    """
+    Отмечает доставки sending перед первой попыткой отправки, чтобы после падения воркера
+    interrupt_claimed отличал «возможно, ушло» от «ещё не пробовали».
+    Отметки, пришедшие, пока идёт запись, уходят следующим одним UPDATE.
+    """
+
+    def __init__(self, message_id):
+        self.message_id = message_id
+        self._queued = set()
+        self._lock = asyncio.Lock()
+
+    async def mark(self, recipient_id):
+        self._queued.add(recipient_id)
+        async with self._lock:
+            # Если id уже нет в очереди, его записал тот, кто держал лок до нас
+            if recipient_id in self._queued:
+                batch, self._queued = self._queued, set()
+                await sync_to_async(mark_attempted)(self.message_id, list(batch))
+
+
+class DeliveryBuffer:
+    """
+    Копит статусы доставок и пишет их пачками одним upsert'ом по (message, recipient).
+    Сбрасывается при ``size`` накопленных строк или раз в ``interval`` секунд.
+    """
+
+    def __init__(self, message_id, size=500, interval=2.0):
+        self.message_id = message_id
+        self.size = size
+        self.interval = interval
+        self._pending = {}
+        self._flushed_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def add(self, result):
+        # Ключ — получатель: в одном upsert не может быть двух строк на один (message, recipient)
+        self._pending[result.recipient_id] = result
+        if len(self._pending) >= self.size or time.monotonic() - self._flushed_at >= self.interval:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+            await sync_to_async(self._write)(list(batch.values()))
+
+    def _write(self, results):
+        BroadcastDelivery.objects.bulk_create(
+            [
+                BroadcastDelivery(
+                    message_id=self.message_id,
+                    recipient_id=r.recipient_id,
+                    status=r.status,
+                    error_message=r.error,
+                )
+                for r in results
+            ],
+            update_conflicts=True,
+            unique_fields=["message", "recipient"],
+            update_fields=["status", "error_message", "sent_at"],
+        )
+        logger.info("💾 Сохранено %d статусов доставки рассылки %s", len(results), self.message_id)
@@ -0,0 +1,43 @@
+import csv
+import gzip
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class _Echo:
+    """«Файл» для csv.writer, который ничего не хранит, а сразу отдаёт записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, columns, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Строки выгрузки: values_list по нужным полям через iterator() — на PostgreSQL это
+    серверный курсор, из БД читается по chunk_size строк, память не растёт с размером таблицы.
+    """
+    fields = [field for field, _ in columns]
+    return queryset.prefetch_related(None).values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+def stream_csv(queryset, columns):
+    """Генератор строк CSV (заголовок + данные) для StreamingHttpResponse."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow([header for _, header in columns])
+    for row in export_rows(queryset, columns):
+        yield writer.writerow(row)
+
+
+def write_csv_gz(queryset, columns, path, progress=None, every=50000):
+    """Пишет выгрузку в gzip-файл; progress(n) вызывается каждые ``every`` строк. Возвращает число строк."""
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([header for _, header in columns])
+        for row in export_rows(queryset, columns):
+            writer.writerow(row)
+            count += 1
+            if progress and count % every == 0:
+                progress(count)
+    return count
+
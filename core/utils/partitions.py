@@ -0,0 +1,147 @@
+import gzip
+import logging
+import os
+import re
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.models import ClientAction
+
+logger = logging.getLogger(__name__)
+
+# ClientAction партиционирована по месяцам (миграция 0026): core_clientaction_p2026_11 и т.д.,
+# core_clientaction_legacy — всё, что было до партиционирования (уходит в архив целиком, когда месяц после
+# миграции выйдет из окна хранения; см. README), DEFAULT — страховка для строк без партиции
+PARENT = ClientAction._meta.db_table
+DEFAULT = f"{PARENT}_default"
+LEGACY = f"{PARENT}_legacy"
+PARTITION_RE = rf"^{PARENT}_(p\d{{4}}_\d{{2}}|legacy)$"
+
+
+def month_start(dt, shift=0):
+    """Начало месяца (в TIME_ZONE проекта), сдвинутого на ``shift`` месяцев от ``dt``."""
+    dt = timezone.localtime(dt)
+    index = dt.year * 12 + dt.month - 1 + shift
+    return dt.replace(year=index // 12, month=index % 12 + 1, day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _bound(value):
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return parse_datetime(value.strip("'"))
+
+
+def partitions():
+    """Прикреплённые партиции, кроме DEFAULT: [(имя, начало, конец)]; None — открытая граница."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            """,
+            [PARENT],
+        )
+        rows = cursor.fetchall()
+    result = []
+    for name, bound in rows:
+        if bound == "DEFAULT":
+            continue
+        lo, hi = re.findall(r"\((MINVALUE|MAXVALUE|'[^']*')\)", bound)
+        result.append((name, _bound(lo), _bound(hi)))
+    return sorted(result, key=lambda p: (p[1] is not None, p[1]))
+
+
+def _create_partition(name, lo, hi):
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS)")
+        # Строки месяца, успевшие попасть в DEFAULT (партицию не создали вовремя), переезжают в новую
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+            """,
+            [lo, hi],
+        )
+        moved = cursor.rowcount
+        cursor.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", [lo, hi])
+    if moved:
+        logger.warning(f"🗂 В {name} перенесено {moved} строк из {DEFAULT}")
+
+
+def ensure_partitions(ahead=3, now=None):
+    """Создаёт партиции текущего и ``ahead`` следующих месяцев, которых ещё нет. Возвращает их имена."""
+    now = now or timezone.now()
+    existing = partitions()
+    created = []
+    for shift in range(ahead + 1):
+        lo, hi = month_start(now, shift), month_start(now, shift + 1)
+        if any((p_lo is None or p_lo < hi) and (p_hi is None or p_hi > lo) for _, p_lo, p_hi in existing):
+            continue
+        name = f"{PARENT}_p{lo:%Y_%m}"
+        _create_partition(name, lo, hi)
+        created.append(name)
+    return created
+
+
+def detach_expired(retention_months, now=None):
+    """Отсоединяет партиции, целиком лежащие раньше окна хранения (``retention_months`` месяцев)."""
+    cutoff = month_start(now or timezone.now(), -retention_months)
+    detached = []
+    for name, _, hi in partitions():
+        if hi is not None and hi <= cutoff:
+            with connection.cursor() as cursor:
+                cursor.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {name}")
+            detached.append(name)
+    return detached
+
+
+def detached_partitions():
+    """Отсоединённые, но ещё не заархивированные партиции (в том числе оставшиеся после упавшей архивации)."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT relname FROM pg_class
+            WHERE relkind = 'r' AND NOT relispartition
+              AND relnamespace = current_schema()::regnamespace AND relname ~ %s
+            ORDER BY relname
+            """,
+            [PARTITION_RE],
+        )
+        return [name for (name,) in cursor.fetchall()]
+
+
+def archive_partition(name, directory):
+    """
+    Выгружает отсоединённую партицию в ``<directory>/<name>.csv.gz`` (COPY прямо в gzip) и удаляет таблицу.
+    Таблица удаляется только если в архив попали все строки. Возвращает путь и число строк.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.csv.gz")
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM {name}")
+        total = cursor.fetchone()[0]
+        with gzip.open(f"{path}.tmp", "wb") as f:
+            cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+        if cursor.rowcount != total:
+            raise RuntimeError(f"В архив {name} записано {cursor.rowcount} строк из {total}")
+        os.replace(f"{path}.tmp", path)
+        cursor.execute(f"DROP TABLE {name}")
+    return path, total
+
+
+def maintain(ahead, retention_months, directory, now=None):
+    """Плановое обслуживание: создать будущие партиции, отсоединить и заархивировать старые (0 — хранить всё)."""
+    created = ensure_partitions(ahead, now)
+    archived = []
+    if retention_months:
+        detach_expired(retention_months, now)
+        for name in detached_partitions():
+            path, rows = archive_partition(name, directory)
+            logger.info(f"📦 Партиция {name} заархивирована: {rows} строк → {path}")
+            archived.append((name, rows))
+    return created, archived
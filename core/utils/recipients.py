@@ -0,0 +1,58 @@
+import json
+
+from django.db import connection
+
+from core.models import BroadcastMessage
+
+
+def _through():
+    through = BroadcastMessage.recipients.through._meta
+    return (
+        through.db_table,
+        through.get_field("broadcastmessage").column,
+        through.get_field("telegramclient").column,
+    )
+
+
+def attach_recipients(broadcast_id, clients):
+    """
+    Добавляет клиентов из queryset в получатели рассылки одним INSERT ... SELECT на стороне БД:
+    клиенты не загружаются в Python, уже добавленные пропускаются. Возвращает число новых получателей.
+    """
+    table, message_col, client_col = _through()
+    select_sql, params = clients.order_by().values("pk").query.sql_with_params()
+    sql = f"""
+        INSERT INTO {table} ({message_col}, {client_col})
+        SELECT %s, c.id FROM ({select_sql}) c(id)
+        ON CONFLICT ({message_col}, {client_col}) DO NOTHING
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [broadcast_id, *params])
+        return cursor.rowcount
+
+
+def attach_recipient_ids(broadcast_id, client_ids):
+    """
+    То же для явного списка id — тех, что форма рассылки получила из выбора получателей.
+    Фоновая задача сюда не ходит: большие выборки она добавляет через attach_recipients, диапазонами id.
+    """
+    table, message_col, client_col = _through()
+    sql = f"""
+        INSERT INTO {table} ({message_col}, {client_col})
+        SELECT %s, unnest(%s::bigint[])
+        ON CONFLICT ({message_col}, {client_col}) DO NOTHING
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [broadcast_id, list(client_ids)])
+        return cursor.rowcount
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по плану запроса (EXPLAIN) — без прохода по таблице, как у COUNT(*)."""
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
@@ -0,0 +1,191 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from core.models import ActionDailyCount, ClientAction, FunnelDailyCount, FunnelProgress, RollupWatermark, TelegramClient
+
+logger = logging.getLogger(__name__)
+
+WATERMARK = "client_actions"
+
+# Шаги воронки: поле FunnelProgress → условие на ClientAction.action
+FUNNEL_STEPS = [
+    ("started_at", "a.action = 'start_private'"),
+    ("payment_clicked_at", "a.action = 'clicked_payment'"),
+    ("payment_uploaded_at", "a.action LIKE 'uploaded_payment%%'"),
+]
+
+
+def _tables():
+    return {
+        "actions": ClientAction._meta.db_table,
+        "clients": TelegramClient._meta.db_table,
+        "daily": ActionDailyCount._meta.db_table,
+        "funnel": FunnelProgress._meta.db_table,
+        "cohorts": FunnelDailyCount._meta.db_table,
+    }
+
+
+def _barrier():
+    """
+    Верхняя граница прохода: max(id) журнала. Блокировка SHARE дожидается незавершённых вставок,
+    так что все строки с меньшим id уже видны — ни одна не проскочит мимо водяного знака.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SET LOCAL lock_timeout = '5s'")
+        cursor.execute(f"LOCK TABLE {ClientAction._meta.db_table} IN SHARE MODE")
+        cursor.execute(f"SELECT COALESCE(max(id), 0) FROM {ClientAction._meta.db_table}")
+        return cursor.fetchone()[0]
+
+
+def _count_actions(cursor, t, lo, hi):
+    cursor.execute(
+        f"""
+        INSERT INTO {t["daily"]} (day, bot_source, action, count)
+        SELECT (a."timestamp" AT TIME ZONE %s)::date, COALESCE(c.bot_source, ''),
+               left(split_part(a.action, ':', 1), 100), count(*)
+        FROM {t["actions"]} a JOIN {t["clients"]} c ON c.id = a.client_id
+        WHERE a.id > %s AND a.id <= %s
+        GROUP BY 1, 2, 3
+        ON CONFLICT (day, bot_source, action) DO UPDATE SET count = {t["daily"]}.count + EXCLUDED.count
+        """,
+        [settings.TIME_ZONE, lo, hi],
+    )
+
+
+def _advance_funnel(cursor, t, lo, hi):
+    """Обновляет первые отметки шагов клиентов из пачки; возвращает затронутые когорты [(день, бот)]."""
+    columns = ", ".join(field for field, _ in FUNNEL_STEPS)
+    firsts = ", ".join(f'min(a."timestamp") FILTER (WHERE {cond}) AS {field}' for field, cond in FUNNEL_STEPS)
+    steps = " OR ".join(f"({cond})" for _, cond in FUNNEL_STEPS)
+    updates = ", ".join(f"{field} = LEAST({t['funnel']}.{field}, EXCLUDED.{field})" for field, _ in FUNNEL_STEPS)
+    # old читает строки до вставки (снимок начала запроса): если клиент сменил когорту, пересчитать надо обе
+    cursor.execute(
+        f"""
+        WITH steps AS (
+            SELECT a.client_id, {firsts}
+            FROM {t["actions"]} a
+            WHERE a.id > %s AND a.id <= %s AND ({steps})
+            GROUP BY a.client_id
+        ),
+        old AS (
+            SELECT f.started_at, f.bot_source FROM {t["funnel"]} f JOIN steps s USING (client_id)
+        ),
+        up AS (
+            INSERT INTO {t["funnel"]} (client_id, bot_source, {columns})
+            SELECT s.client_id, COALESCE(c.bot_source, ''), {", ".join(f"s.{field}" for field, _ in FUNNEL_STEPS)}
+            FROM steps s JOIN {t["clients"]} c ON c.id = s.client_id
+            ON CONFLICT (client_id) DO UPDATE SET bot_source = EXCLUDED.bot_source, {updates}
+            RETURNING started_at, bot_source
+        )
+        SELECT DISTINCT (started_at AT TIME ZONE %s)::date, bot_source
+        FROM (SELECT * FROM up UNION ALL SELECT * FROM old) touched
+        WHERE started_at IS NOT NULL
+        """,
+        [lo, hi, settings.TIME_ZONE],
+    )
+    return cursor.fetchall()
+
+
+def _recount_cohorts(cursor, t, cohorts):
+    """Пересчитывает строки когорт из FunnelProgress — по индексу (bot_source, started_at), только затронутые дни."""
+    if not cohorts:
+        return
+    days, sources = zip(*cohorts)
+    cursor.execute(
+        f"""
+        INSERT INTO {t["cohorts"]} (day, bot_source, started, payment_clicked, payment_uploaded)
+        SELECT k.day, k.bot_source, count(f.client_id), count(f.payment_clicked_at), count(f.payment_uploaded_at)
+        FROM unnest(%s::date[], %s::text[]) AS k(day, bot_source)
+        LEFT JOIN {t["funnel"]} f ON f.bot_source = k.bot_source
+            AND f.started_at >= k.day::timestamp AT TIME ZONE %s
+            AND f.started_at < (k.day + 1)::timestamp AT TIME ZONE %s
+        GROUP BY k.day, k.bot_source
+        ON CONFLICT (day, bot_source) DO UPDATE SET
+            started = EXCLUDED.started,
+            payment_clicked = EXCLUDED.payment_clicked,
+            payment_uploaded = EXCLUDED.payment_uploaded
+        """,
+        [list(days), list(sources), settings.TIME_ZONE, settings.TIME_ZONE],
+    )
+
+
+def run(batch_size=None):
+    """
+    Учитывает в агрегатах действия после водяного знака, пачками по ``batch_size`` id.
+    Пачка и сдвиг знака — одна транзакция, так что каждое действие считается ровно один раз,
+    а параллельный запуск ждёт на блокировке знака. Возвращает обработанный диапазон id.
+    """
+    batch_size = batch_size or settings.ROLLUP_BATCH_SIZE
+    upper = _barrier()
+    t = _tables()
+    start = None
+    while True:
+        with transaction.atomic():
+            mark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK)
+            lo = mark.last_id
+            if start is None:
+                start = lo
+            if lo >= upper:
+                break
+            hi = min(lo + batch_size, upper)
+            with connection.cursor() as cursor:
+                _count_actions(cursor, t, lo, hi)
+                _recount_cohorts(cursor, t, _advance_funnel(cursor, t, lo, hi))
+            mark.last_id = hi
+            mark.save(update_fields=["last_id", "updated_at"])
+    return start, upper
+
+
+def rebuild():
+    """Пересчёт с нуля по тому, что осталось в БД (заархивированные партиции не учитываются)."""
+    with transaction.atomic():
+        for model in (ActionDailyCount, FunnelProgress, FunnelDailyCount):
+            model.objects.all().delete()
+        RollupWatermark.objects.filter(name=WATERMARK).update(last_id=0)
+    return run()
+
+
+def report(days=30, bot_source=None, top=8):
+    """Данные для страницы аналитики: воронка когорт за период и ежедневные действия — только из агрегатов."""
+    since = timezone.localdate() - timedelta(days=days - 1)
+    cohorts = FunnelDailyCount.objects.filter(day__gte=since)
+    actions = ActionDailyCount.objects.filter(day__gte=since)
+    if bot_source is not None:
+        cohorts = cohorts.filter(bot_source=bot_source)
+        actions = actions.filter(bot_source=bot_source)
+
+    def funnel(row):
+        started = row["started"] or 0
+        return {
+            **row,
+            "clicked_pct": round(100 * (row["payment_clicked"] or 0) / started, 1) if started else None,
+            "uploaded_pct": round(100 * (row["payment_uploaded"] or 0) / started, 1) if started else None,
+        }
+
+    sums = {"started": Sum("started"), "payment_clicked": Sum("payment_clicked"), "payment_uploaded": Sum("payment_uploaded")}
+    top_actions = list(
+        actions.values("action").annotate(total=Sum("count")).order_by("-total").values_list("action", flat=True)[:top]
+    )
+    per_day = {}
+    for row in actions.filter(action__in=top_actions).values("day", "action").annotate(n=Sum("count")):
+        per_day.setdefault(row["day"], {})[row["action"]] = row["n"]
+
+    mark = RollupWatermark.objects.filter(name=WATERMARK).first()
+    return {
+        "days": days,
+        "bot_source": bot_source,
+        "bot_sources": sorted(ActionDailyCount.objects.values_list("bot_source", flat=True).distinct()),
+        "total": funnel(cohorts.aggregate(**sums)),
+        "cohorts": [funnel(row) for row in cohorts.values("day").annotate(**sums).order_by("-day")],
+        "actions": top_actions,
+        "action_rows": [
+            {"day": day, "counts": [per_day[day].get(action, 0) for action in top_actions]}
+            for day in sorted(per_day, reverse=True)
+        ],
+        "watermark": mark,
+    }
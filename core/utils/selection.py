@@ -0,0 +1,33 @@
+from django.apps import apps
+from django.contrib import admin
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.auth import get_user_model
+from django.http import HttpRequest, QueryDict
+
+
+def dump_selection(modeladmin, request):
+    """
+    Выборка действия админки → аргумент Celery-задачи: только данные, которые JSON передаёт как есть —
+    модель, фильтры списка (GET-параметры changelist), пользователь и отмеченные id (None — «выбрать все»).
+    """
+    select_across = request.POST.get("select_across") == "1"
+    return {
+        "model": modeladmin.model._meta.label,
+        "user_id": request.user.pk,
+        "filters": request.GET.urlencode(),
+        "pks": None if select_across else request.POST.getlist(ACTION_CHECKBOX_NAME),
+    }
+
+
+def load_selection(selection):
+    """Собирает queryset выборки на воркере так же, как его собирает changelist админки перед действием."""
+    model = apps.get_model(selection["model"])
+    modeladmin = admin.site._registry[model]
+    request = HttpRequest()
+    request.method = "GET"
+    request.GET = QueryDict(selection["filters"])
+    request.user = get_user_model().objects.get(pk=selection["user_id"])
+    queryset = modeladmin.get_changelist_instance(request).get_queryset(request)
+    if selection["pks"] is not None:
+        queryset = queryset.filter(pk__in=selection["pks"])
+    return queryset
@@ -1,46 +1,130 @@
 import asyncio
-import time
 import logging
+from asgiref.sync import sync_to_async
 from telegram import InputMediaPhoto
-from telegram.error import RetryAfter, TelegramError
-from django.conf import settings
-from tg_bots.bot_private.send import bot
+from telegram.error import BadRequest
 
 logger = logging.getLogger('broadcast')
 
-async def _send_async(bot_instance, user_id, text, markup=None, photo_paths=None, text_after_media=None):
-    if photo_paths:
-        if len(photo_paths) == 1:
-            with open(photo_paths[0], 'rb') as f:
-                await bot_instance.send_photo(
-                    chat_id=user_id,
-                    photo=f.read(),
-                    caption=text,
-                    reply_markup=markup,
-                    parse_mode='HTML'
-                )
+
+class CachedPhoto:
+    """Фото для отправки: после первой загрузки уходит по file_id, а не байтами."""
+
+    def __init__(self, path, file_id=None, on_cached=None, data=None):
+        self.path = path
+        self.file_id = file_id
+        # синхронный callback(file_id) — сохраняет полученный id в БД
+        self.on_cached = on_cached
+        # байты, заранее прочитанные в память (иначе файл читается при загрузке)
+        self.data = data
+
+    def media(self):
+        if self.file_id:
+            return self.file_id
+        if self.data is not None:
+            return self.data
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+def is_bad_file_id(exc):
+    """BadRequest из-за устаревшего или чужого file_id — значит, файл надо загрузить заново."""
+    msg = str(exc).lower()
+    return "file identifier" in msg or "file_id" in msg or "file_reference" in msg
+
+
+class PhotoSet:
+    """
+    Набор фото (рассылки или галереи бота). Пока file_id неизвестны, загружает их ровно один отправитель,
+    остальные ждут и шлют уже по id. Отклонённый Telegram file_id заменяется новой загрузкой.
+    """
+
+    def __init__(self, photos):
+        self.photos = list(photos)
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self.photos)
+
+    def _ids(self):
+        return [p.file_id for p in self.photos]
+
+    async def send(self, bot_instance, user_id, text, markup=None, text_after_media=None, state=None):
+        """
+        ``state`` — словарь, который отправитель хранит между повторами одной доставки: если альбом уже ушёл,
+        а на тексте после него пришёл RetryAfter, повтор шлёт только текст, без второго альбома.
+        """
+        state = {} if state is None else state
+        return await self._cached(lambda: self._send(bot_instance, user_id, text, markup, text_after_media, state))
+
+    async def send_album(self, bot_instance, chat_id):
+        """Только сами фото, без подписи и кнопок."""
+        return await self._cached(lambda: self._send_album(bot_instance, chat_id))
+
+    async def _cached(self, do_send):
+        try:
+            if all(self._ids()):
+                used = self._ids()
+                return await do_send()
+            async with self._lock:
+                used = self._ids()
+                return await do_send()
+        except BadRequest as exc:
+            if not is_bad_file_id(exc):
+                raise
+            async with self._lock:
+                # Другой отправитель мог уже перезагрузить фото, пока мы ждали лок
+                if self._ids() == used:
+                    logger.warning("♻️ Telegram отклонил сохранённый file_id (%s) — загружаем фото заново", exc)
+                    for photo in self.photos:
+                        photo.file_id = None
+                return await do_send()
+
+    async def _send(self, bot_instance, user_id, text, markup, text_after_media, state):
+        if len(self.photos) == 1:
+            msg = await bot_instance.send_photo(
+                chat_id=user_id,
+                photo=self.photos[0].media(),
+                caption=text,
+                reply_markup=markup,
+                parse_mode='HTML'
+            )
+            await self._remember([msg])
         else:
-            media = []
-            for i, path in enumerate(photo_paths):
-                with open(path, 'rb') as f:
-                    content = f.read()
-                    media.append(InputMediaPhoto(content, caption=text, parse_mode='HTML') if i == 0 else InputMediaPhoto(content))
-            await bot_instance.send_media_group(chat_id=user_id, media=media)
+            if not state.get("album_sent"):
+                media = [
+                    InputMediaPhoto(p.media(), caption=text, parse_mode='HTML') if i == 0 else InputMediaPhoto(p.media())
+                    for i, p in enumerate(self.photos)
+                ]
+                msgs = await bot_instance.send_media_group(chat_id=user_id, media=media)
+                state["album_sent"] = True
+                await self._remember(msgs)
             await bot_instance.send_message(chat_id=user_id, text=text_after_media or "\u200B", reply_markup=markup)
+
+    async def _send_album(self, bot_instance, chat_id):
+        if len(self.photos) == 1:
+            msgs = [await bot_instance.send_photo(chat_id=chat_id, photo=self.photos[0].media())]
+        else:
+            msgs = await bot_instance.send_media_group(
+                chat_id=chat_id,
+                media=[InputMediaPhoto(p.media()) for p in self.photos],
+            )
+        await self._remember(msgs)
+        return msgs
+
+    async def _remember(self, msgs):
+        for photo, msg in zip(self.photos, msgs):
+            if photo.file_id or not msg.photo:
+                continue
+            photo.file_id = msg.photo[-1].file_id
+            if photo.on_cached:
+                await sync_to_async(photo.on_cached)(photo.file_id)
+
+
+async def _send_async(bot_instance, user_id, text, markup=None, photos=None, text_after_media=None, state=None):
+    if photos:
+        if not isinstance(photos, PhotoSet):
+            photos = PhotoSet(CachedPhoto(path) for path in photos)
+        await photos.send(bot_instance, user_id, text, markup, text_after_media, state)
     else:
         await bot_instance.send_message(chat_id=user_id, text=text, reply_markup=markup, parse_mode='HTML')
-
-def safe_send_message(chat_id, text, markup=None, photo_paths=None, text_after_media=None):
-    while True:
-        try:
-            asyncio.run(_send_async(bot, chat_id, text, markup, photo_paths, text_after_media))
-            return
-        except RetryAfter as e:
-            logger.warning(f"Rate limited. Sleeping for {e.retry_after} seconds")
-            time.sleep(e.retry_after + 1)
-        except TelegramError as e:
-            logger.error(f"TelegramError: {e}")
-            return
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}")
-            return
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class TextRegistry:
+    """
+    Все .txt из каталога, загруженные в память. Каталог опрашивается по mtime,
+    при изменениях тексты перечитываются и подменяются целиком, одной операцией.
+    """
+
+    def __init__(self, directory, strip=True):
+        self.directory = directory
+        self.strip = strip
+        self._texts = {}
+        self._snapshot = None
+
+    def _scan(self):
+        try:
+            with os.scandir(self.directory) as entries:
+                return {e.name: e.stat().st_mtime_ns for e in entries if e.name.endswith(".txt") and e.is_file()}
+        except FileNotFoundError:
+            return {}
+
+    def _read(self, snapshot):
+        texts = {}
+        for filename in snapshot:
+            with open(os.path.join(self.directory, filename), encoding="utf-8") as f:
+                text = f.read()
+            texts[filename[:-len(".txt")]] = text.strip() if self.strip else text
+        return texts
+
+    def load(self):
+        snapshot = self._scan()
+        texts = self._read(snapshot)
+        # Хендлеры читают self._texts без блокировок: новый словарь подменяется одним присваиванием
+        self._texts, self._snapshot = texts, snapshot
+        logger.info(f"📚 Загружено текстов: {len(texts)} из {self.directory}")
+
+    def get(self, name, default=None):
+        return self._texts.get(name, default)
+
+    async def watch(self, interval=5):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                snapshot = await asyncio.to_thread(self._scan)
+                if snapshot != self._snapshot:
+                    texts = await asyncio.to_thread(self._read, snapshot)
+                    self._texts, self._snapshot = texts, snapshot
+                    logger.info(f"♻️ Тексты в {self.directory} изменились — перечитаны")
+            except Exception:
+                logger.exception(f"Не удалось перечитать тексты из {self.directory}")
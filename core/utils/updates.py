@@ -0,0 +1,149 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+
+import redis
+from redis import asyncio as aioredis
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY_PREFIX = "crm:bot_updates:"
+
+# Для семафора PTB в process_update: настоящий лимит ChatOrderedProcessor держит сам
+UNLIMITED = 2 ** 31
+
+
+class _ChatQueue:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка апдейтов (до ``limit`` одновременно), но апдейты
+    одного чата идут строго по очереди: пока один пользователь ждёт загрузку файла,
+    клики остальных обрабатываются.
+
+    Всё делается в do_process_update. Общий семафор PTB (он берётся в process_update до вызова
+    do_process_update) не ограничивает: слот своего лимита апдейт получает, только когда подошла
+    очередь его чата, иначе ждущие апдейты одного чата заняли бы все слоты.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(UNLIMITED)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._running = 0
+        self._chats = {}
+        self._waiting = {}
+        self._max_wait = 0.0
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        key = object()
+        self._waiting[key] = time.monotonic()
+        try:
+            if chat is None:
+                await self._run(key, coroutine)
+                return
+            # Очередь чата занимается синхронно, до первого await: порядок задач = порядок апдейтов
+            queue = self._chats.get(chat.id)
+            if queue is None:
+                queue = self._chats[chat.id] = _ChatQueue()
+            queue.depth += 1
+            try:
+                async with queue.lock:
+                    await self._run(key, coroutine)
+            finally:
+                queue.depth -= 1
+                if not queue.depth:
+                    del self._chats[chat.id]
+        finally:
+            self._waiting.pop(key, None)
+
+    async def _run(self, key, coroutine):
+        async with self._slots:
+            waited = time.monotonic() - self._waiting.pop(key)
+            self._max_wait = max(self._max_wait, waited)
+            self._running += 1
+            try:
+                await coroutine
+            finally:
+                self._running -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self, top=10):
+        """Снимок для мониторинга; max_wait — наибольшее ожидание с прошлого снимка."""
+        now = time.monotonic()
+        queues = sorted(
+            ({"chat_id": chat_id, "depth": q.depth} for chat_id, q in self._chats.items() if q.depth > 1),
+            key=lambda q: q["depth"],
+            reverse=True,
+        )
+        stats = {
+            "max_concurrent": self.limit,
+            "current": self._running,
+            "waiting": len(self._waiting),
+            "longest_wait": round(now - min(self._waiting.values()), 3) if self._waiting else 0.0,
+            "max_wait": round(self._max_wait, 3),
+            "queued_chats": len(queues),
+            "queues": queues[:top],
+        }
+        self._max_wait = 0.0
+        return stats
+
+
+async def publish_stats(processor, bot_name, url, interval=5):
+    """Раз в ``interval`` секунд кладёт stats() процессора в Redis, откуда их читает страница мониторинга."""
+    key = f"{STATS_KEY_PREFIX}{bot_name}:{socket.gethostname()}:{os.getpid()}"
+    conn = aioredis.from_url(url)
+    while True:
+        try:
+            stats = {"bot": bot_name, "pid": os.getpid(), **processor.stats()}
+            if stats["queued_chats"] or stats["longest_wait"] > interval:
+                logger.warning(f"⏳ Очередь апдейтов {bot_name}: {stats}")
+            await conn.set(key, json.dumps(stats), ex=interval * 3)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Не удалось опубликовать статистику апдейтов")
+        await asyncio.sleep(interval)
+
+
+def read_stats(url):
+    """Статистика всех живых процессов ботов (ключи с истёкшим TTL уже удалены Redis)."""
+    try:
+        conn = redis.Redis.from_url(url)
+        keys = sorted(conn.scan_iter(f"{STATS_KEY_PREFIX}*"))
+        return [json.loads(raw) for raw in conn.mget(keys) if raw] if keys else []
+    except redis.RedisError:
+        logger.exception("Не удалось прочитать статистику апдейтов")
+        return []
+
+
+def start_background(app, name, coro):
+    """Фоновая задача бота (наблюдатели, подписки, статистика): живёт до post_shutdown, см. stop_background."""
+    app.bot_data.setdefault("background", {})[name] = asyncio.create_task(coro, name=name)
+
+
+async def stop_background(app):
+    """Отменяет фоновые задачи бота и дожидается их: после остановки не остаётся задач и соединений с Redis."""
+    tasks = list(app.bot_data.pop("background", {}).values())
+    for task in tasks:
+        task.cancel()
+    for name, result in zip([t.get_name() for t in tasks], await asyncio.gather(*tasks, return_exceptions=True)):
+        if isinstance(result, Exception):
+            logger.error(f"Фоновая задача {name} завершилась с ошибкой: {result!r}")
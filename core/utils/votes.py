@@ -0,0 +1,99 @@
+from django.db import connection
+from django.utils import timezone
+
+from core.models import BroadcastAudio, BroadcastMessage, BroadcastVote, BroadcastVoteTally
+from core.utils.client_cache import publish
+
+# Канал, через который админка и конвертер аудио сообщают боту об изменённых аудио рассылки
+AUDIO_INVALIDATE_CHANNEL = "crm:broadcastaudio:invalidate"
+
+
+def publish_audio_invalidation(broadcast_id):
+    """Бот выкидывает аудио рассылки из своего кэша и перечитывает их при следующем голосе."""
+    publish(AUDIO_INVALIDATE_CHANNEL, broadcast_id)
+
+
+def record_vote(client_id, broadcast_id, choice, voice_file=None):
+    """
+    Голос и счётчик варианта одним запросом: вставка голоса идемпотентна (повторное нажатие
+    ничего не вставляет), счётчик увеличивается только если голос действительно вставлен.
+    Возвращает True, если голос записан впервые.
+    """
+    vote = BroadcastVote._meta.db_table
+    message = BroadcastMessage._meta.db_table
+    tally = BroadcastVoteTally._meta.db_table
+    sql = f"""
+        WITH vote AS (
+            INSERT INTO {vote} (message_id, client_id, choice_number, voice_file, created_at)
+            SELECT m.id, %s, %s, %s, %s FROM {message} m WHERE m.id = %s
+            ON CONFLICT (message_id, client_id) DO NOTHING
+            RETURNING message_id, choice_number
+        )
+        INSERT INTO {tally} AS t (message_id, choice_number, votes)
+        SELECT message_id, choice_number, 1 FROM vote
+        ON CONFLICT (message_id, choice_number) DO UPDATE SET votes = t.votes + 1
+        RETURNING votes
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [client_id, choice, voice_file, timezone.now(), broadcast_id])
+        return cursor.fetchone() is not None
+
+
+def reconcile_vote_tallies():
+    """
+    Сверяет счётчики с самими голосами и исправляет расхождения (например, после удаления голосов
+    вместе с клиентом). Пишется не пересчитанное значение, а разница: голоса и счётчики читаются
+    из одного снимка, и «votes = t.votes + разница» не теряет инкременты record_vote, закоммиченные
+    после снимка. Возвращает число исправленных строк.
+    """
+    vote = BroadcastVote._meta.db_table
+    tally = BroadcastVoteTally._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH diff AS (
+                SELECT COALESCE(c.message_id, s.message_id) AS message_id,
+                       COALESCE(c.choice_number, s.choice_number) AS choice_number,
+                       COALESCE(c.n, 0) - COALESCE(s.votes, 0) AS delta,
+                       s.id IS NULL AS missing
+                FROM (
+                    SELECT message_id, choice_number, COUNT(*) AS n FROM {vote} GROUP BY message_id, choice_number
+                ) c
+                FULL JOIN {tally} s ON s.message_id = c.message_id AND s.choice_number = c.choice_number
+                WHERE COALESCE(c.n, 0) <> COALESCE(s.votes, 0)
+            ),
+            updated AS (
+                UPDATE {tally} t SET votes = t.votes + d.delta
+                FROM diff d
+                WHERE NOT d.missing AND t.message_id = d.message_id AND t.choice_number = d.choice_number
+                RETURNING 1
+            ),
+            inserted AS (
+                INSERT INTO {tally} AS t (message_id, choice_number, votes)
+                SELECT message_id, choice_number, delta FROM diff WHERE missing
+                ON CONFLICT (message_id, choice_number) DO UPDATE SET votes = t.votes + EXCLUDED.votes
+                RETURNING 1
+            )
+            SELECT (SELECT COUNT(*) FROM updated) + (SELECT COUNT(*) FROM inserted)
+        """)
+        return cursor.fetchone()[0]
+
+
+def vote_results(message_id):
+    """Итоги голосования рассылки из счётчиков — без подсчёта самих голосов."""
+    counts = dict(BroadcastVoteTally.objects.filter(message_id=message_id).values_list("choice_number", "votes"))
+    # Варианты без голосов тоже показываем — с нулём
+    for choice in BroadcastAudio.objects.filter(message_id=message_id).values_list("choice_number", flat=True):
+        counts.setdefault(choice, 0)
+    total = sum(counts.values())
+    return {
+        "broadcast": message_id,
+        "total": total,
+        "choices": [
+            {
+                "choice_number": choice,
+                "votes": votes,
+                "percent": round(votes * 100 / total, 1) if total else 0.0,
+            }
+            for choice, votes in sorted(counts.items())
+        ],
+    }
@@ -2,7 +2,10 @@ from django.shortcuts import render
 from django.http import JsonResponse
 from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
 from .models import TelegramClient
+from .utils import rollups
+from .utils.updates import read_stats
 import json
 import psutil
 import datetime
@@ -12,6 +15,13 @@ import time
 def monitoring_page(request):
     return render(request, 'admin/monitoring.html')
 
+@staff_member_required
+def analytics_page(request):
+    """Воронка и активность клиентов — читается только из агрегатов core.utils.rollups, не из журнала."""
+    days = request.GET.get("days", "30")
+    days = int(days) if days in ("7", "30", "90", "365") else 30
+    return render(request, 'admin/analytics.html', rollups.report(days, request.GET.get("bot")))
+
 @staff_member_required
 def metrics_api(request):
     cpu = psutil.cpu_percent()
@@ -79,6 +89,7 @@ def metrics_api(request):
         "disk_percent": disk_percent,
         "io_read_mb": io_read_mb,
         "io_write_mb": io_write_mb,
+        "bot_updates": read_stats(settings.BOT_STATS_REDIS_URL),
     })
 
 
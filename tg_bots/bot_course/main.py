@@ -14,9 +14,12 @@ from telegram.ext import (
 import logging
 from dotenv import load_dotenv
 import os
+from functools import cache
 
-from core.models import TelegramClient
-from asgiref.sync import sync_to_async
+from core.utils.clients import ClientUpserter
+from core.utils.texts import TextRegistry
+from core.utils.updates import start_background, stop_background
+from django.conf import settings
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -28,6 +31,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+TEXTS = TextRegistry(os.path.dirname(__file__), strip=False)
+UPSERTS = ClientUpserter('public', window=settings.CLIENT_UPSERT_WINDOW)
+
+# Клавиатуры PTB неизменяемы — каждая собирается один раз и дальше переиспользуется
+@cache
 def main_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [
@@ -40,36 +48,22 @@ def main_menu() -> InlineKeyboardMarkup:
         ],
     ])
 
+@cache
 def flow_keyboard():
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("🔮 В поток", url="https://t.me/soul_evolucion")]
     ])
 
 def read_greeting_text() -> str:
-    base_dir = os.path.dirname(__file__)
-    path = os.path.join(base_dir, 'greeting.txt')
-    try:
-        with open(path, 'r', encoding='utf-8') as f:
-            return f.read()
-    except Exception as e:
-        logger.error(f"Ошибка при чтении greeting.txt: {e}")
+    text = TEXTS.get('greeting')
+    if text is None:
+        logger.error("Ошибка при чтении greeting.txt: файл не найден")
         return "Произошла ошибка при загрузке текста приветствия."
-
-@sync_to_async
-def save_telegram_user(user):
-    TelegramClient.objects.get_or_create(
-        user_id=user.id,
-        defaults={
-            'username': user.username,
-            'first_name': user.first_name,
-            'last_name': user.last_name,
-            'bot_source': 'public',
-        }
-    )
+    return text
 
 async def start(update: Update, context: CallbackContext) -> None:
     user = update.message.from_user
-    await save_telegram_user(user)
+    await UPSERTS.upsert(user)
 
     text = update.message.text or ""
     args = text.split()
@@ -129,10 +123,21 @@ async def error_handler(update: object, context: CallbackContext) -> None:
             "⚠️ Произошла ошибка. Попробуйте снова."
         )
 
-def main() -> None:
+async def post_init(application: Application) -> None:
+    TEXTS.load()
+    start_background(application, 'text_watcher', TEXTS.watch())
+
+async def post_shutdown(application: Application) -> None:
+    await stop_background(application)
+
+def build_application() -> Application:
     application = Application.builder().token(
         os.getenv('TELEGRAM_BOT_TOKEN')
-    ).build()
+    ).base_url(
+        f"{settings.TELEGRAM_API_URL}/bot"
+    ).base_file_url(
+        f"{settings.TELEGRAM_API_URL}/file/bot"
+    ).post_init(post_init).post_shutdown(post_shutdown).build()
 
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CallbackQueryHandler(handle_main_menu))
@@ -140,7 +145,10 @@ def main() -> None:
         MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text)
     )
     application.add_error_handler(error_handler)
+    return application
 
+def main() -> None:
+    application = build_application()
     logger.info("Бот запущен...")
     application.run_polling()
 
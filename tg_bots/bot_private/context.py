@@ -0,0 +1,14 @@
+from django.conf import settings
+from telegram.ext import CallbackContext, ExtBot
+
+from core.utils.client_cache import ClientCache
+
+CLIENTS = ClientCache(maxsize=settings.CLIENT_CACHE_SIZE, ttl=settings.CLIENT_CACHE_TTL)
+
+
+class ClientContext(CallbackContext[ExtBot, dict, dict, dict]):
+    """Контекст хендлеров приватного бота: клиент текущего апдейта берётся из кэша процесса."""
+
+    async def get_client(self, user_id):
+        """Клиент по id пользователя апдейта (update.effective_user.id); None — клиента ещё нет в БД."""
+        return await CLIENTS.get(user_id)
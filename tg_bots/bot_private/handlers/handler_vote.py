@@ -1,102 +1,176 @@
 from telegram import Update, InputFile
-from telegram.ext import ContextTypes
+from telegram.error import BadRequest
 from asgiref.sync import sync_to_async
+from cachetools import TTLCache
+from contextlib import asynccontextmanager
+import asyncio
 import logging
 import os
+import time
 
-from core.models import TelegramClient, BroadcastMessage, BroadcastVote, BroadcastAudio
+from core.models import BroadcastMessage, BroadcastAudio
+from core.utils.client_cache import listen_channel
+from core.utils.telegram import is_bad_file_id
+from core.utils.votes import AUDIO_INVALIDATE_CHANNEL, record_vote
+from tg_bots.bot_private.context import ClientContext
 
 logger = logging.getLogger(__name__)
 
-@sync_to_async
-def get_vote_info(user_id, vote_key):
+# Аудио рассылок по broadcast_id: {choice_number: BroadcastAudio}, None — рассылки нет.
+# Объекты общие для всех хендлеров, поэтому сохранённый file_id сразу виден следующим голосам.
+# Сохранение BroadcastAudio (в админке или после конвертации) сбрасывает запись через Redis.
+AUDIOS = TTLCache(maxsize=256, ttl=60)
+# Пока file_id аудио неизвестен, mp3 загружает один голос, остальные ждут его и шлют уже по id.
+# {audio.pk: [лок, сколько голосов его держат или ждут]} — запись удаляется, когда уходит последний
+UPLOAD_LOCKS = {}
+
+
+@asynccontextmanager
+async def _upload_lock(audio_pk):
+    entry = UPLOAD_LOCKS.setdefault(audio_pk, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del UPLOAD_LOCKS[audio_pk]
+
+
+def parse_vote_key(vote_key):
     parts = vote_key.split(":")
     if len(parts) != 3 or parts[0] != "vote":
-        return None, None, None, "⚠️ Неверный формат callback."
-
+        raise ValueError("⚠️ Неверный формат callback.")
     try:
-        choice = int(parts[1])
-        broadcast_id = int(parts[2])
+        return int(parts[1]), int(parts[2])
     except ValueError:
-        return None, None, None, "⚠️ Ошибка разбора номера."
+        raise ValueError("⚠️ Ошибка разбора номера.")
 
-    client = TelegramClient.objects.filter(user_id=user_id).first()
-    if not client:
-        return None, None, None, "⚠️ Клиент не найден."
 
-    broadcast = BroadcastMessage.objects.filter(id=broadcast_id).first()
-    if not broadcast:
-        return None, None, None, "⚠️ Рассылка не найдена."
+def _load_audios(broadcast_id):
+    broadcast = BroadcastMessage.objects.filter(id=broadcast_id).prefetch_related("audios").first()
+    if broadcast is None:
+        return None
+    return {audio.choice_number: audio for audio in broadcast.audios.all()}
 
-    already = BroadcastVote.objects.filter(message=broadcast, client=client).exists()
-    if already:
-        return None, None, None, "Вы уже получили послание 🙅"
 
-    audio = BroadcastAudio.objects.filter(message=broadcast, choice_number=choice).first()
-    return client, broadcast, audio, None
+async def get_broadcast_audios(broadcast_id, choice):
+    audios = AUDIOS.get(broadcast_id)
+    # Варианта или его mp3 нет в кэше — возможно, аудио добавили или сконвертировали после загрузки: перечитываем
+    if audios is None or choice not in audios or not audios[choice].mp3_file:
+        audios = AUDIOS[broadcast_id] = await sync_to_async(_load_audios)(broadcast_id)
+    return audios
 
-@sync_to_async
-def save_vote(client, broadcast, choice, audio):
-    BroadcastVote.objects.create(
-        client=client,
-        message=broadcast,
-        choice_number=choice,
-        voice_file=audio.file if audio else None
-    )
-
-async def handle_vote_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
 
+async def listen_audio_invalidations(url):
+    await listen_channel(url, AUDIO_INVALIDATE_CHANNEL, lambda data: AUDIOS.pop(int(data), None), AUDIOS.clear)
+
+
+async def _delete_keyboard(query):
+    try:
+        await query.delete_message()
+    except Exception:
+        pass
+
+
+async def handle_vote_callback(update: Update, context: ClientContext):
+    started = time.monotonic()
+    query = update.callback_query
     user_id = query.from_user.id
+    chat_id = query.message.chat_id
     vote_key = query.data
     logger.info(f"[VOTE DEBUG] callback_data={vote_key}, user_id={user_id}")
 
-    client, broadcast, audio, error = await get_vote_info(user_id, vote_key)
+    error = None
+    try:
+        choice, broadcast_id = parse_vote_key(vote_key)
+    except ValueError as e:
+        error = str(e)
+        await query.answer()
+    else:
+        _, client, audios = await asyncio.gather(query.answer(), context.get_client(user_id), get_broadcast_audios(broadcast_id, choice))
+        if not client:
+            error = "⚠️ Клиент не найден."
+        elif audios is None:
+            error = "⚠️ Рассылка не найдена."
+        else:
+            audio = audios.get(choice)
+            if not await sync_to_async(record_vote)(client.pk, broadcast_id, choice, audio.file.name if audio else None):
+                error = "Вы уже получили послание 🙅"
 
     if error:
         logger.warning(f"Ошибка голосования от user {user_id}: {error}")
-        try:
-            await query.delete_message()
-        except Exception:
-            pass
-        await context.bot.send_message(chat_id=query.message.chat_id, text=error)
+        await asyncio.gather(_delete_keyboard(query), context.bot.send_message(chat_id=chat_id, text=error))
         return
 
-    await save_vote(client, broadcast, int(vote_key.split(":")[1]), audio)
+    # Удаляем исходное сообщение с кнопками и одновременно отправляем аудио
+    if audio and audio.mp3_file:
+        reply = send_vote_audio(context.bot, chat_id, audio)
+    else:
+        reply = context.bot.send_message(chat_id=chat_id, text="✅ Голос принят, но аудио не найдено.")
+    await asyncio.gather(_delete_keyboard(query), reply)
+    logger.info(f"⏱ Голос user {user_id} за рассылку #{broadcast_id} обработан за {(time.monotonic() - started) * 1000:.0f} мс")
+
+def _audio_filename(audio, mp3_path):
+    # Используется только то имя, что указано в custom_filename (даже без .mp3), если оно есть.
+    if audio.custom_filename:
+        return audio.custom_filename
+    if mp3_path:
+        return os.path.basename(mp3_path)
+    return None
 
-    # Удаляем исходное сообщение с кнопками
-    try:
-        await query.delete_message()
-    except Exception:
-        pass
+@sync_to_async
+def remember_audio_file_id(audio, file_id, filename):
+    BroadcastAudio.objects.filter(pk=audio.pk).update(telegram_file_id=file_id, telegram_filename=filename)
+    audio.telegram_file_id = file_id
+    audio.telegram_filename = filename
 
+async def _send_by_file_id(bot, chat_id, audio, caption):
+    """Отправка по сохранённому file_id; False — Telegram его отклонил и mp3 надо загрузить заново."""
+    try:
+        await bot.send_audio(chat_id=chat_id, audio=audio.telegram_file_id, caption=caption, parse_mode="HTML")
+        return True
+    except BadRequest as e:
+        if not is_bad_file_id(e):
+            raise
+        logger.warning(f"♻️ Telegram отклонил file_id аудио #{audio.pk}: {e} — загружаем заново")
+        return False
+
+async def send_vote_audio(bot, chat_id, audio):
+    caption = audio.caption or "✅ Ваш голос учтён. Спасибо!"
     mp3_path = None
-    if audio and audio.mp3_file and audio.mp3_file.name:
+    if audio.mp3_file.name:
         try:
             mp3_path = audio.mp3_file.path
         except ValueError:
             mp3_path = None
-    if audio and audio.mp3_file:
-        # >>> Главное отличие здесь <<<
-        # Используется только то имя, что указано в custom_filename (даже без .mp3), если оно есть.
-        if audio.custom_filename:
-            filename = audio.custom_filename
-        elif mp3_path:
-            filename = os.path.basename(mp3_path)
-        else:
-            filename = None
+    filename = _audio_filename(audio, mp3_path)
+
+    # Уже загруженный mp3 отправляем по file_id, если с тех пор не поменялось имя файла
+    used = None
+    if audio.telegram_file_id and audio.telegram_filename == filename:
+        used = audio.telegram_file_id
+        if await _send_by_file_id(bot, chat_id, audio, caption):
+            return
+
+    async with _upload_lock(audio.pk):
+        # Пока ждали лок, mp3 мог загрузить другой голос — тогда шлём по его file_id
+        if audio.telegram_file_id and audio.telegram_filename == filename and audio.telegram_file_id != used:
+            if await _send_by_file_id(bot, chat_id, audio, caption):
+                return
+
         exists_flag = os.path.exists(mp3_path) if mp3_path else False
         logger.info(f"📎 Отправка mp3-аудио: {mp3_path}, exists={exists_flag}, filename={filename}")
-        if mp3_path and os.path.exists(mp3_path):
-            with open(mp3_path, "rb") as f:
-                await context.bot.send_audio(
-                    chat_id=query.message.chat_id,
-                    audio=InputFile(f, filename=filename),
-                    caption=audio.caption or "✅ Ваш голос учтён. Спасибо!",
-                    parse_mode="HTML"
-                )
-        else:
-            await context.bot.send_message(chat_id=query.message.chat_id, text="⚠️ mp3-файл не найден.")
-    else:
-        await context.bot.send_message(chat_id=query.message.chat_id, text="✅ Голос принят, но аудио не найдено.")
+        if not exists_flag:
+            await bot.send_message(chat_id=chat_id, text="⚠️ mp3-файл не найден.")
+            return
+        with open(mp3_path, "rb") as f:
+            msg = await bot.send_audio(
+                chat_id=chat_id,
+                audio=InputFile(f, filename=filename),
+                caption=caption,
+                parse_mode="HTML"
+            )
+        if msg.audio:
+            await remember_audio_file_id(audio, msg.audio.file_id, filename)
@@ -2,6 +2,7 @@ import os
 import logging
 import re
 from datetime import datetime
+from functools import cache
 from pathlib import Path
 from typing import Optional
 from asgiref.sync import sync_to_async
@@ -12,7 +13,6 @@ from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
-    InputMediaPhoto,
     InputFile,
     Message,
 )
@@ -25,8 +25,15 @@ from telegram.ext import (
     filters,
 )
 
-from core.models import TelegramClient, ClientAction, SupportMessage, PaymentUpload, BroadcastMessage
-from tg_bots.bot_private.handlers.handler_vote import handle_vote_callback
+from core.models import SupportMessage, PaymentUpload, BroadcastMessage
+from tg_bots.bot_private.handlers.handler_vote import handle_vote_callback, listen_audio_invalidations
+from tg_bots.bot_private.media_cache import MediaGalleries
+from tg_bots.bot_private.context import CLIENTS, ClientContext
+from core.utils.actions import ActionRecorder
+from core.utils.clients import ClientUpserter
+from core.utils.updates import ChatOrderedProcessor, publish_stats, start_background, stop_background
+from core.utils.texts import TextRegistry
+from django.conf import settings
 from django.core.files.base import ContentFile
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
@@ -36,6 +43,18 @@ ABOUT_MEDIA_DIR = BASE_DIR / "tg_bots" / "bot_private" / "media" / "about"
 TRANSFORM_FEEDBACK_MEDIA_DIR = BASE_DIR / "tg_bots" / "bot_private" / "media" / "transform_feedback"
 UPLOADS_ROOT = BASE_DIR / "media" / "uploads"
 
+TEXTS = TextRegistry(TEXT_DIR)
+ACTIONS = ActionRecorder(
+    settings.ACTION_LOG_SPOOL,
+    batch_size=settings.ACTION_LOG_BATCH_SIZE,
+    interval=settings.ACTION_LOG_FLUSH_INTERVAL_MS / 1000,
+)
+UPSERTS = ClientUpserter("private", window=settings.CLIENT_UPSERT_WINDOW)
+GALLERIES = MediaGalleries(BASE_DIR, {
+    "about": [ABOUT_MEDIA_DIR / f"about{i}.jpg" for i in range(1, 8)],
+    "reviews": [REVIEW_MEDIA_DIR / f"re{i}.jpg" for i in range(1, 9)],
+})
+
 log_path = BASE_DIR / "logs" / "bot.log"
 logging.basicConfig(
     handlers=[logging.FileHandler(log_path)],
@@ -46,11 +65,10 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 def load_text(name: str) -> str:
-    try:
-        return (TEXT_DIR / f"{name}.txt").read_text(encoding="utf-8").strip()
-    except FileNotFoundError:
-        return f"[текст '{name}' не найден]"
+    return TEXTS.get(name, f"[текст '{name}' не найден]")
 
+# Клавиатуры PTB неизменяемы — каждая собирается один раз и дальше переиспользуется
+@cache
 def main_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("Подробнее о канале 🐇", callback_data="about")],
@@ -61,6 +79,7 @@ def main_menu() -> InlineKeyboardMarkup:
         [InlineKeyboardButton("Задать вопрос ❔", callback_data="support")],
     ])
 
+@cache
 def transform_menu(include_detail: bool = True) -> InlineKeyboardMarkup:
     buttons = []
     if include_detail:
@@ -69,11 +88,13 @@ def transform_menu(include_detail: bool = True) -> InlineKeyboardMarkup:
     buttons.append([InlineKeyboardButton("⬅️ На главную", callback_data="main")])
     return InlineKeyboardMarkup(buttons)
 
+@cache
 def transform_go_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("⬅️ Назад", callback_data="transform")],
     ])
 
+@cache
 def about_menu(include_reviews: bool = True) -> InlineKeyboardMarkup:
     buttons = []
     if include_reviews:
@@ -82,6 +103,7 @@ def about_menu(include_reviews: bool = True) -> InlineKeyboardMarkup:
     buttons.append([InlineKeyboardButton("⬅️ На главную", callback_data="main")])
     return InlineKeyboardMarkup(buttons)
 
+@cache
 def payment_menu(exclude: Optional[str] = None) -> InlineKeyboardMarkup:
     buttons = []
     if exclude != "pay_tg":
@@ -91,17 +113,10 @@ def payment_menu(exclude: Optional[str] = None) -> InlineKeyboardMarkup:
     buttons.append([InlineKeyboardButton("⬅️ На главную", callback_data="main")])
     return InlineKeyboardMarkup(buttons)
 
+@cache
 def back_to_main() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ На главную", callback_data="main")]])
 
-@sync_to_async
-def get_client(user_id):
-    return TelegramClient.objects.filter(user_id=user_id).first()
-
-@sync_to_async
-def create_client_action(client, action):
-    return ClientAction.objects.create(client=client, action=action)
-
 @sync_to_async
 def create_support_message(client, message):
     return SupportMessage.objects.create(client=client, message=message)
@@ -117,51 +132,30 @@ def create_payment_upload(client, f, filename):
 def get_main_broadcast():
     return BroadcastMessage.objects.filter(comment="Послание для меню").first()
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def start(update: Update, context: ClientContext):
     user = update.effective_user
     await update.message.reply_text(load_text("main"), reply_markup=main_menu(), parse_mode="HTML")
-    await sync_to_async(TelegramClient.objects.get_or_create)(user_id=user.id, defaults={
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name,
-        "bot_source": "private",
-    })
-    client = await get_client(user.id)
-    if client:
-        await create_client_action(client, "start_private")
+    client = await UPSERTS.upsert(user)
+    CLIENTS.put(client)
+    ACTIONS.record(client, "start_private")
 
-async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_main_menu(update: Update, context: ClientContext):
     query = update.callback_query
     await query.answer()
-    user = query.from_user
     data = query.data
-    client = await get_client(user.id)
+    client = await context.get_client(query.from_user.id)
     if client:
-        await create_client_action(client, f"clicked_{data}")
+        ACTIONS.record(client, f"clicked_{data}")
 
     if data == "about":
-        media = []
-        for i in range(1, 8):
-            path = ABOUT_MEDIA_DIR / f"about{i}.jpg"
-            if path.exists():
-                with open(path, "rb") as f:
-                    media.append(InputMediaPhoto(f.read()))
-        if media:
-            await context.bot.send_media_group(chat_id=query.message.chat_id, media=media)
+        await GALLERIES.send(context.bot, query.message.chat_id, "about")
         await query.message.reply_text(load_text("about"), reply_markup=about_menu(), parse_mode="HTML")
     elif data == "payment":
         await query.message.reply_text(load_text("payment"), reply_markup=payment_menu(), parse_mode="HTML")
     elif data == "support":
         await query.message.reply_text(load_text("support"), reply_markup=back_to_main(), parse_mode="HTML")
     elif data == "reviews":
-        media = []
-        for i in range(1, 9):
-            path = REVIEW_MEDIA_DIR / f"re{i}.jpg"
-            if path.exists():
-                with open(path, "rb") as f:
-                    media.append(InputMediaPhoto(f.read()))
-        if media:
-            await context.bot.send_media_group(chat_id=query.message.chat_id, media=media)
+        await GALLERIES.send(context.bot, query.message.chat_id, "reviews")
         await query.message.reply_text("🌟 Обратная связь подписчиков 🌟", reply_markup=about_menu(False), parse_mode="HTML")
     elif data == "pay_tg":
         await query.message.reply_text(load_text("payment_trib"), reply_markup=payment_menu("pay_tg"), parse_mode="HTML")
@@ -194,17 +188,16 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode="HTML"
         )
 
-async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
+async def handle_text(update: Update, context: ClientContext):
     txt = update.message.text.strip()
-    client = await get_client(user.id)
+    client = await context.get_client(update.effective_user.id)
     if client:
         await create_support_message(client, txt)
-        await create_client_action(client, f"support_message: {txt}")
+        ACTIONS.record(client, f"support_message: {txt}")
     await update.message.reply_text("✅ Вопрос получен. Мы свяжемся с вами в личных сообщениях.",
                                     reply_markup=main_menu(), parse_mode="HTML")
 
-async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_media(update: Update, context: ClientContext):
     message: Message = update.message
     user = message.from_user
     file_id = message.document.file_id if message.document else message.photo[-1].file_id
@@ -220,11 +213,11 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     filepath = user_dir / filename
     await tg_file.download_to_drive(custom_path=str(filepath))
 
-    client = await get_client(user.id)
+    client = await context.get_client(user.id)
     if client:
         with open(filepath, "rb") as f:
             await create_payment_upload(client, f, filename)
-        await create_client_action(client, f"uploaded_payment: {filename}")
+        ACTIONS.record(client, f"uploaded_payment: {filename}")
 
     await update.message.reply_text("✅ Чек получен. Проверим и добавим в канал.", parse_mode="HTML")
 
@@ -233,14 +226,45 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     if hasattr(update, "effective_message") and update.effective_message:
         await update.effective_message.reply_text("⚠️ Произошла ошибка. Попробуйте снова.")
 
-def main():
-    app = ApplicationBuilder().token(os.getenv("TELEGRAM_BOT_TOKEN_PRIVATE")).build()
+async def post_init(app):
+    ACTIONS.start()
+    TEXTS.load()
+    start_background(app, "text_watcher", TEXTS.watch())
+    await sync_to_async(GALLERIES.load)()
+    cache_chat_id = os.getenv("TELEGRAM_MEDIA_CACHE_CHAT_ID")
+    if cache_chat_id:
+        await GALLERIES.warm_up(app.bot, int(cache_chat_id))
+    start_background(app, "media_watcher", GALLERIES.watch())
+    start_background(app, "client_invalidations", CLIENTS.listen(settings.CLIENT_CACHE_REDIS_URL))
+    start_background(app, "audio_invalidations", listen_audio_invalidations(settings.CLIENT_CACHE_REDIS_URL))
+    start_background(app, "update_stats", publish_stats(app.update_processor, "private", settings.BOT_STATS_REDIS_URL))
+
+async def post_shutdown(app):
+    await stop_background(app)
+    await ACTIONS.close()
+
+def build_application():
+    app = (
+        ApplicationBuilder()
+        .token(os.getenv("TELEGRAM_BOT_TOKEN_PRIVATE"))
+        .base_url(f"{settings.TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{settings.TELEGRAM_API_URL}/file/bot")
+        .context_types(ContextTypes(context=ClientContext))
+        .concurrent_updates(ChatOrderedProcessor(settings.BOT_CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CallbackQueryHandler(handle_vote_callback, pattern=r"^vote:"))
     app.add_handler(CallbackQueryHandler(handle_main_menu, pattern=r"^(about|payment|support|reviews|pay_tg|pay_card_ru|main|get_message|transform|transform_detail|transform_go)$"))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
     app.add_handler(MessageHandler(filters.PHOTO | filters.Document.IMAGE, handle_media))
     app.add_error_handler(error_handler)
+    return app
+
+def main():
+    app = build_application()
     logger.info("Бот запущен (async)")
     app.run_polling()
 
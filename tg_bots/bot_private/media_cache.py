@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from functools import partial
+
+from asgiref.sync import sync_to_async
+
+from core.models import TelegramMediaFile
+from core.utils.telegram import CachedPhoto, PhotoSet
+
+logger = logging.getLogger(__name__)
+
+
+def _signature(path):
+    st = path.stat()
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+def _save_file_id(rel_path, signature, file_id):
+    TelegramMediaFile.objects.update_or_create(
+        path=rel_path,
+        defaults={"signature": signature, "file_id": file_id},
+    )
+
+
+class MediaGalleries:
+    """
+    Статичные галереи бота: файлы читаются в память при старте, в Telegram загружаются один раз,
+    дальше уходят только по file_id. Id хранятся в TelegramMediaFile и переживают перезапуск;
+    при изменении файлов на диске галерея перечитывается.
+    """
+
+    def __init__(self, base_dir, galleries):
+        self.base_dir = base_dir
+        self.galleries = galleries
+        self._sets = {}
+        self._signatures = {}
+
+    def _scan(self, key):
+        return {path: _signature(path) for path in self.galleries[key] if path.exists()}
+
+    @staticmethod
+    def _read(signatures):
+        return {path: path.read_bytes() for path in signatures}
+
+    def _build(self, signatures, data):
+        rel = {path: str(path.relative_to(self.base_dir)) for path in signatures}
+        known = {row.path: row for row in TelegramMediaFile.objects.filter(path__in=rel.values())}
+        photos = []
+        for path, signature in signatures.items():
+            row = known.get(rel[path])
+            photos.append(CachedPhoto(
+                path,
+                row.file_id if row and row.signature == signature else None,
+                on_cached=partial(_save_file_id, rel[path], signature),
+                data=data[path],
+            ))
+        return PhotoSet(photos) if photos else None
+
+    def load(self):
+        for key in self.galleries:
+            signatures = self._scan(key)
+            self._sets[key] = self._build(signatures, self._read(signatures))
+            self._signatures[key] = signatures
+            cached = sum(1 for p in self._sets[key].photos if p.file_id) if self._sets[key] else 0
+            logger.info(f"🖼 Галерея {key}: {len(signatures)} фото, из них {cached} уже загружены в Telegram")
+
+    async def send(self, bot, chat_id, key):
+        photos = self._sets.get(key)
+        if photos:
+            await photos.send_album(bot, chat_id)
+
+    async def warm_up(self, bot, chat_id):
+        """Загружает ещё не загруженные галереи в служебный чат, чтобы первый клик пользователя уже шёл по file_id."""
+        for key, photos in self._sets.items():
+            if not photos or all(p.file_id for p in photos.photos):
+                continue
+            msgs = await photos.send_album(bot, chat_id)
+            for msg in msgs:
+                try:
+                    await msg.delete()
+                except Exception:
+                    logger.exception(f"Не удалось удалить служебное фото галереи {key} из чата {chat_id}")
+            logger.info(f"🔥 Галерея {key} загружена в Telegram заранее")
+
+    async def watch(self, interval=30):
+        # Диск — в отдельном потоке, чтобы не останавливать event loop; БД — через sync_to_async
+        while True:
+            await asyncio.sleep(interval)
+            for key in self.galleries:
+                try:
+                    signatures = await asyncio.to_thread(self._scan, key)
+                    if signatures != self._signatures.get(key):
+                        data = await asyncio.to_thread(self._read, signatures)
+                        self._sets[key] = await sync_to_async(self._build)(signatures, data)
+                        self._signatures[key] = signatures
+                        logger.info(f"♻️ Галерея {key} изменилась на диске — перечитана")
+                except Exception:
+                    logger.exception(f"Не удалось перечитать галерею {key}")
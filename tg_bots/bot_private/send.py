@@ -1,22 +1,20 @@
-import asyncio
 import logging
-from telegram import Bot
-from django.conf import settings
 
-logger = logging.getLogger(__name__)
+from core.utils import bot_pool
 
-bot = Bot(token=settings.TELEGRAM_BOT_TOKEN_PRIVATE)
+logger = logging.getLogger(__name__)
 
 def send_broadcast_message(broadcast):
-    from asgiref.sync import async_to_sync
-    return async_to_sync(_send_broadcast)(broadcast)
+    chat_ids = list(broadcast.recipients.values_list("user_id", flat=True))
+    return bot_pool.run(_send_broadcast(broadcast.text, chat_ids))
 
-async def _send_broadcast(broadcast):
+async def _send_broadcast(text, chat_ids):
+    bot = await bot_pool.get_bot()
     count = 0
-    for client in broadcast.recipients.all():
+    for chat_id in chat_ids:
         try:
-            await bot.send_message(chat_id=client.user_id, text=broadcast.text)
+            await bot.send_message(chat_id=chat_id, text=text)
             count += 1
         except Exception as e:
-            logger.error(f"Ошибка при отправке {client.user_id}: {e}")
+            logger.error(f"Ошибка при отправке {chat_id}: {e}")
     return count
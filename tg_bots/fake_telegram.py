@@ -0,0 +1,83 @@
+import itertools
+import json
+import time
+
+from django.test import AsyncClient
+from django.urls import reverse
+from telegram.request import BaseRequest
+
+from tg_bots.webhook import SECRET_HEADER
+
+
+def fake_update(update_id, user_id, text=None, callback_data=None):
+    """Апдейт в том виде, в каком его присылает Telegram: сообщение или нажатие inline-кнопки."""
+    user = {"id": user_id, "is_bot": False, "first_name": "Test", "username": f"test_{user_id}"}
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": "Test"},
+        "from": user,
+        "text": text or "",
+    }
+    if text and text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    if callback_data is None:
+        return {"update_id": update_id, "message": message}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": callback_data,
+            "message": message,
+        },
+    }
+
+
+class FakeTelegram:
+    """
+    Сторона Telegram для тестов вебхука: шлёт апдейты в /tg/<bot>/ через ASGI-клиент Django,
+    с секретным заголовком, как это делает Telegram. ``secret=None`` — без заголовка.
+    """
+
+    def __init__(self, bot_name, secret, client=None):
+        self.url = reverse("telegram_webhook", args=[bot_name])
+        self.secret = secret
+        self.client = client or AsyncClient()
+        self._update_ids = itertools.count(int(time.time()))
+
+    async def post(self, payload):
+        headers = {} if self.secret is None else {SECRET_HEADER[len("HTTP_"):].replace("_", "-"): self.secret}
+        return await self.client.post(self.url, json.dumps(payload), content_type="application/json", headers=headers)
+
+    async def send(self, user_id, text=None, callback_data=None):
+        return await self.post(fake_update(next(self._update_ids), user_id, text, callback_data))
+
+
+class FakeBotAPI(BaseRequest):
+    """
+    Bot API без сети — для ``ApplicationBuilder().request(...)`` в тестах: на getMe отвечает
+    пользователем-ботом, остальные вызовы запоминает в ``calls`` и отвечает ``True``.
+    """
+
+    BOT = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+    def __init__(self):
+        self.calls = []
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        name = url.rsplit("/", 1)[-1]
+        self.calls.append((name, request_data.parameters if request_data else {}))
+        result = self.BOT if name == "getMe" else True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
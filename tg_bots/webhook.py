@@ -0,0 +1,119 @@
+import asyncio
+import contextvars
+import hmac
+import json
+import logging
+from importlib import import_module
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, Http404
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Имя бота в URL вебхука → (модуль с build_application(), настройка с токеном)
+BOTS = {
+    "private": ("tg_bots.bot_private.main", "TELEGRAM_BOT_TOKEN_PRIVATE"),
+    "course": ("tg_bots.bot_course.main", "TELEGRAM_BOT_TOKEN"),
+}
+
+SECRET_HEADER = "HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN"
+
+_apps = {}
+_lock = asyncio.Lock()
+
+
+async def _start(app):
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+
+
+async def get_application(name):
+    """
+    PTB Application бота, запущенное в event loop этого воркера (один раз на процесс).
+    Порядок апдейтов одного чата (ChatOrderedProcessor) и кэш клиентов — внутри процесса,
+    поэтому вебхук бота должен обслуживать ровно один ASGI-воркер (uvicorn --workers 1).
+    """
+    if name not in settings.TELEGRAM_WEBHOOK_BOTS or name not in BOTS:
+        return None
+    if name in _apps:
+        return _apps[name]
+    async with _lock:
+        if name not in _apps:
+            app = import_module(BOTS[name][0]).build_application()
+            # Фоновые задачи бота не должны наследовать контекст HTTP-запроса,
+            # в котором их запустили (иначе sync_to_async привяжется к уже завершённому запросу)
+            loop = asyncio.get_running_loop()
+            await loop.create_task(_start(app), context=contextvars.Context())
+            _apps[name] = app
+            logger.info(f"🤖 Бот {name} запущен в режиме вебхука")
+    return _apps[name]
+
+
+async def shutdown_applications():
+    for name, app in list(_apps.items()):
+        try:
+            await app.stop()
+            await app.shutdown()
+            if app.post_shutdown:
+                await app.post_shutdown(app)
+        except Exception:
+            logger.exception(f"Ошибка при остановке бота {name}")
+        del _apps[name]
+
+
+async def telegram_webhook(request, bot_name):
+    """
+    Принимает апдейт от Telegram и кладёт его в очередь Application, не дожидаясь обработки:
+    Telegram сразу получает 200, а хендлеры работают в фоне в том же event loop.
+    """
+    if request.method != "POST":
+        raise Http404
+    secret = settings.TELEGRAM_WEBHOOK_SECRET
+    if not secret or not hmac.compare_digest(request.META.get(SECRET_HEADER, ""), secret):
+        return HttpResponseForbidden()
+    app = await get_application(bot_name)
+    if app is None:
+        raise Http404
+    try:
+        update = Update.de_json(json.loads(request.body), app.bot)
+    except (ValueError, TypeError, KeyError):
+        return HttpResponseBadRequest()
+    await app.update_queue.put(update)
+    return HttpResponse()
+
+
+# csrf_exempt в Django 4.2 превращает async-вью в синхронную обёртку, поэтому флаг ставим напрямую
+telegram_webhook.csrf_exempt = True
+
+
+class TelegramLifespan:
+    """
+    ASGI-обёртка над Django: на lifespan startup поднимает боты из TELEGRAM_WEBHOOK_BOTS,
+    на shutdown останавливает их (и сбрасывает буферы, например журнал действий).
+    Django сам lifespan не обрабатывает.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "lifespan":
+            return await self.app(scope, receive, send)
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    for name in settings.TELEGRAM_WEBHOOK_BOTS:
+                        await get_application(name)
+                except Exception as e:
+                    logger.exception("Не удалось запустить ботов")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await shutdown_applications()
+                await send({"type": "lifespan.shutdown.complete"})
+                return